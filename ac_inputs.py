@@ -1,4 +1,3 @@
-import configparser
 import math
 import os
 import platform
@@ -9,27 +8,48 @@ import numpy as np
 
 from PIL import Image, ImageOps, ImageTk
 
-from sim_info import info
+import sim_info
+from sensors import SensorEngine, gauss_weights
+from centerline import load_centerline
+from content_index import track_paths
+from profiling import timed
+from track_geometry import load_track, read_map_config
 
 # print(info.graphics.tyreCompound, info.physics.rpms, info.static.playerNick)
 
-if platform.architecture()[0] == "64bit":
-    sysdir = "stdlib64"
-else:
-    sysdir = "stdlib"
+_stdlib_ready = False
+_default_info = None
 
-marker_file = "init_done.marker"
 
-if not os.path.exists(marker_file):
-    sys.path.insert(0, os.path.join(os.path.dirname(__file__), sysdir))
-    os.environ['PATH'] = os.environ['PATH'] + ";."
+def setup_stdlib():
+    '''Puts the bundled stdlib on sys.path, once per process.'''
+    global _stdlib_ready
+    if _stdlib_ready:
+        return
+    if platform.architecture()[0] == "64bit":
+        sysdir = "stdlib64"
+    else:
+        sysdir = "stdlib"
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), sysdir)
+    if path not in sys.path:
+        sys.path.insert(0, path)
+        os.environ['PATH'] = os.environ['PATH'] + ";."
+    _stdlib_ready = True
 
-    with open(marker_file, "w") as f:
-        f.write("This system is initialized.")
 
-    print("Initialization completed and marker file created.")
-else:
-    print("Initialization already done. Skipping setup.")
+def default_info():
+    '''The process wide `GetInfo`, created on first use.'''
+    global _default_info
+    if _default_info is None:
+        _default_info = GetInfo()
+    return _default_info
+
+
+def __getattr__(name):
+    # `from ac_inputs import gi` keeps working, without a GetInfo at import time
+    if name == 'gi':
+        return default_info()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def count_info_attributes(cls):
@@ -37,10 +57,112 @@ def count_info_attributes(cls):
 
 
 class GetInfo:
-    def __init__(self) -> None:
-        current_track = self.get_track_attributes()
-        self.map_data = current_track['map_data']
-        self.map_image = current_track['map_image']
+    '''
+    Telemetry and track assets of the running session.
+
+    Track assets (map data, image, geometry, sensors, centerline) are
+    loaded on first use. When `auto_reload` is on, every `freeze` checks
+    whether the track or layout changed and reloads only what differs.
+    '''
+
+    def __init__(self, info=None, auto_reload=True) -> None:
+        setup_stdlib()
+        self.info = sim_info.get_info() if info is None else info
+        self.auto_reload = auto_reload
+        self.thaw()
+        self._track = None
+        self._assets = {}
+        self._map_image = None
+        self._centerline = None
+
+    def freeze(self, snapshot=None):
+        '''
+        Reads every property from one consistent snapshot
+        until the next `freeze` or `thaw`.
+
+        Takes a new snapshot when none is given, returns it.
+        '''
+        if snapshot is None:
+            snapshot = self.info.snapshot()
+        self._physics = snapshot.physics
+        self._graphics = snapshot.graphics
+        self._static = snapshot.static
+        if self.auto_reload:
+            self.check_track()
+        return snapshot
+
+    def thaw(self):
+        '''Goes back to reading live shared memory.'''
+        self._physics = self.info.physics
+        self._graphics = self.info.graphics
+        self._static = self.info.static
+
+    def check_track(self):
+        '''
+        Reloads the track assets when the session moved to another track
+        or layout. Returns the names of the reloaded assets.
+        '''
+        if self._track is None or self._track == tuple(self.track_name):
+            return []
+        return self.reload_track()
+
+    def track_paths(self, track=None):
+        '''Returns (map.png path, map.ini path) of a [track, layout].'''
+        track, layout = self.track_name if track is None else track
+        return track_paths(track, layout)
+
+    def reload_track(self):
+        '''
+        Loads the assets of the current track, keeping the ones that did
+        not change. Returns the names of the reloaded assets.
+
+        Geometry comes from the track cache, so going back to a track
+        loaded before in this process is free.
+        '''
+        track = tuple(self.track_name)
+        map_path, map_data_path = self.track_paths(track)
+        geometry = load_track(map_path, map_data_path, *track)
+        self._track = track
+
+        reloaded = []
+        if geometry is not self._assets.get('geometry'):
+            self._assets = {'geometry': geometry, 'map_path': map_path}
+            self._centerline = None
+            self.prev_sensor_mean_angle = 0
+            reloaded += ['geometry', 'map_data', 'sensor_engine', 'centerline']
+        if self._map_image is not None and self._map_image.filename != map_path:
+            self._map_image = None
+            reloaded.append('map_image')
+        return reloaded
+
+    def _asset(self, name):
+        if self._track is None:
+            self.reload_track()
+        return self._assets[name]
+
+    @ property
+    def geometry(self):
+        return self._asset('geometry')
+
+    @ property
+    def map_data(self):
+        return self.geometry.map_data
+
+    @ property
+    def map_image(self):
+        '''Map image, opened on first use.'''
+        if self._map_image is None:
+            self._map_image = Image.open(self._asset('map_path'))
+        return self._map_image
+
+    @ property
+    def sensor_engine(self):
+        engine = self._assets.get('sensor_engine')
+        if engine is None:
+            geometry = self.geometry
+            engine = SensorEngine(geometry.mask, geometry.map_data, geometry.sdf)
+            self._assets['sensor_engine'] = engine
+        return engine
 
     @ property
     def track_name(self):
@@ -50,17 +172,17 @@ class GetInfo:
 
         [Track, Layout]
         '''
-        return [info.static.track, info.static.trackConfiguration]
+        return [self._static.track, self._static.trackConfiguration]
 
     @ property
     def car_name(self):
         '''Model of the car'''
-        return info.static.carModel
+        return self._static.carModel
 
     @ property
     def auto_shifter_on(self):
         '''Returns if auto shifter is enabled'''
-        return info.physics.autoShifterOn
+        return self._physics.autoShifterOn
 
     @ property
     def wheel_slip(self):
@@ -69,7 +191,7 @@ class GetInfo:
 
         [Front Left, Front Right, Rear Left, Rear Right]
         '''
-        return info.physics.wheelSlip[:]
+        return self._physics.wheelSlip[:]
 
     @ property
     def steer_angle(self):
@@ -78,17 +200,17 @@ class GetInfo:
 
         [-1, 1]
         '''
-        return info.physics.steerAngle
+        return self._physics.steerAngle
 
     @ property
     def speed(self):
         '''Speed in KM/h'''
-        return info.physics.speedKmh
+        return self._physics.speedKmh
 
     @ property
     def wheels_offtrack(self):
         '''Returns the number of wheels that are currently off the track.'''
-        return info.physics.numberOfTyresOut
+        return self._physics.numberOfTyresOut
 
     @ property
     def car_damage(self):
@@ -98,7 +220,7 @@ class GetInfo:
 
         [Front, Rear, Left, Right, Highest Damage]
         '''
-        return info.physics.carDamage[:]
+        return self._physics.carDamage[:]
 
     @ property
     def last_lap(self):
@@ -109,7 +231,7 @@ class GetInfo:
 
         [SSSSsss]
         '''
-        return info.graphics.iLastTime
+        return self._graphics.iLastTime
 
     @ property
     def best_lap(self):
@@ -120,7 +242,7 @@ class GetInfo:
 
         [SSSSsss]
         '''
-        return info.graphics.bestTime
+        return self._graphics.iBestTime
 
     @ property
     def track_completion(self):
@@ -129,7 +251,7 @@ class GetInfo:
 
         Uses track spline.
         '''
-        return info.graphics.normalizedCarPosition
+        return self._graphics.normalizedCarPosition
 
     @ property
     def performance_meter(self):
@@ -137,7 +259,7 @@ class GetInfo:
         Returns the time difference on the current point on track.
         (Negative is better.)
         '''
-        return info.physics.performanceMeter
+        return self._physics.performanceMeter
 
     @ property
     def heading(self):
@@ -146,55 +268,26 @@ class GetInfo:
 
         [-pi, pi]
         '''
-        return info.physics.heading
+        return self._physics.heading
 
     @ property
     def coordinates(self):
         '''Returns [x,y,z]'''
-        return info.graphics.carCoordinates[:]
+        return self._graphics.carCoordinates[:]
 
     def gauss(self, n, sigma=50, range=(0, 1)):
-        r = np.arange(-int(n/2), int(n/2)+1)
-        result = np.array([1 / (sigma * np.sqrt(2*np.pi)) *
-                          np.exp(-float(x)**2/(2*sigma**2)) for x in r])
-        result = (result - min(result)) / (max(result) - min(result))
+        result = gauss_weights(n, sigma)
         if range != (0, 1):
             result = result * (range[1] - range[0]) + range[0]
         return result
 
     def read_map_config(self, path):
-        config = configparser.ConfigParser()
-
-        # Read the .ini file
-        config.read(path)
-        parameters = {}
-        if 'PARAMETERS' in config:
-            for key in config['PARAMETERS']:
-                value = config.get('PARAMETERS', key)
-                if value.isdigit():
-                    parameters[key] = int(value)
-                elif value.replace('.', '', 1).isdigit():
-                    parameters[key] = float(value)
-                else:
-                    parameters[key] = value
-
-        return parameters
+        return read_map_config(path)
 
     def get_track_attributes(self):
-        assetto_corsa_root = 'D:\\SteamLibrary\\steamapps\\common\\assettocorsa\\'
-        tracks_root = 'content\\tracks\\'
-
-        current_track = f'{assetto_corsa_root}{tracks_root}{self.track_name[0]}'
-        if self.track_name[1]:
-            current_track = f'{current_track}\\{self.track_name[1]}'
-
-        track_map_path = f'{current_track}\\map.png'
-        map_data_path = f'{current_track}\\data\\map.ini'
-        map_data = self.read_map_config(map_data_path)
-        map_image = Image.open(track_map_path)
-
-        map_ = {'map_data': map_data,
-                'map_image': map_image}
+        map_ = {'map_data': self.map_data,
+                'map_image': self.map_image,
+                'geometry': self.geometry}
 
         return map_
 
@@ -205,54 +298,12 @@ class GetInfo:
     sensors = []
     triggered_sensors = []
 
+    @ timed('ac_inputs.get_sensors')
     def get_sensors(self, min_sensor_distance=10, min_sensor_count=5, FOV_degrees=90):
-        coords = self.coordinates
-        heading = self.heading
-
-        FOV_radians = np.radians(FOV_degrees)
-
-        sensor_distance = max(min_sensor_distance *
-                              self.speed/100, min_sensor_distance)
-
-        sensor_count = max(
-            int(np.ceil(min_sensor_count * sensor_distance/25) // 2 * 2 + 1), min_sensor_count)
-
-        angles = np.linspace(-FOV_radians/2, FOV_radians/2,
-                             sensor_count) + np.radians(90)  # offset is due to heading being off by -90 degrees
-        # FIXME Sensor drawer has a problem, i shouldn't really offset it
-
-        distance_offset = [1]*sensor_count
-        sensors = []
-        triggered_sensors = [sensor_distance]
-        triggered_sensors_gauss = []
-
-        for idx, angle in enumerate(angles):
-            sensor_x = self.map_data['x_offset'] + \
-                coords[0] + sensor_distance * distance_offset[idx] * \
-                np.cos(heading + angle) * self.map_data['scale_factor']
-
-            sensor_z = self.map_data['z_offset'] + \
-                coords[2] + sensor_distance * distance_offset[idx] * \
-                np.sin(heading + angle) * self.map_data['scale_factor']
-            is_sensor_on_track = self.is_sensor_on_track(
-                sensor_x, sensor_z)
-
-            sensors.append((sensor_x, sensor_z, angle))
-            gausser = self.gauss(sensor_count, sensor_count)
-
-            if is_sensor_on_track:
-                triggered_sensors.append(angle)
-                # print((angle-np.radians(90)) * gausser[idx])
-                triggered_sensors_gauss.append(
-                    ((angle-np.radians(90))*gausser[idx])+np.radians(90))
-
-        # # Linear Mean
-        # sensor_mean_angle = np.degrees(
-        #     np.mean(triggered_sensors[1:]))-90
-
-        # Gaussian Mean
-        sensor_mean_angle = np.degrees(
-            np.mean(triggered_sensors_gauss[1:]))-90
+        # FIXME Sensor drawer has a problem, angles are offset by 90 degrees
+        sensors, triggered_sensors, sensor_mean_angle = self.sensor_engine.get_sensors(
+            self.coordinates, self.heading, self.speed,
+            min_sensor_distance, min_sensor_count, FOV_degrees)
 
         if np.isnan(sensor_mean_angle):
             sensor_mean_angle = self.prev_sensor_mean_angle
@@ -261,28 +312,44 @@ class GetInfo:
         triggered_sensors.append(sensor_mean_angle)
         return sensors, triggered_sensors
 
-    def is_sensor_on_track(self, x, z):
-        # Check if coordinates are within the bounds of the map image
-        if 0 <= int(x) < self.map_image.width and 0 <= int(z) < self.map_image.height:
-            try:
-                pixel_color = self.map_image.getpixel((int(x), int(z)))
-                alpha_value = pixel_color[3]
-                return True if alpha_value == 255 else False
+    @ timed('ac_inputs.get_lidar')
+    def get_lidar(self, ray_count=64, FOV_degrees=180, max_distance=200):
+        '''
+        Ray-cast sensors with continuous hit distances.
 
-            except Exception as e:
-                print(f"Error checking pixel color at ({x}, {z}):", e)
-                return False
-        else:
-            return False
+        Rays fan out over the FOV like `get_sensors` and stop where
+        they leave the track or at `max_distance` metres.
 
+        Returns (distances, hit_points)
+        distances: float32 metres, one per ray
+        hit_points: float32 [x, z] map pixels, for drawing
+        '''
+        return self.sensor_engine.cast(
+            self.coordinates, self.heading, ray_count, FOV_degrees, max_distance)
+
+    @ timed('ac_inputs.is_sensor_on_track')
+    def is_sensor_on_track(self, x, z):
+        return bool(self.sensor_engine.on_track(x, z))
 
-gi = GetInfo()
+    def get_centerline(self):
+        '''Centerline of the current track, extracted once and cached on disk.'''
+        if self._centerline is None:
+            self._centerline = load_centerline(self.geometry)
+        return self._centerline
 
-current_track = gi.get_track_attributes()
+    def get_track_position(self):
+        '''
+        Returns (s, lateral_offset) in metres along the centerline,
+        the offset is positive to the right of the centerline direction.
+        '''
+        s, lateral, _ = self.get_centerline().nearest(
+            self.coordinates[0], self.coordinates[2])
+        return s, lateral
 
 
 if __name__ == '__main__':
+    gi = default_info()
     print(f'Track: {gi.track_name}')
     print(f'Car: {gi.car_name}')
     print(f'Class attribute count: {len(count_info_attributes(gi))}')
-    print(current_track['map_data'])
+    print(gi.map_data)
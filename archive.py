@@ -0,0 +1,214 @@
+'''
+Columnar, chunked telemetry archive.
+
+Frames are stored in fixed-size chunks, each column of a chunk zlib
+compressed on its own. A sidecar index keeps the time, lap and track
+position range of every chunk, so a query only decompresses the chunks
+and columns it needs::
+
+    with ArchiveWriter('session.rla') as writer:
+        writer.append(load_recording('recording'))
+
+    lap = Archive('session.rla').read(['physics.speedKmh'], laps=3)
+'''
+import json
+import mmap
+import zlib
+
+import numpy as np
+
+INDEX_COLUMNS = {'time': 'time',
+                 'lap': 'graphics.completedLaps',
+                 'position': 'graphics.normalizedCarPosition'}
+
+
+def flatten_dtype(dtype, prefix=''):
+    '''Leaf columns of a (nested) structured dtype as [(path, dtype)].'''
+    columns = []
+    for name in dtype.names:
+        field = dtype.fields[name][0]
+        path = prefix + name
+        if field.names is not None:
+            columns.extend(flatten_dtype(field, path + '.'))
+        else:
+            columns.append((path, field))
+    return columns
+
+
+def column_values(frames, path):
+    for name in path.split('.'):
+        frames = frames[name]
+    return frames
+
+
+def index_path(path):
+    return path + '.idx.npz'
+
+
+class ArchiveWriter:
+    '''Appends structured frames to an archive, column by column.'''
+
+    def __init__(self, path, chunk_frames=8192, level=6):
+        self.path = path
+        self.chunk_frames = chunk_frames
+        self.level = level
+        self.columns = None
+        self._file = open(path, 'wb')
+        self._pending = []
+        self._pending_frames = 0
+        self._chunks = []
+
+    def append(self, frames):
+        if self.columns is None:
+            self.columns = flatten_dtype(frames.dtype)
+        self._pending.append(frames)
+        self._pending_frames += len(frames)
+        while self._pending_frames >= self.chunk_frames:
+            frames = np.concatenate(self._pending)
+            self._write_chunk(frames[:self.chunk_frames])
+            self._pending = [frames[self.chunk_frames:]]
+            self._pending_frames = len(self._pending[0])
+
+    def _write_chunk(self, frames):
+        offsets = []
+        lengths = []
+        for path, _ in self.columns:
+            data = zlib.compress(
+                np.ascontiguousarray(column_values(frames, path)).tobytes(), self.level)
+            offsets.append(self._file.tell())
+            lengths.append(len(data))
+            self._file.write(data)
+
+        chunk = {'frames': len(frames), 'offsets': offsets, 'lengths': lengths}
+        for key, path in INDEX_COLUMNS.items():
+            try:
+                values = column_values(frames, path)
+            except (KeyError, ValueError):
+                continue
+            chunk[key] = (values.min(), values.max())
+        self._chunks.append(chunk)
+
+    def close(self):
+        if self._pending_frames:
+            self._write_chunk(np.concatenate(self._pending))
+        self._pending = []
+        self._pending_frames = 0
+        self._file.close()
+
+        meta = {'columns': [(path, dtype.base.str, dtype.shape)
+                            for path, dtype in self.columns or []]}
+        index = {'meta': np.array(json.dumps(meta)),
+                 'frames': np.array([c['frames'] for c in self._chunks], dtype=np.int64),
+                 'offsets': np.array([c['offsets'] for c in self._chunks], dtype=np.int64),
+                 'lengths': np.array([c['lengths'] for c in self._chunks], dtype=np.int64)}
+        for key in INDEX_COLUMNS:
+            if self._chunks and key in self._chunks[0]:
+                index[f'{key}_range'] = np.array([c[key] for c in self._chunks])
+        np.savez(index_path(self.path), **index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Archive:
+    '''
+    Memory-mapped reader of an archive.
+
+    Only the chunks whose index ranges overlap a query are touched,
+    and only the requested columns of them are decompressed.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(index_path(path)) as index:
+            meta = json.loads(str(index['meta']))
+            self.frames = index['frames']
+            self.offsets = index['offsets']
+            self.lengths = index['lengths']
+            self.ranges = {key: index[f'{key}_range'] for key in INDEX_COLUMNS
+                           if f'{key}_range' in index}
+        self.columns = {}
+        for position, (name, dtype, shape) in enumerate(meta['columns']):
+            self.columns[name] = (position, np.dtype(dtype), tuple(shape))
+
+        with open(path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) \
+                if self.offsets.size else b''
+
+    def __len__(self):
+        return int(self.frames.sum())
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+    def chunk_column(self, chunk, name):
+        '''Decompresses one column of one chunk.'''
+        position, dtype, shape = self.columns[name]
+        start = self.offsets[chunk, position]
+        data = zlib.decompress(self._data[start:start + self.lengths[chunk, position]])
+        return np.frombuffer(data, dtype=dtype).reshape((-1,) + shape)
+
+    def select_chunks(self, laps=None, time_range=None, position_range=None):
+        '''Indices of the chunks that may hold frames matching the query.'''
+        selected = np.ones(len(self.frames), dtype=bool)
+        if laps is not None:
+            laps = np.atleast_1d(laps)
+            lo, hi = self.ranges['lap'].T
+            selected &= ((laps[:, None] >= lo) & (laps[:, None] <= hi)).any(axis=0)
+        for key, query in (('time', time_range), ('position', position_range)):
+            if query is not None:
+                lo, hi = self.ranges[key].T
+                selected &= (hi >= query[0]) & (lo <= query[1])
+        return np.flatnonzero(selected)
+
+    def read(self, columns=None, laps=None, time_range=None, position_range=None):
+        '''
+        Frames matching every given filter, as {column: array}.
+
+        laps: lap number or list of them (completedLaps)
+        time_range, position_range: inclusive (min, max)
+        '''
+        if columns is None:
+            columns = list(self.columns)
+        filters = [(INDEX_COLUMNS['lap'], laps), (INDEX_COLUMNS['time'], time_range),
+                   (INDEX_COLUMNS['position'], position_range)]
+        filters = [(name, query) for name, query in filters if query is not None]
+
+        parts = {name: [] for name in columns}
+        for chunk in self.select_chunks(laps, time_range, position_range):
+            keep = None
+            decoded = {}
+            for name, query in filters:
+                values = decoded[name] = self.chunk_column(chunk, name)
+                if name == INDEX_COLUMNS['lap']:
+                    match = np.isin(values, np.atleast_1d(query))
+                else:
+                    match = (values >= query[0]) & (values <= query[1])
+                keep = match if keep is None else keep & match
+            for name in columns:
+                values = decoded[name] if name in decoded else self.chunk_column(chunk, name)
+                parts[name].append(values if keep is None else values[keep])
+
+        result = {}
+        for name in columns:
+            _, dtype, shape = self.columns[name]
+            result[name] = np.concatenate(parts[name]) if parts[name] else \
+                np.zeros((0,) + shape, dtype=dtype)
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def archive_recording(directory, path, chunk_frames=8192):
+    '''Converts a `recorder` directory into an archive.'''
+    from recorder import load_recording
+    with ArchiveWriter(path, chunk_frames) as writer:
+        writer.append(load_recording(directory, mmap_mode='r'))
@@ -0,0 +1,205 @@
+'''
+Asyncio access to the AC pages without picking a polling period.
+
+One `AdaptivePoller` per process watches the physics `packetId`. It learns
+the packet cadence and sleeps until just before the next packet is due,
+polls briefly around it, takes one snapshot per packet and hands it to
+every waiting coroutine, in any number of event loops::
+
+    telemetry = AsyncTelemetry()
+    snapshot = await telemetry.next_frame()
+    async for snapshot in telemetry:
+        print(snapshot.physics.speedKmh)
+
+The poller is a thread so waits are timed with `time.sleep`, asyncio
+timers are too coarse for a 333 Hz cadence on Windows.
+'''
+import asyncio
+import threading
+import time
+
+from profiling import count
+
+_shared_poller = None
+_shared_lock = threading.Lock()
+
+
+class CadenceEstimator:
+    '''Moving average of the time between packets, from observed arrivals.'''
+
+    def __init__(self, interval=1 / 333, alpha=0.05, min_interval=0.0005, max_interval=0.5):
+        self.interval = interval
+        self.alpha = alpha
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.last_id = None
+        self.last_time = None
+
+    def observe(self, packet_id, now):
+        if self.last_id is not None and packet_id > self.last_id:
+            # Several packets may have gone by between two polls
+            interval = (now - self.last_time) / (packet_id - self.last_id)
+            interval = min(max(interval, self.min_interval), self.max_interval)
+            self.interval += self.alpha * (interval - self.interval)
+        self.last_id = packet_id
+        self.last_time = now
+
+    def expected(self):
+        '''When the next packet should arrive, None before the first.'''
+        if self.last_time is None:
+            return None
+        return self.last_time + self.interval
+
+
+class AdaptivePoller:
+    '''
+    Background thread turning packetId changes into snapshots.
+
+    It sleeps until `lead` seconds before the expected packet, then polls
+    every `spin` seconds. When packets stop (menu, pause) it backs off up
+    to `idle` seconds between polls.
+    '''
+
+    def __init__(self, sim_info=None, lead=0.0005, spin=0.0001, idle=0.05):
+        if sim_info is None:
+            from sim_info import get_info
+            sim_info = get_info()
+        self.sim_info = sim_info
+        self.lead = lead
+        self.spin = spin
+        self.idle = idle
+        self.cadence = CadenceEstimator()
+        self.snapshot = None
+        self.frame = 0
+        self.polls = 0
+        self._waiters = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._running = True
+                self._thread = threading.Thread(target=self._run, daemon=True,
+                                                name='AdaptivePoller')
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _delay(self, now):
+        expected = self.cadence.expected()
+        if expected is None:
+            return self.idle / 10
+        if now < expected - self.lead:
+            return expected - self.lead - now
+        late = now - expected
+        if late > 4 * self.cadence.interval:
+            # No packet for a while, the game is paused or in a menu
+            return min(self.idle, late / 4)
+        return self.spin
+
+    def _run(self):
+        physics = self.sim_info.physics
+        last_id = physics.packetId
+        while self._running:
+            packet_id = physics.packetId
+            self.polls += 1
+            if packet_id == last_id:
+                time.sleep(self._delay(time.perf_counter()))
+                continue
+            self.cadence.observe(packet_id, time.perf_counter())
+            snapshot = self.sim_info.snapshot()
+            last_id = snapshot.physics.packetId
+            with self._lock:
+                self.snapshot = snapshot
+                self.frame += 1
+                frame = self.frame
+                waiters, self._waiters = self._waiters, []
+            for loop, future in waiters:
+                try:
+                    loop.call_soon_threadsafe(_resolve, future, frame, snapshot)
+                except RuntimeError:
+                    # The consumer's event loop is closed
+                    count('async_info.closed_loop')
+
+    def wait(self, after):
+        '''
+        Future of the first (frame, snapshot) newer than frame `after`,
+        already done when there is one. Must be called from a running loop.
+        '''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self.frame > after:
+                future.set_result((self.frame, self.snapshot))
+            else:
+                self._waiters.append((loop, future))
+        self.start()
+        return future
+
+
+def _resolve(future, frame, snapshot):
+    if not future.done():
+        future.set_result((frame, snapshot))
+
+
+def shared_poller():
+    '''The process wide `AdaptivePoller` on the default `SimInfo`.'''
+    global _shared_poller
+    with _shared_lock:
+        if _shared_poller is None:
+            _shared_poller = AdaptivePoller()
+    return _shared_poller
+
+
+class AsyncTelemetry:
+    '''
+    One consumer of a poller. `next_frame` returns the snapshot after the
+    last one this consumer got; frames it was too slow for are skipped and
+    counted in `skipped`.
+    '''
+
+    def __init__(self, poller=None):
+        self.poller = poller or shared_poller()
+        self.frame = self.poller.frame
+        self.skipped = 0
+
+    async def next_frame(self, timeout=None):
+        '''Next `sim_info.Snapshot`, raises TimeoutError after `timeout` seconds.'''
+        future = self.poller.wait(self.frame)
+        if timeout is not None:
+            future = asyncio.wait_for(future, timeout)
+        frame, snapshot = await future
+        self.skipped += frame - self.frame - 1
+        self.frame = frame
+        return snapshot
+
+    async def latest(self):
+        '''Newest snapshot, waiting only before the first packet.'''
+        if self.poller.snapshot is None:
+            return await self.next_frame()
+        return self.poller.snapshot
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.next_frame()
+
+
+async def demo():
+    telemetry = AsyncTelemetry()
+    async for snapshot in telemetry:
+        if telemetry.frame % 100 == 0:
+            print(snapshot.static.track, snapshot.physics.speedKmh,
+                  f'{telemetry.poller.cadence.interval * 1000:.2f} ms/packet')
+
+
+if __name__ == '__main__':
+    asyncio.run(demo())
@@ -0,0 +1,220 @@
+'''
+Benchmarks of the sensing, shared memory and rendering paths on synthetic
+tracks, without the game.
+
+    python benchmarks/run.py --sizes 512 1024 2048 --output results.json
+    python benchmarks/run.py --baseline results.json --tolerance 1.3
+
+Every stage is timed per call over a scripted lap. Results are written as
+JSON (times in ms). With --baseline, the run fails (exit code 1) when the
+p50 or p95 of a stage is more than `tolerance` times the baseline.
+'''
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def summarize(samples):
+    samples = np.asarray(samples, dtype=np.float64) * 1000
+    p50, p95, p99 = np.percentile(samples, (50, 95, 99))
+    return {'count': len(samples), 'mean': float(samples.mean()), 'p50': float(p50),
+            'p95': float(p95), 'p99': float(p99), 'max': float(samples.max())}
+
+
+def time_frames(telemetry, frames, func, warmup=16):
+    '''Times `func()` once per published frame, returns seconds per call.'''
+    telemetry.rewind()
+    for _ in range(warmup):
+        telemetry.step()
+        func()
+    samples = np.empty(frames)
+    for i in range(frames):
+        telemetry.step()
+        start = time.perf_counter()
+        func()
+        samples[i] = time.perf_counter() - start
+    return samples
+
+
+def time_calls(func, count, warmup=16):
+    for _ in range(warmup):
+        func()
+    samples = np.empty(count)
+    for i in range(count):
+        start = time.perf_counter()
+        func()
+        samples[i] = time.perf_counter() - start
+    return samples
+
+
+def open_minimap(gi):
+    '''MinimapApp with its update loop detached, None without a display.'''
+    import tkinter as tk
+    from minimap import MinimapApp
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    root.withdraw()
+    root.after = lambda *args: None
+    os.chdir(REPO)  # MinimapApp loads assets relative to the repo
+    return MinimapApp(root, gi=gi)
+
+
+def bench_track(size, root, args, results):
+    from ac_inputs import GetInfo
+    from gamepad import Gamepad, RecordingBackend
+    from render import MinimapRasterizer
+    from synthetic import ScriptedTelemetry, make_track, track_name
+    from sim_info import info
+    import track_geometry
+
+    lap = make_track(root, size)
+    telemetry = ScriptedTelemetry(info, lap)
+    telemetry.set_track(track_name(size))
+    telemetry.step()
+
+    def stage(name, samples):
+        results[f'{size}/{name}'] = summarize(samples)
+        print(f"{size:>5} {name:<22} p50 {results[f'{size}/{name}']['p50']:9.4f} ms"
+              f"  p95 {results[f'{size}/{name}']['p95']:9.4f} ms")
+
+    # Cold: preprocessing into an empty cache, warm: memory mapping it
+    start = time.perf_counter()
+    gi = GetInfo()
+    gi.sensor_engine
+    stage('load_track_cold', [time.perf_counter() - start])
+    track_geometry._loaded.clear()
+    start = time.perf_counter()
+    gi = GetInfo()
+    gi.sensor_engine
+    stage('load_track_warm', [time.perf_counter() - start])
+
+    frames = args.frames
+    map_data_path = os.path.join(root, 'content', 'tracks', track_name(size),
+                                 'data', 'map.ini')
+    stage('read_map_config', time_calls(
+        lambda: gi.read_map_config(map_data_path), frames))
+    stage('gauss', time_calls(lambda: gi.gauss(21, sigma=50), frames))
+    stage('snapshot', time_frames(telemetry, frames, gi.freeze))
+
+    gi.freeze()
+    x0 = gi.map_data['x_offset'] + gi.coordinates[0] * gi.map_data['scale_factor']
+    z0 = gi.map_data['z_offset'] + gi.coordinates[2] * gi.map_data['scale_factor']
+    stage('is_sensor_on_track', time_calls(lambda: gi.is_sensor_on_track(x0, z0), frames))
+
+    def sensors():
+        gi.freeze()
+        gi.get_sensors(min_sensor_distance=50, min_sensor_count=10, FOV_degrees=180)
+    stage('get_sensors', time_frames(telemetry, frames, sensors))
+
+    def lidar():
+        gi.freeze()
+        gi.get_lidar()
+    stage('get_lidar', time_frames(telemetry, frames, lidar))
+
+    rasterizer = MinimapRasterizer.from_info(gi)
+
+    def raster_frame():
+        gi.freeze()
+        all_sensors, triggered = gi.get_sensors(
+            min_sensor_distance=50, min_sensor_count=10, FOV_degrees=180)
+        rasterizer.render(gi.coordinates, gi.heading, all_sensors, triggered)
+    stage('raster_frame', time_frames(telemetry, frames, raster_frame))
+
+    if not args.no_tk:
+        app = open_minimap(gi)
+        if app is None:
+            print(f'{size:>5} minimap_frame          skipped, no display')
+        else:
+            stage('minimap_frame', time_frames(telemetry, frames, app.update_minimap))
+            app.root.destroy()
+
+    gamepad = Gamepad(RecordingBackend())
+
+    def step():
+        gi.freeze()
+        gi.get_sensors(min_sensor_distance=50, min_sensor_count=10, FOV_degrees=180)
+        distances, _ = gi.get_lidar()
+        on_track = gi.is_sensor_on_track(x0, z0)
+        steer = float(np.clip(gi.prev_sensor_mean_angle / 90, -1, 1))
+        gamepad.apply_input(steer, 0.5 if on_track else 0.2, 0.0)
+    stage('end_to_end_step', time_frames(telemetry, frames, step))
+
+
+def compare(results, baseline, tolerance, min_delta=0.005):
+    '''
+    Stages slower than `tolerance` times the baseline, ignoring
+    differences under `min_delta` ms that are timer noise.
+    '''
+    failures = []
+    for name, current in results.items():
+        reference = baseline.get(name)
+        if reference is None or name.endswith('load_track_cold'):
+            continue
+        for key in ('p50', 'p95'):
+            slower = current[key] > reference[key] * tolerance and \
+                current[key] - reference[key] > min_delta
+            if slower:
+                failures.append(f'{name} {key}: {current[key]:.4f} ms, '
+                                f'baseline {reference[key]:.4f} ms')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[512, 1024, 2048],
+                        help='map resolutions in pixels')
+    parser.add_argument('--frames', type=int, default=1000, help='timed calls per stage')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=1.3,
+                        help='allowed slowdown against the baseline')
+    parser.add_argument('--min-delta', type=float, default=0.005,
+                        help='ms, smaller slowdowns never fail')
+    parser.add_argument('--no-tk', action='store_true', help='skip the Tk minimap frame')
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    with tempfile.TemporaryDirectory(prefix='rl_driver_bench_') as root:
+        # Game content, shared memory and track cache all in the scratch dir
+        os.environ['AC_ROOT'] = root
+        os.environ['AC_SHM_DIR'] = os.path.join(root, 'shm')
+        os.environ['RL_DRIVER_CACHE'] = os.path.join(root, 'cache')
+
+        results = {}
+        for size in args.sizes:
+            bench_track(size, root, args, results)
+
+    report = {'meta': {'python': platform.python_version(), 'numpy': np.__version__,
+                       'platform': platform.platform(), 'frames': args.frames,
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+              'results': results}
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Results written to {output}')
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)['results']
+        failures = compare(results, baseline, args.tolerance, args.min_delta)
+        for failure in failures:
+            print(f'REGRESSION {failure}')
+        if failures:
+            sys.exit(1)
+        print(f'No stage slower than {args.tolerance}x the baseline')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+'''
+Synthetic Assetto Corsa content and scripted telemetry for the benchmarks.
+
+Tracks are written in the game's layout (content/tracks/<name>/map.png and
+data/map.ini) so `GetInfo` loads them like real ones, telemetry goes
+through the file-backed pages of `sim_info`.
+'''
+import os
+
+import numpy as np
+from PIL import Image
+
+from telemetry_producer import SyntheticLap, TelemetryProducer
+
+
+def track_name(size):
+    return f'bench_{size}'
+
+
+def make_track(root, size, scale_factor=None, width_fraction=0.12, seed=0):
+    '''
+    Writes a closed track of `size` x `size` pixels under `root`.
+
+    The track is a ring with a wavy radius and width, so the sensors see
+    straights, curves and varying widths. Returns the lap to drive on it.
+    '''
+    name = track_name(size)
+    directory = os.path.join(root, 'content', 'tracks', name)
+    os.makedirs(os.path.join(directory, 'data'), exist_ok=True)
+    if scale_factor is None:
+        # Keep the track about 1.4 km long whatever the resolution
+        scale_factor = size / 640
+
+    rng = np.random.default_rng(seed)
+    phases = rng.uniform(0, 2 * np.pi, 3)
+    z, x = np.mgrid[0:size, 0:size].astype(np.float32) + 0.5 - size / 2
+    angle = np.arctan2(z, x)
+    radius = np.hypot(x, z) / (size / 2)
+    centre = 0.7 + 0.03 * np.sin(3 * angle + phases[0]) + \
+        0.015 * np.sin(5 * angle + phases[1])
+    half_width = width_fraction / 2 * (1 + 0.3 * np.sin(2 * angle + phases[2]))
+    on_track = np.abs(radius - centre) < half_width
+
+    image = np.zeros((size, size, 4), dtype=np.uint8)
+    image[..., :3] = 200
+    image[..., 3] = np.where(on_track, 255, 0)
+    Image.fromarray(image, 'RGBA').save(os.path.join(directory, 'map.png'))
+
+    with open(os.path.join(directory, 'data', 'map.ini'), 'w') as f:
+        f.write('[PARAMETERS]\n'
+                f'WIDTH={size}\n'
+                f'HEIGHT={size}\n'
+                'MARGIN=20\n'
+                f'SCALE_FACTOR={scale_factor}\n'
+                f'X_OFFSET={size / 2}\n'
+                f'Z_OFFSET={size / 2}\n'
+                'DRAWING_SIZE=10\n')
+
+    # Driven on the mean radius, so the car crosses the edges now and then
+    world_radius = 0.7 * size / 2 / scale_factor
+    return SyntheticLap(world_radius, world_radius, speed=150.0)
+
+
+class ScriptedTelemetry:
+    '''
+    Publishes one frame of a scripted lap per `step`, no clock involved,
+    so every run sees the same sequence of poses.
+    '''
+
+    def __init__(self, sim_info, lap, hz=333.0):
+        self.producer = TelemetryProducer(sim_info, hz)
+        self.lap = lap
+        self.hz = hz
+        self.frame = 0
+
+    def set_track(self, name, layout=''):
+        self.producer.set_static(name, layout)
+
+    def step(self):
+        self.lap.fill(self.producer.physics[0], self.producer.graphics[0],
+                      self.frame / self.hz)
+        self.producer.publish()
+        self.frame += 1
+
+    def rewind(self):
+        self.frame = 0
@@ -0,0 +1,406 @@
+'''
+Track centerline extracted from the map mask, with a spatial index for
+nearest point, lateral offset and curvature lookahead queries.
+
+The centerline is the thinned track mask traced into a polyline, smoothed
+and resampled by arc length, all in world metres. Its start (s = 0) and
+direction are arbitrary until `orient` is called with a recorded path.
+'''
+import os
+
+import numpy as np
+
+# Neighbour order P2..P9 of Zhang-Suen, clockwise from north
+_NEIGHBOURS = [(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)]
+
+
+def thin(mask):
+    '''One pixel wide skeleton of a boolean mask (Zhang-Suen thinning).'''
+    rows, cols = np.nonzero(mask)
+    if not rows.size:
+        return np.zeros_like(mask, dtype=bool)
+    # Work on the bounding box only, with a background border
+    z0, z1, x0, x1 = rows.min(), rows.max() + 1, cols.min(), cols.max() + 1
+    img = np.pad(mask[z0:z1, x0:x1], 1).astype(np.uint8)
+    height, width = img.shape
+
+    def neighbours():
+        return [img[1 + dz:height - 1 + dz, 1 + dx:width - 1 + dx]
+                for dz, dx in _NEIGHBOURS]
+
+    changed = True
+    while changed:
+        changed = False
+        for first in (True, False):
+            p = neighbours()
+            centre = img[1:-1, 1:-1]
+            count = sum(n.astype(np.int8) for n in p)
+            transitions = sum(((p[i] == 0) & (p[(i + 1) % 8] == 1)).astype(np.int8)
+                              for i in range(8))
+            if first:
+                c1 = p[0] & p[2] & p[4]
+                c2 = p[2] & p[4] & p[6]
+            else:
+                c1 = p[0] & p[2] & p[6]
+                c2 = p[0] & p[4] & p[6]
+            delete = (centre == 1) & (count >= 2) & (count <= 6) & \
+                (transitions == 1) & (c1 == 0) & (c2 == 0)
+            if delete.any():
+                centre[delete] = 0
+                changed = True
+
+    skeleton = np.zeros(mask.shape, dtype=bool)
+    skeleton[z0:z1, x0:x1] = img[1:-1, 1:-1].astype(bool)
+    return skeleton
+
+
+def _pixel_graph(skeleton):
+    pixels = set(zip(*(int_array.tolist() for int_array in np.nonzero(skeleton))))
+    return {p: [(p[0] + dz, p[1] + dx) for dz, dx in _NEIGHBOURS
+                if (p[0] + dz, p[1] + dx) in pixels] for p in pixels}
+
+
+def prune(graph, length):
+    '''Removes branches shorter than `length` pixels from dead ends.'''
+    for _ in range(length):
+        ends = [p for p, neighbours in graph.items() if len(neighbours) <= 1]
+        if not ends or len(ends) == len(graph):
+            break
+        for p in ends:
+            for q in graph.pop(p, ()):
+                if q in graph:
+                    graph[q].remove(p)
+    return graph
+
+
+def trace(graph, start):
+    '''
+    Walks the skeleton from `start`, keeping the straightest way at
+    junctions, until it closes the loop or runs out of pixels.
+
+    Returns the (z, x) pixels in order and whether the path is closed.
+    '''
+    path = [start]
+    visited = {start}
+    while True:
+        current = path[-1]
+        if len(path) > 8 and start in graph[current]:
+            return path, True
+        back = path[max(len(path) - 4, 0)]
+        direction = np.array([current[0] - back[0], current[1] - back[1]], dtype=float)
+        candidates = [p for p in graph[current] if p not in visited]
+        if not candidates:
+            return path, False
+        best = max(candidates, key=lambda p: (
+            direction @ (p[0] - current[0], p[1] - current[1])) /
+            np.hypot(p[0] - current[0], p[1] - current[1]))
+        path.append(best)
+        visited.add(best)
+
+
+def _bilinear(image, x, z):
+    height, width = image.shape
+    x = np.clip(x, 0, width - 1.001)
+    z = np.clip(z, 0, height - 1.001)
+    x0 = x.astype(np.intp)
+    z0 = z.astype(np.intp)
+    fx = x - x0
+    fz = z - z0
+    top = image[z0, x0] * (1 - fx) + image[z0, x0 + 1] * fx
+    bottom = image[z0 + 1, x0] * (1 - fx) + image[z0 + 1, x0 + 1] * fx
+    return top * (1 - fz) + bottom * fz
+
+
+def _tangents(points, closed):
+    if closed:
+        tangent = np.roll(points, -1, axis=0) - np.roll(points, 1, axis=0)
+    else:
+        tangent = np.gradient(points, axis=0)
+    return tangent / np.maximum(np.hypot(*tangent.T), 1e-9)[:, None]
+
+
+def recentre(points, sdf, closed, step=0.25, chunk=1024):
+    '''
+    Moves every point of a polyline in map pixels [x, z] halfway between
+    the track edges along its normal, with the edges found to a fraction
+    of a pixel. Takes out the one pixel wobble of the skeleton.
+    '''
+    sdf = np.asarray(sdf, dtype=np.float32)
+    tangent = _tangents(points, closed)
+    normal = np.stack([-tangent[:, 1], tangent[:, 0]], axis=1)
+    t = np.arange(step, float(sdf.max()) + 4, step)
+    centred = points.copy()
+    for start in range(0, len(points), chunk):
+        p = points[start:start + chunk]
+        n = normal[start:start + chunk]
+        # sdf is sampled at pixel centres
+        inside = _bilinear(sdf, p[:, 0] - 0.5, p[:, 1] - 0.5)
+        edges = []
+        for sign in (1, -1):
+            x = p[:, 0, None] + sign * t * n[:, 0, None] - 0.5
+            z = p[:, 1, None] + sign * t * n[:, 1, None] - 0.5
+            values = _bilinear(sdf, x, z)
+            outside = values <= 0
+            k = outside.argmax(axis=1)
+            rows = np.arange(len(p))
+            before = np.where(k > 0, values[rows, k - 1], inside)
+            after = values[rows, k]
+            t_before = np.where(k > 0, t[k - 1], 0)
+            edge = t_before + step * before / np.maximum(before - after, 1e-9)
+            edges.append(np.where(outside.any(axis=1) & (inside > 0), edge, np.nan))
+        shift = (edges[0] - edges[1]) / 2
+        shift[np.isnan(shift)] = 0
+        centred[start:start + chunk] += shift[:, None] * n
+    return centred
+
+
+def smooth(points, window, closed):
+    '''Moving average of a polyline, wrapping around when closed.'''
+    if window < 2 or len(points) <= window:
+        return points
+    kernel = np.ones(window) / window
+    half = window // 2
+    if closed:
+        padded = np.concatenate([points[-half:], points, points[:window - half - 1]])
+    else:
+        padded = np.concatenate([np.repeat(points[:1], half, axis=0), points,
+                                 np.repeat(points[-1:], window - half - 1, axis=0)])
+    return np.stack([np.convolve(padded[:, i], kernel, mode='valid')
+                     for i in range(points.shape[1])], axis=1)
+
+
+def resample(points, spacing, closed):
+    '''Points evenly spaced by arc length, returns (points, s).'''
+    if closed:
+        points = np.concatenate([points, points[:1]])
+    segment = np.hypot(*np.diff(points, axis=0).T)
+    s = np.concatenate([[0], np.cumsum(segment)])
+    count = max(int(s[-1] // spacing), 2)
+    new_s = np.linspace(0, s[-1], count + 1 if closed else count)
+    if closed:
+        new_s = new_s[:-1]
+    resampled = np.stack([np.interp(new_s, s, points[:, i]) for i in range(2)], axis=1)
+    return resampled, new_s, s[-1]
+
+
+class Centerline:
+    '''
+    Arc-length parameterized centerline in world metres.
+
+    points: (N, 2) [x, z], s: arc length of every point, tangent: unit
+    direction, curvature: signed 1/m, positive when turning towards +90
+    degrees from the tangent.
+    '''
+
+    def __init__(self, points, s, length, closed, cell_size=20.0):
+        self.points = np.asarray(points, dtype=np.float64)
+        self.s = np.asarray(s, dtype=np.float64)
+        self.length = float(length)
+        self.closed = bool(closed)
+
+        self.tangent = _tangents(self.points, closed)
+        angle = np.unwrap(np.arctan2(self.tangent[:, 1], self.tangent[:, 0]))
+        spacing = self.length / len(self.points) if closed else \
+            self.length / max(len(self.points) - 1, 1)
+        if closed:
+            turn = (np.roll(angle, -1) - np.roll(angle, 1) + np.pi) % (2*np.pi) - np.pi
+        else:
+            turn = np.gradient(angle) * 2
+        self.curvature = turn / (2 * spacing)
+        self._build_index(cell_size)
+
+    def _build_index(self, cell_size):
+        '''
+        Grid index: each cell lists every point of its 3x3 neighbourhood,
+        padded with -1, so a query is one row lookup.
+        '''
+        self.cell_size = cell_size
+        self.origin = self.points.min(axis=0) - 2 * cell_size
+        cells = ((self.points - self.origin) // cell_size).astype(np.intp)
+        self.grid_shape = tuple(cells.max(axis=0) + 3)
+
+        members = {}
+        for index, (cx, cz) in enumerate(cells.tolist()):
+            for dx in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    members.setdefault((cx + dx, cz + dz), []).append(index)
+        width = max(len(v) for v in members.values())
+        self.cell_row = np.full(self.grid_shape, -1, dtype=np.int32)
+        self.cell_members = np.full((len(members) + 1, width), -1, dtype=np.int32)
+        for row, (cell, indices) in enumerate(members.items()):
+            self.cell_row[cell] = row
+            self.cell_members[row, :len(indices)] = indices
+        # Row of -1 for cells with nothing nearby
+        self.cell_row[self.cell_row == -1] = len(members)
+
+    def _candidates(self, x, z):
+        cx = int((x - self.origin[0]) // self.cell_size)
+        cz = int((z - self.origin[1]) // self.cell_size)
+        if 0 <= cx < self.grid_shape[0] and 0 <= cz < self.grid_shape[1]:
+            row = self.cell_members[self.cell_row[cx, cz]]
+            if row[0] >= 0:
+                return row[row >= 0]
+        return None
+
+    def nearest(self, x, z):
+        '''
+        Nearest centerline point to world (x, z).
+
+        Returns (s, lateral_offset, index). The offset is signed metres,
+        positive to the +90 degree side of the tangent.
+        '''
+        candidates = self._candidates(x, z)
+        if candidates is None:
+            # Far from the track, fall back to every point
+            candidates = np.arange(len(self.points))
+        d = self.points[candidates] - (x, z)
+        distance = d[:, 0]**2 + d[:, 1]**2
+        nearest = np.argmin(distance)
+        if distance[nearest] > self.cell_size**2 and len(candidates) < len(self.points):
+            # Something outside the neighbourhood may be closer
+            d = self.points - (x, z)
+            candidates = np.arange(len(self.points))
+            nearest = np.argmin(d[:, 0]**2 + d[:, 1]**2)
+        index = int(candidates[nearest])
+
+        offset = np.array([x, z]) - self.points[index]
+        tangent = self.tangent[index]
+        along = offset @ tangent
+        lateral = tangent[0] * offset[1] - tangent[1] * offset[0]
+        s = self.s[index] + along
+        if self.closed:
+            s %= self.length
+        return float(s), float(lateral), index
+
+    def nearest_batch(self, x, z, chunk=1024):
+        '''Vectorized `nearest` for many points, returns (s, lateral, index) arrays.'''
+        x = np.asarray(x, dtype=np.float64)
+        z = np.asarray(z, dtype=np.float64)
+        index = np.empty(x.shape, dtype=np.intp)
+        flat_x = x.reshape(-1)
+        flat_z = z.reshape(-1)
+        for start in range(0, x.size, chunk):
+            px = flat_x[start:start + chunk]
+            pz = flat_z[start:start + chunk]
+            cx = np.floor((px - self.origin[0]) / self.cell_size).astype(np.intp)
+            cz = np.floor((pz - self.origin[1]) / self.cell_size).astype(np.intp)
+            inside = (cx >= 0) & (cx < self.grid_shape[0]) & (cz >= 0) & (cz < self.grid_shape[1])
+            # Outside the grid gets the row of -1, like an empty cell
+            rows = np.full(len(px), len(self.cell_members) - 1)
+            rows[inside] = self.cell_row[cx[inside], cz[inside]]
+            candidates = self.cell_members[rows]
+            points = self.points[candidates]
+            d = (points[..., 0] - px[:, None])**2 + (points[..., 1] - pz[:, None])**2
+            d[candidates < 0] = np.inf
+            nearest = d.argmin(axis=1)
+            best = candidates[np.arange(len(px)), nearest]
+            # Nothing within a cell, something outside the neighbourhood may
+            # be closer, fall back to every point like `nearest`
+            far = np.flatnonzero(d[np.arange(len(px)), nearest] > self.cell_size**2)
+            if far.size:
+                d = (self.points[:, 0] - px[far, None])**2 + (self.points[:, 1] - pz[far, None])**2
+                best[far] = d.argmin(axis=1)
+            index.reshape(-1)[start:start + chunk] = best
+        offset_x = x - self.points[index, 0]
+        offset_z = z - self.points[index, 1]
+        tangent = self.tangent[index]
+        s = self.s[index] + offset_x * tangent[..., 0] + offset_z * tangent[..., 1]
+        if self.closed:
+            s %= self.length
+        lateral = tangent[..., 0] * offset_z - tangent[..., 1] * offset_x
+        return s, lateral, index
+
+    def curvature_at(self, s):
+        '''Curvature interpolated at arc lengths `s`, wrapping on closed tracks.'''
+        s = np.asarray(s, dtype=np.float64)
+        if self.closed:
+            return np.interp(s % self.length, self.s, self.curvature, period=self.length)
+        return np.interp(s, self.s, self.curvature)
+
+    def curvature_ahead(self, x, z, distances):
+        '''Curvature at `distances` metres ahead of the nearest point to (x, z).'''
+        s, _, _ = self.nearest(x, z)
+        return self.curvature_at(s + np.asarray(distances))
+
+    def orient(self, x, z):
+        '''
+        Reverses the centerline if the recorded path (x, z) runs against
+        it, so s grows in the driving direction. Returns self.
+        '''
+        s, _, _ = self.nearest_batch(x, z)
+        step = np.diff(s)
+        if self.closed:
+            step = (step + self.length / 2) % self.length - self.length / 2
+        if step.sum() < 0:
+            reversed_ = Centerline(self.points[::-1], self.s[-1] - self.s[::-1],
+                                   self.length, self.closed, self.cell_size)
+            self.__dict__.update(reversed_.__dict__)
+        return self
+
+    def save(self, path):
+        np.savez(path, points=self.points, s=self.s, length=self.length,
+                 closed=self.closed, cell_size=self.cell_size)
+
+    @ classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['points'], data['s'], data['length'], data['closed'],
+                       float(data['cell_size']))
+
+    @ classmethod
+    def from_geometry(cls, geometry, spacing=1.0, smoothing=15.0, cell_size=20.0):
+        '''
+        Extracts the centerline from a `TrackGeometry`.
+
+        spacing and smoothing are in metres, spurs shorter than the
+        widest part of the track are pruned.
+        '''
+        scale = geometry.scale_factor
+        skeleton = thin(geometry.mask)
+        graph = _pixel_graph(skeleton)
+        if not graph:
+            raise ValueError('Track mask is empty')
+        prune(graph, int(np.ceil(2 * float(np.max(geometry.sdf)))) + 1)
+
+        # Start from the widest part of the remaining skeleton
+        pixels = np.array(list(graph))
+        widest = np.argmax(np.asarray(geometry.sdf)[pixels[:, 0], pixels[:, 1]])
+        path, closed = trace(graph, tuple(pixels[widest].tolist()))
+        if not closed:
+            # Widest point was in the middle of an open track, trace again from an end
+            path, closed = trace(graph, path[-1])
+
+        # Pixel centres as [x, z], evenly spaced so the smoothing window is
+        # the same length everywhere
+        pixels = np.array(path, dtype=np.float64)[:, ::-1] + 0.5
+        pixels, _, _ = resample(pixels, spacing * scale, closed)
+        window = max(int(round(smoothing / spacing)), 1)
+        pixels = recentre(pixels, geometry.sdf, closed)
+        # Two box passes, the staircase of the pixel edges is longer than one
+        pixels = smooth(smooth(pixels, window, closed), window, closed)
+
+        points = np.stack([(pixels[:, 0] - geometry.map_data['x_offset']) / scale,
+                           (pixels[:, 1] - geometry.map_data['z_offset']) / scale],
+                          axis=1)
+        points, s, length = resample(points, spacing, closed)
+        return cls(points, s, length, closed, cell_size)
+
+
+def load_centerline(geometry, spacing=1.0, smoothing=15.0, cell_size=20.0):
+    '''
+    Centerline of a track geometry, cached next to its arrays when the
+    geometry came from the track cache. The cache file is named after the
+    parameters, so other parameters extract a new centerline.
+    '''
+    path = None
+    if geometry.cache_path is not None:
+        path = os.path.join(geometry.cache_path,
+                            f'centerline_{spacing:g}_{smoothing:g}_{cell_size:g}.npz')
+        if os.path.exists(path):
+            return Centerline.load(path)
+    centerline = Centerline.from_geometry(geometry, spacing, smoothing, cell_size)
+    if path is not None:
+        tmp_path = f'{path}.tmp{os.getpid()}.npz'
+        centerline.save(tmp_path)
+        os.replace(tmp_path, path)
+    return centerline
@@ -0,0 +1,194 @@
+'''
+Index of the tracks and layouts of an Assetto Corsa install.
+
+Scans content/tracks once, records the map.png and map.ini of every layout
+with its metadata and keeps the index as JSON next to the track cache.
+`preload` preprocesses every layout whose cached geometry is missing or
+stale in a process pool, so switching tracks never decodes a PNG::
+
+    python content_index.py --root "D:\\SteamLibrary\\steamapps\\common\\assettocorsa"
+'''
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image
+
+from track_geometry import (CACHE_DIR, cache_key, load_track, read_map_config,
+                            source_mtime)
+
+DEFAULT_ROOT = 'D:\\SteamLibrary\\steamapps\\common\\assettocorsa'
+INDEX_NAME = 'content_index.json'
+
+
+def content_root(root=None):
+    '''Assetto Corsa install directory, `root` or AC_ROOT or the default.'''
+    return root or os.environ.get('AC_ROOT', DEFAULT_ROOT)
+
+
+def track_paths(track, layout='', root=None):
+    '''Returns (map.png path, map.ini path) of a track layout.'''
+    directory = os.path.join(content_root(root), 'content', 'tracks', track)
+    if layout:
+        directory = os.path.join(directory, layout)
+    return (os.path.join(directory, 'map.png'),
+            os.path.join(directory, 'data', 'map.ini'))
+
+
+def scan_layouts(root=None):
+    '''Yields (track, layout) of every directory with a map.png.'''
+    tracks_dir = os.path.join(content_root(root), 'content', 'tracks')
+    if not os.path.isdir(tracks_dir):
+        return
+    for track in sorted(os.listdir(tracks_dir)):
+        track_dir = os.path.join(tracks_dir, track)
+        if not os.path.isdir(track_dir):
+            continue
+        if os.path.isfile(os.path.join(track_dir, 'map.png')):
+            yield track, ''
+        for layout in sorted(os.listdir(track_dir)):
+            if os.path.isfile(os.path.join(track_dir, layout, 'map.png')):
+                yield track, layout
+
+
+def _preprocess(map_path, map_data_path, track, layout, cache_dir):
+    load_track(map_path, map_data_path, track, layout, cache_dir)
+    return track, layout
+
+
+class ContentIndex:
+    '''
+    Tracks and layouts found under `root`, keyed by (track, layout).
+
+    Each entry holds map_path, map_data_path, mtime_ns (newest of the two
+    files), map_data and the map image size.
+    '''
+
+    def __init__(self, root=None, cache_dir=None) -> None:
+        self.root = content_root(root)
+        self.cache_dir = cache_dir or CACHE_DIR
+        self.path = os.path.join(self.cache_dir, INDEX_NAME)
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return tuple(key) in self.entries
+
+    def __getitem__(self, key):
+        return self.entries[tuple(key)]
+
+    def load(self):
+        '''Reads the saved index, returns False when there is none for this root.'''
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if saved.get('root') != self.root:
+            return False
+        self.entries = {(entry['track'], entry['layout']): entry
+                        for entry in saved['tracks']}
+        return True
+
+    def save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f'{self.path}.tmp{os.getpid()}'
+        with open(tmp_path, 'w') as f:
+            json.dump({'root': self.root, 'tracks': list(self.entries.values())},
+                      f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def scan(self):
+        '''
+        Rescans the content directory. Unchanged layouts keep their
+        entry, only new or modified ones are read. Returns the changed keys.
+        '''
+        entries = {}
+        changed = []
+        for track, layout in scan_layouts(self.root):
+            map_path, map_data_path = track_paths(track, layout, self.root)
+            mtime = source_mtime(map_path, map_data_path)
+            entry = self.entries.get((track, layout))
+            if entry is None or entry['mtime_ns'] != mtime:
+                with Image.open(map_path) as image:
+                    # Only reads the PNG header
+                    size = list(image.size)
+                entry = {'track': track, 'layout': layout,
+                         'map_path': map_path, 'map_data_path': map_data_path,
+                         'mtime_ns': mtime, 'size': size,
+                         'map_data': read_map_config(map_data_path)}
+                changed.append((track, layout))
+            entries[(track, layout)] = entry
+        self.entries = entries
+        return changed
+
+    def update(self):
+        '''Loads the saved index, rescans and saves it. Returns the changed keys.'''
+        self.load()
+        changed = self.scan()
+        if changed or not os.path.exists(self.path):
+            self.save()
+        return changed
+
+    def cache_path(self, key):
+        entry = self[key]
+        return os.path.join(self.cache_dir,
+                            cache_key(entry['track'], entry['layout'], entry['mtime_ns']))
+
+    def stale(self):
+        '''Keys of the layouts without up to date cached geometry.'''
+        return [key for key in self.entries
+                if not os.path.exists(os.path.join(self.cache_path(key), 'meta.json'))]
+
+    def preload(self, keys=None, workers=None, progress=None):
+        '''
+        Preprocesses the geometry of `keys` (default every stale layout)
+        in a process pool. Returns {key: error message} of the failures.
+
+        `progress(key, done, total)` is called as layouts finish.
+        '''
+        keys = self.stale() if keys is None else [tuple(key) for key in keys]
+        failures = {}
+        if not keys:
+            return failures
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_preprocess, self[key]['map_path'],
+                                   self[key]['map_data_path'], *key, self.cache_dir): key
+                       for key in keys}
+            for done, future in enumerate(as_completed(futures), 1):
+                key = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    failures[key] = f'{type(e).__name__}: {e}'
+                if progress is not None:
+                    progress(key, done, len(keys))
+        return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--root', help='Assetto Corsa directory, default AC_ROOT')
+    parser.add_argument('--cache', help='track cache directory, default RL_DRIVER_CACHE')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--no-preload', action='store_true')
+    args = parser.parse_args()
+
+    index = ContentIndex(args.root, args.cache)
+    changed = index.update()
+    print(f'{len(index)} layouts under {index.root}, {len(changed)} new or changed')
+    if not args.no_preload:
+        start = time.perf_counter()
+        stale = index.stale()
+
+        def report(key, done, total):
+            print(f'[{done}/{total}] {key[0]} {key[1]}'.rstrip())
+        failures = index.preload(stale, args.workers, report)
+        for key, error in failures.items():
+            print(f'Failed {key[0]} {key[1]}: {error}')
+        print(f'Preprocessed {len(stale) - len(failures)} layouts '
+              f'in {time.perf_counter() - start:.1f} s')
@@ -0,0 +1,149 @@
+'''
+Gym-style driving environment on top of `GetInfo` and `Gamepad`.
+
+Follows the gymnasium API (`reset` -> (obs, info), `step` ->
+(obs, reward, terminated, truncated, info)) without depending on it.
+'''
+import time
+
+import numpy as np
+
+from profiling import LatencyTracker
+from rewards import RewardPipeline, default_pipeline, live_signals
+
+
+class DrivingEnv:
+    '''
+    Observations from `GetInfo`, actions through `Gamepad.apply_input`.
+
+    Every step applies the action, waits for the next physics packet,
+    freezes one snapshot and builds the observation and the reward from
+    it in a single pass. The reward is a `RewardPipeline`, by default
+    progress minus off-track and damage penalties, or one built from a
+    config dict passed as `reward`. The observation is a reused float32 buffer,
+    copy it if it has to outlive the next step.
+
+    The game session is not restarted by `reset`, it only resyncs.
+    '''
+
+    base_observation_names = ['speed', 'steer_angle', 'track_completion',
+                              'performance_meter', 'wheels_offtrack',
+                              'wheel_slip_FL', 'wheel_slip_FR',
+                              'wheel_slip_RL', 'wheel_slip_RR']
+
+    def __init__(self, gi=None, gamepad=None, sim_info=None, ray_count=32,
+                 FOV_degrees=180, max_distance=200, max_speed=300,
+                 progress_weight=100.0, offtrack_penalty=0.1, damage_weight=0.01,
+                 damage_limit=150, max_episode_steps=None, physics_hz=333,
+                 packet_timeout=1.0, reward=None, sensor_params=None):
+        if gi is None:
+            from ac_inputs import default_info
+            gi = default_info()
+        if sim_info is None:
+            sim_info = gi.info
+        self.gi = gi
+        self._gamepad = gamepad
+        self.sim_info = sim_info
+
+        self.ray_count = ray_count
+        self.FOV_degrees = FOV_degrees
+        self.max_distance = max_distance
+        self.max_speed = max_speed
+        if reward is None:
+            reward = default_pipeline(progress_weight, offtrack_penalty,
+                                      damage_weight, damage_limit)
+        elif isinstance(reward, dict):
+            reward = RewardPipeline.from_config(reward)
+        self.reward = reward
+        # get_sensors arguments, when a reward term uses the sensor mean angle
+        self.sensor_params = sensor_params or {'min_sensor_distance': 50,
+                                               'min_sensor_count': 10,
+                                               'FOV_degrees': 180}
+        self.max_episode_steps = max_episode_steps
+        self.packet_timeout = packet_timeout
+
+        self.observation_names = self.base_observation_names + \
+            [f'ray_{i}' for i in range(ray_count)]
+        self.observation = np.zeros(len(self.observation_names), dtype=np.float32)
+        self.latency = LatencyTracker(1 / physics_hz)
+
+        self.steps = 0
+        self.packet_id = None
+        self.snapshot = None
+
+    @ property
+    def gamepad(self):
+        if self._gamepad is None:
+            from gamepad import Gamepad
+            self._gamepad = Gamepad()
+        return self._gamepad
+
+    def _next_frame(self):
+        packet_id = self.sim_info.wait_for_packet(self.packet_id, self.packet_timeout)
+        if packet_id is None:
+            raise TimeoutError(
+                f'No physics packet for {self.packet_timeout}s, is the game running?')
+        arrival = time.perf_counter()
+        self.snapshot = self.gi.freeze()
+        self.packet_id = self.snapshot.physics.packetId
+        return arrival
+
+    def _observe(self):
+        '''Fills the observation buffer, returns (reward, terminated).'''
+        gi = self.gi
+        obs = self.observation
+        obs[0] = gi.speed / self.max_speed
+        obs[1] = gi.steer_angle
+        obs[2] = gi.track_completion
+        obs[3] = gi.performance_meter
+        obs[4] = gi.wheels_offtrack / 4
+        obs[5:9] = gi.wheel_slip
+        distances, _ = gi.get_lidar(self.ray_count, self.FOV_degrees, self.max_distance)
+        np.divide(distances, self.max_distance, out=obs[9:])
+
+        if 'sensor_mean_angle' in self.reward.signals:
+            gi.get_sensors(**self.sensor_params)
+        return self.reward.step(live_signals(gi, self.reward.signals))
+
+    def _info(self):
+        return {'packet_id': self.packet_id, 'steps': self.steps,
+                'consistent': self.snapshot.consistent,
+                'reward_terms': self.reward.components}
+
+    def reset(self):
+        '''Resyncs to the next physics packet, returns (observation, info).'''
+        self.steps = 0
+        self.packet_id = self.sim_info.physics.packetId
+        self._next_frame()
+        self.reward.reset()
+        self._observe()
+        return self.observation, self._info()
+
+    def step(self, action):
+        '''
+        Applies (steer, gas, brake) and observes the next physics packet.
+
+        Returns (observation, reward, terminated, truncated, info). The
+        latency recorded is from the new packet to the returned
+        observation, `latency_percentiles` reports it.
+        '''
+        steer, gas, brake = action
+        self.gamepad.apply_input(float(steer), float(gas), float(brake))
+
+        start = self._next_frame()
+        reward, terminated = self._observe()
+        self.steps += 1
+        truncated = self.max_episode_steps is not None and \
+            self.steps >= self.max_episode_steps
+        self.latency.add(time.perf_counter() - start)
+        return self.observation, reward, terminated, truncated, self._info()
+
+    def latency_percentiles(self):
+        '''Step latency p50/p95/p99 in ms, plus overruns of the physics tick.'''
+        result = self.latency.percentiles()
+        result['overruns'] = self.latency.overruns
+        result['steps'] = self.latency.count
+        return result
+
+    def close(self):
+        self.gi.thaw()
@@ -0,0 +1,342 @@
+'''
+One reader process fanning live telemetry out to any number of consumers.
+
+`TelemetryPublisher` polls the AC pages once per physics `packetId`,
+computes the derived data (lidar, sensor mean angle) once and writes the
+frame into a ring of slots in `multiprocessing.shared_memory`. Every slot
+is a seqlock: its sequence is odd while it is being written and
+2 * frame + 2 once frame `frame` is complete. Consumers never take a lock,
+they copy a slot with one memcpy and check the sequence did not move::
+
+    python fanout.py --slots 64                 # the single reader
+
+    reader = TelemetryReader()                  # in each consumer
+    frame = reader.next()                       # or reader.latest()
+    speed = frame['physics']['speedKmh'][0]
+    lidar = frame['lidar'][0]
+'''
+import argparse
+import os
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from profiling import timed
+from sim_info import GRAPHICS_DTYPE, PHYSICS_DTYPE, STATIC_DTYPE, Snapshot
+
+DEFAULT_NAME = 'rl_driver_telemetry'
+MAGIC = 0x52444654
+VERSION = 2
+
+HEADER_DTYPE = np.dtype([('magic', '<u4'), ('version', '<u4'), ('slots', '<u4'),
+                         ('ray_count', '<u4'), ('frame', '<i8'), ('static_seq', '<u8'),
+                         ('publisher_pid', '<i8'), ('tracker', '<u8'), ('padding', 'V16')])
+
+
+def _round_up(size, alignment=64):
+    return -(-size // alignment) * alignment
+
+
+def frame_dtype(ray_count):
+    '''One published frame: the pages and the derived data.'''
+    return np.dtype([('time', '<f8'),
+                     ('physics', PHYSICS_DTYPE),
+                     ('graphics', GRAPHICS_DTYPE),
+                     ('lidar', '<f4', (ray_count,)),
+                     ('lidar_hits', '<f4', (ray_count, 2)),
+                     ('sensor_mean_angle', '<f8'),
+                     ('triggered_sensors', '<i4')])
+
+
+class _Layout:
+    '''Offsets of the header, static page and slots in the block.'''
+
+    def __init__(self, slots, ray_count):
+        self.slots = slots
+        self.ray_count = ray_count
+        self.frame_dtype = frame_dtype(ray_count)
+        self.static_offset = HEADER_DTYPE.itemsize
+        self.slots_offset = _round_up(self.static_offset + STATIC_DTYPE.itemsize)
+        # Slot: 8 byte sequence then the frame, cache line aligned
+        self.slot_size = _round_up(8 + self.frame_dtype.itemsize)
+        self.size = self.slots_offset + slots * self.slot_size
+
+    def views(self, buffer):
+        '''(header record, static bytes, slot sequences, slot frame bytes).'''
+        header = np.ndarray(1, HEADER_DTYPE, buffer)
+        static = np.ndarray(STATIC_DTYPE.itemsize, np.uint8, buffer, self.static_offset)
+        slots = np.ndarray((self.slots, self.slot_size), np.uint8, buffer, self.slots_offset)
+        sequences = slots[:, :8].view('<u8')[:, 0]
+        frames = slots[:, 8:8 + self.frame_dtype.itemsize]
+        return header, static, sequences, frames
+
+
+def _tracker_id():
+    '''Inode of this process's resource tracker pipe, 0 without one (Windows).'''
+    if os.name != 'posix':
+        return 0
+    return os.fstat(resource_tracker.getfd()).st_ino
+
+
+def _publisher_alive(pid):
+    if os.name != 'posix':
+        # Windows frees a block with its last handle, an existing one is in use
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        memory = shared_memory.SharedMemory(name=name)
+    # Before Python 3.13 attaching registers the block with this process's
+    # resource tracker, which would unlink it at exit. Processes started by
+    # multiprocessing from the publisher share its tracker, where the
+    # registration is the publisher's own and has to stay.
+    tracker = 0
+    if memory.size >= HEADER_DTYPE.itemsize:
+        tracker = int(np.ndarray(1, HEADER_DTYPE, memory.buf)[0]['tracker'])
+    if os.name == 'posix' and tracker != _tracker_id():
+        resource_tracker.unregister(memory._name, 'shared_memory')
+    return memory
+
+
+class TelemetryPublisher:
+    '''
+    The single reader of the AC pages, see the module docstring.
+
+    Owns the shared memory block and unlinks it on `close`.
+    '''
+
+    def __init__(self, gi=None, name=DEFAULT_NAME, slots=64, ray_count=64,
+                 FOV_degrees=180, max_distance=200, sensor_params=None):
+        if gi is None:
+            from ac_inputs import default_info
+            gi = default_info()
+        self.gi = gi
+        self.name = name
+        self.FOV_degrees = FOV_degrees
+        self.max_distance = max_distance
+        self.sensor_params = sensor_params or {'min_sensor_distance': 50,
+                                               'min_sensor_count': 10,
+                                               'FOV_degrees': 180}
+        self.layout = _Layout(slots, ray_count)
+        try:
+            self.memory = shared_memory.SharedMemory(name, create=True, size=self.layout.size)
+        except FileExistsError:
+            existing = _attach(name)
+            header = np.ndarray(1, HEADER_DTYPE, existing.buf)[0].copy()
+            existing.close()
+            if header['magic'] == MAGIC and _publisher_alive(int(header['publisher_pid'])):
+                raise FileExistsError(f"Telemetry publisher {header['publisher_pid']} "
+                                      f'is already running on {name!r}')
+            # Left behind by a publisher that did not exit cleanly
+            stale = shared_memory.SharedMemory(name)
+            stale.unlink()
+            stale.close()
+            self.memory = shared_memory.SharedMemory(name, create=True, size=self.layout.size)
+        self.header, self._static, self._sequences, self._frames = \
+            self.layout.views(self.memory.buf)
+        self._frame = np.zeros(1, self.layout.frame_dtype)
+        self._frame_bytes = self._frame.view(np.uint8)
+        self.frame = -1
+        self.packet_id = None
+
+        header = self.header[0]
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['slots'] = slots
+        header['ray_count'] = ray_count
+        header['frame'] = -1
+        header['publisher_pid'] = os.getpid()
+        header['tracker'] = _tracker_id()
+
+    def _publish_static(self, static):
+        if np.array_equal(self._static, static):
+            return
+        header = self.header[0]
+        header['static_seq'] += 1
+        self._static[:] = static
+        header['static_seq'] += 1
+
+    @ timed('fanout.publish')
+    def publish(self, snapshot=None):
+        '''Freezes a snapshot, computes the derived data and publishes it.'''
+        gi = self.gi
+        snapshot = gi.freeze(snapshot)
+        self.packet_id = snapshot.physics.packetId
+        frame = self._frame[0]
+        frame['time'] = time.perf_counter()
+        frame['physics'] = snapshot.physics.data[0]
+        frame['graphics'] = snapshot.graphics.data[0]
+        distances, hits = gi.get_lidar(self.layout.ray_count, self.FOV_degrees, self.max_distance)
+        frame['lidar'] = distances
+        frame['lidar_hits'] = hits
+        _, triggered = gi.get_sensors(**self.sensor_params)
+        frame['sensor_mean_angle'] = gi.prev_sensor_mean_angle
+        # [sensor_distance, *triggered angles, mean angle]
+        frame['triggered_sensors'] = len(triggered) - 2
+        self._publish_static(snapshot.static.data.view(np.uint8))
+
+        self.frame += 1
+        slot = self.frame % self.layout.slots
+        self._sequences[slot] = 2 * self.frame + 1
+        self._frames[slot] = self._frame_bytes
+        self._sequences[slot] = 2 * self.frame + 2
+        self.header[0]['frame'] = self.frame
+        return self.frame
+
+    def run(self, duration=None, timeout=1.0):
+        '''Publishes every new physics packet, for `duration` seconds or forever.'''
+        sim_info = self.gi.info
+        deadline = None if duration is None else time.perf_counter() + duration
+        while deadline is None or time.perf_counter() < deadline:
+            packet_id = sim_info.wait_for_packet(self.packet_id, timeout)
+            if packet_id is not None:
+                self.publish()
+
+    def close(self):
+        self.header = self._static = self._sequences = self._frames = None
+        self.memory.close()
+        self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TelemetryReader:
+    '''
+    Consumer side, lock free. Frames are returned as one-element
+    `frame_dtype` arrays, copied out of the ring.
+
+    `dropped` counts frames that were overwritten before `next` got to them.
+    '''
+
+    def __init__(self, name=DEFAULT_NAME, timeout=5.0, poll_interval=0.0002):
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                self.memory = _attach(name)
+                break
+            except FileNotFoundError:
+                if time.perf_counter() >= deadline:
+                    raise TimeoutError(f'No telemetry publisher {name!r}, is fanout.py running?')
+                time.sleep(0.05)
+        header = np.ndarray(1, HEADER_DTYPE, self.memory.buf)[0]
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            raise ValueError(f'{name!r} is not a version {VERSION} telemetry ring')
+        self.layout = _Layout(int(header['slots']), int(header['ray_count']))
+        self.header, self._static, self._sequences, self._frames = \
+            self.layout.views(self.memory.buf)
+        self.poll_interval = poll_interval
+        # `next` starts at the newest frame, not at the oldest still in the ring
+        self.frame = max(self.published - 1, -1)
+        self.dropped = 0
+
+    @ property
+    def published(self):
+        '''Number of the newest complete frame, -1 before the first.'''
+        return int(self.header[0]['frame'])
+
+    def read(self, frame):
+        '''Copy of frame `frame`, None once it has been overwritten.'''
+        slot = frame % self.layout.slots
+        expected = 2 * frame + 2
+        if self._sequences[slot] != expected:
+            return None
+        data = self._frames[slot].copy()
+        if self._sequences[slot] != expected:
+            return None
+        return data.view(self.layout.frame_dtype)
+
+    def latest(self):
+        '''The newest frame, None before the first one.'''
+        while True:
+            frame = self.published
+            if frame < 0:
+                return None
+            data = self.read(frame)
+            if data is not None:
+                self.frame = frame
+                return data
+
+    def next(self, timeout=1.0):
+        '''
+        The frame after the last one read, waiting for it. Skips ahead to
+        the oldest frame still in the ring when this consumer fell behind.
+        Returns None on timeout.
+        '''
+        deadline = time.perf_counter() + timeout
+        while True:
+            published = self.published
+            if published > self.frame and published >= 0:
+                target = max(self.frame + 1, published - self.layout.slots + 2)
+                data = self.read(target)
+                if data is not None:
+                    self.dropped += target - self.frame - 1
+                    self.frame = target
+                    return data
+                # Overwritten while reading, retry further ahead
+                self.frame = max(self.frame, target - 1)
+                continue
+            if time.perf_counter() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def frames(self, timeout=1.0):
+        '''Yields every frame, until none comes for `timeout` seconds.'''
+        while True:
+            data = self.next(timeout)
+            if data is None:
+                return
+            yield data
+
+    def static(self):
+        '''Copy of the static page as a one-element STATIC_DTYPE array.'''
+        while True:
+            sequence = self.header[0]['static_seq']
+            data = self._static.copy()
+            if sequence % 2 == 0 and self.header[0]['static_seq'] == sequence:
+                return data.view(STATIC_DTYPE)
+
+    def snapshot(self, data):
+        '''`sim_info.Snapshot` of a frame, for `GetInfo.freeze`.'''
+        return Snapshot(data['physics'], data['graphics'], self.static())
+
+    def close(self):
+        self.header = self._static = self._sequences = self._frames = None
+        self.memory.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--name', default=DEFAULT_NAME)
+    parser.add_argument('--slots', type=int, default=64)
+    parser.add_argument('--rays', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=None, help='seconds, default forever')
+    args = parser.parse_args()
+
+    with TelemetryPublisher(name=args.name, slots=args.slots, ray_count=args.rays) as publisher:
+        print(f'Publishing telemetry to {args.name!r}, {args.slots} slots')
+        try:
+            publisher.run(args.duration)
+        except KeyboardInterrupt:
+            pass
+        print(f'Published {publisher.frame + 1} frames')
@@ -0,0 +1,171 @@
+'''
+Offline recomputation of the sensor features of recorded trajectories.
+
+Poses (carCoordinates, heading, speedKmh) come from a recorder directory
+or an archive. Sensors are recomputed in vectorized chunks, spread over a
+process pool whose workers read the track mask from one shared memory
+block. The features are written as an archive aligned frame for frame
+with the source::
+
+    python features.py recording session.features.rla --track monza \\
+        --min-sensor-distance 50 --min-sensor-count 10 --fov 180
+'''
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from archive import Archive, ArchiveWriter
+from sensors import SensorEngine
+
+POSE_COLUMNS = {'coordinates': 'graphics.carCoordinates',
+                'heading': 'physics.heading',
+                'speed': 'physics.speedKmh'}
+# Kept in the feature archive so it can be queried like the source
+INDEX_COLUMNS = {'time': 'time',
+                 'lap': 'graphics.completedLaps',
+                 'position': 'graphics.normalizedCarPosition'}
+
+_worker = {}
+
+
+def load_poses(source):
+    '''
+    Pose and index columns of a recorder directory or an archive,
+    as {name: array} with the names of POSE_COLUMNS and INDEX_COLUMNS.
+    '''
+    columns = {**POSE_COLUMNS, **INDEX_COLUMNS}
+    if os.path.isdir(source):
+        from archive import column_values
+        from recorder import load_recording
+        frames = load_recording(source, mmap_mode='r')
+        return {name: np.asarray(column_values(frames, path))
+                for name, path in columns.items()}
+    with Archive(source) as archive:
+        data = archive.read(list(columns.values()))
+    return {name: data[path] for name, path in columns.items()}
+
+
+def fill_mean_angle(mean_angle, initial=0.0):
+    '''Replaces NaN with the previous value, like `GetInfo.get_sensors`.'''
+    valid = ~np.isnan(mean_angle)
+    last = np.where(valid, np.arange(len(mean_angle)), -1)
+    np.maximum.accumulate(last, out=last)
+    return np.where(last >= 0, mean_angle[np.maximum(last, 0)], initial)
+
+
+def _init_worker(name, shape, map_data):
+    # Workers share the parent's resource tracker, the parent unlinks the block
+    memory = shared_memory.SharedMemory(name=name)
+    mask = np.ndarray(shape, dtype=bool, buffer=memory.buf)
+    _worker['memory'] = memory
+    _worker['engine'] = SensorEngine(mask, map_data)
+
+
+def _compute(coords, headings, speeds, params):
+    return _worker['engine'].get_sensors_batch(coords, headings, speeds, **params)
+
+
+def compute_features(mask, map_data, coords, headings, speeds, chunk=65536,
+                     workers=None, **params):
+    '''
+    Sensor features of N poses, see `SensorEngine.get_sensors_batch`
+    for the parameters and the columns.
+
+    With more than one worker the chunks go to a process pool sharing
+    `mask` through shared memory. The mean angle is filled forward.
+    '''
+    count = len(headings)
+    starts = range(0, count, chunk)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(starts) == 1:
+        engine = SensorEngine(mask, map_data)
+        parts = [engine.get_sensors_batch(coords[i:i + chunk], headings[i:i + chunk],
+                                          speeds[i:i + chunk], **params)
+                 for i in starts]
+    else:
+        mask = np.ascontiguousarray(mask, dtype=bool)
+        memory = shared_memory.SharedMemory(create=True, size=max(mask.nbytes, 1))
+        try:
+            np.ndarray(mask.shape, dtype=bool, buffer=memory.buf)[...] = mask
+            with ProcessPoolExecutor(min(workers, len(starts)), initializer=_init_worker,
+                                     initargs=(memory.name, mask.shape, map_data)) as pool:
+                futures = [pool.submit(_compute, coords[i:i + chunk], headings[i:i + chunk],
+                                       speeds[i:i + chunk], params)
+                           for i in starts]
+                parts = [future.result() for future in futures]
+        finally:
+            memory.close()
+            memory.unlink()
+
+    if not parts:
+        return SensorEngine(mask, map_data).get_sensors_batch(
+            coords, headings, speeds, **params)
+    width = max(part['on_track'].shape[1] for part in parts)
+    on_track = np.zeros((count, width), dtype=bool)
+    for i, part in zip(starts, parts):
+        on_track[i:i + len(part['on_track']), :part['on_track'].shape[1]] = part['on_track']
+    features = {name: np.concatenate([part[name] for part in parts])
+                for name in ('sensor_distance', 'sensor_count', 'sensor_mean_angle')}
+    features['sensor_mean_angle'] = fill_mean_angle(features['sensor_mean_angle'])
+    features['on_track'] = on_track
+    return features
+
+
+def write_features(path, poses, features, chunk_frames=8192):
+    '''
+    Writes `features` as 'features.<name>' columns of an archive, with
+    the time, lap and position of `poses` so the same queries apply.
+    '''
+    count = len(poses['heading'])
+    dtype = [('time', np.float64),
+             ('graphics', [('completedLaps', poses['lap'].dtype),
+                           ('normalizedCarPosition', poses['position'].dtype)]),
+             ('features', [(name, values.dtype, values.shape[1:])
+                           for name, values in features.items()])]
+    frames = np.zeros(count, dtype=dtype)
+    frames['time'] = poses['time']
+    frames['graphics']['completedLaps'] = poses['lap']
+    frames['graphics']['normalizedCarPosition'] = poses['position']
+    for name, values in features.items():
+        frames['features'][name] = values
+    with ArchiveWriter(path, chunk_frames) as writer:
+        writer.append(frames)
+
+
+def recompute(source, path, mask, map_data, chunk=65536, workers=None, **params):
+    '''Recomputes the features of `source` into the archive `path`, returns them.'''
+    poses = load_poses(source)
+    features = compute_features(mask, map_data, poses['coordinates'], poses['heading'],
+                                poses['speed'], chunk, workers, **params)
+    write_features(path, poses, features)
+    return features
+
+
+if __name__ == '__main__':
+    from content_index import track_paths
+    from track_geometry import load_track
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('source', help='recorder directory or archive')
+    parser.add_argument('output', help='feature archive to write')
+    parser.add_argument('--track', required=True)
+    parser.add_argument('--layout', default='')
+    parser.add_argument('--min-sensor-distance', type=float, default=10)
+    parser.add_argument('--min-sensor-count', type=int, default=5)
+    parser.add_argument('--fov', type=float, default=90, help='degrees')
+    parser.add_argument('--sigma', type=float, default=None,
+                        help='Gaussian weighting width, default the sensor count')
+    parser.add_argument('--chunk', type=int, default=65536)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    geometry = load_track(*track_paths(args.track, args.layout), args.track, args.layout)
+    features = recompute(args.source, args.output, geometry.mask, geometry.map_data,
+                         args.chunk, args.workers,
+                         min_sensor_distance=args.min_sensor_distance,
+                         min_sensor_count=args.min_sensor_count,
+                         FOV_degrees=args.fov, sigma=args.sigma)
+    print(f"Wrote {len(features['sensor_count'])} frames to {args.output}")
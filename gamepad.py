@@ -1,16 +1,144 @@
-import vgamepad as vg
+import threading
+import time
 
+from profiling import LatencyTracker, timed
+
+STEER_STEPS = 32767  # Joystick axis resolution
+PEDAL_STEPS = 255    # Trigger resolution
+
+
+class VGamepadBackend:
+    '''Virtual Xbox 360 controller through vgamepad (Windows only).'''
 
-class Gamepad():
     def __init__(self) -> None:
+        import vgamepad as vg
         self.gamepad = vg.VX360Gamepad()
 
-    def apply_input(self, steer: float, gas: float, brake: float):
-        assert steer >= -1 or steer <= 1, 'Steering out of bounds [-1, 1]'
-        assert gas >= 0 or gas <= 1, 'Acceleration out of bounds [0, 1]'
-        assert brake >= 0 or brake <= 1, 'Brake out of bounds [0, 1]'
-
+    @ timed('gamepad.submit')
+    def submit(self, steer: float, gas: float, brake: float):
         self.gamepad.left_joystick_float(steer, 0)   # Steering      [-1, 1]
         self.gamepad.left_trigger_float(gas)         # Acceleration  [0 , 1]
         self.gamepad.right_trigger_float(brake)      # Brake         [0 , 1]
         self.gamepad.update()                        # Submit input
+
+
+class RecordingBackend:
+    '''Records submitted inputs instead of driving a device, for tests and Linux.'''
+
+    def __init__(self) -> None:
+        self.commands = []
+
+    def submit(self, steer: float, gas: float, brake: float):
+        self.commands.append((time.perf_counter(), steer, gas, brake))
+
+
+def check_input(steer: float, gas: float, brake: float):
+    if not -1 <= steer <= 1:
+        raise ValueError(f'Steering out of bounds [-1, 1]: {steer}')
+    if not 0 <= gas <= 1:
+        raise ValueError(f'Acceleration out of bounds [0, 1]: {gas}')
+    if not 0 <= brake <= 1:
+        raise ValueError(f'Brake out of bounds [0, 1]: {brake}')
+
+
+def quantize(steer: float, gas: float, brake: float):
+    '''Rounds inputs to what the device can actually represent.'''
+    return (round(steer * STEER_STEPS) / STEER_STEPS,
+            round(gas * PEDAL_STEPS) / PEDAL_STEPS,
+            round(brake * PEDAL_STEPS) / PEDAL_STEPS)
+
+
+class Gamepad():
+    def __init__(self, backend=None) -> None:
+        self.backend = VGamepadBackend() if backend is None else backend
+
+    @ timed('gamepad.apply_input')
+    def apply_input(self, steer: float, gas: float, brake: float):
+        check_input(steer, gas, brake)
+        self.backend.submit(steer, gas, brake)
+
+
+class AsyncGamepad(Gamepad):
+    '''
+    Non-blocking `apply_input`, submitted from a dedicated writer thread.
+
+    Inputs are quantized to the device resolution and dropped when they
+    equal the last one. Bursts coalesce to the latest command, the writer
+    only ever submits the newest. Command-to-submit latency is tracked
+    in `latency`.
+
+    An exception from the backend stops the writer, it is raised again by
+    every later `apply_input` and by `close`. After `close`, `apply_input`
+    raises RuntimeError.
+    '''
+
+    def __init__(self, backend=None, budget=0.002) -> None:
+        super().__init__(backend)
+        self.latency = LatencyTracker(budget)
+        self.submitted = 0
+        self.suppressed = 0
+        self.coalesced = 0
+        self._last = None
+        self._pending = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = True
+        self._error = None
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+
+    @ timed('gamepad.apply_input')
+    def apply_input(self, steer: float, gas: float, brake: float):
+        if self._error is not None:
+            raise self._error
+        if not self._running:
+            raise RuntimeError('Input applied to a closed AsyncGamepad')
+        check_input(steer, gas, brake)
+        command = quantize(steer, gas, brake)
+        if command == self._last:
+            self.suppressed += 1
+            return
+        self._last = command
+
+        with self._lock:
+            if not self._running:
+                raise RuntimeError('Input applied to a closed AsyncGamepad')
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = (command, time.perf_counter())
+        self._wake.set()
+
+    def _write(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            # Taken together, a command issued before `close` is always submitted
+            with self._lock:
+                running = self._running
+                pending, self._pending = self._pending, None
+            if pending is not None:
+                command, issued = pending
+                try:
+                    self.backend.submit(*command)
+                except Exception as error:
+                    self._error = error
+                    break
+                self.latency.add(time.perf_counter() - issued)
+                self.submitted += 1
+            if not running:
+                break
+
+    def close(self):
+        '''Submits the last pending command and stops the writer.'''
+        with self._lock:
+            self._running = False
+        self._wake.set()
+        self._writer.join()
+        if self._error is not None:
+            raise self._error
+
+    def stats(self):
+        return {'submitted': self.submitted,
+                'suppressed': self.suppressed,
+                'coalesced': self.coalesced,
+                'latency': self.latency.percentiles()}
@@ -0,0 +1,247 @@
+'''
+Derived kinematics streamed frame by frame, with a batch mode for
+recordings that gives the same values.
+
+The raw physics page has heading, world velocity, steering and wheel slip.
+From those `KinematicsEngine` derives yaw rate, car frame accelerations,
+jerk and steering rate, EMAs and rolling statistics over a fixed window,
+all kept in one preallocated vector::
+
+    engine = KinematicsEngine(window=64)
+    values = engine.update(time, gi._physics)   # same array every frame
+    yaw_rate = values[engine.index['yaw_rate']]
+
+Every update is O(1): rolling sums are updated with the entering and
+leaving sample, rolling min/max use monotonic queues. Frames whose time
+did not advance (a repeated packet) return the previous vector unchanged.
+'''
+from collections import deque
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Per-frame values, derivatives are 0 on the first frame
+BASE = ['speed', 'yaw_rate', 'long_acc', 'lat_acc', 'long_jerk', 'lat_jerk',
+        'steer', 'steer_rate', 'slip']
+EMA = ['yaw_rate', 'long_acc', 'lat_acc', 'slip']
+ROLLING = ['yaw_rate', 'lat_acc', 'steer_rate']
+STATS = ['mean', 'var', 'min', 'max']
+
+FEATURES = BASE + [f'{name}_ema' for name in EMA] + \
+    [f'{name}_{stat}' for name in ROLLING for stat in STATS]
+
+_EMA_INDEX = np.array([BASE.index(name) for name in EMA])
+_ROLLING_INDEX = np.array([BASE.index(name) for name in ROLLING])
+
+
+def wrap_angle(angle):
+    return (angle + np.pi) % (2 * np.pi) - np.pi
+
+
+class RollingStats:
+    '''
+    Mean, variance, min and max of the last `size` samples of a few
+    channels, updated in O(1) per sample.
+    '''
+
+    def __init__(self, size, channels):
+        self.size = size
+        self.buffer = np.zeros((size, channels))
+        self.sum = np.zeros(channels)
+        self.sum_sq = np.zeros(channels)
+        self.count = 0
+        # Monotonic queues of (sample number, value) per channel
+        self.minima = [deque() for _ in range(channels)]
+        self.maxima = [deque() for _ in range(channels)]
+        self.stats = np.zeros((channels, len(STATS)))
+
+    def add(self, values):
+        slot = self.count % self.size
+        old = self.buffer[slot]
+        self.sum += values - old
+        self.sum_sq += values * values - old * old
+        self.buffer[slot] = values
+        n = self.count
+        self.count += 1
+
+        filled = min(self.count, self.size)
+        mean = self.sum / filled
+        self.stats[:, 0] = mean
+        self.stats[:, 1] = np.maximum(self.sum_sq / filled - mean * mean, 0)
+        first = self.count - filled
+        for channel, value in enumerate(values.tolist()):
+            for queue, column, keep in ((self.minima[channel], 2, float.__lt__),
+                                        (self.maxima[channel], 3, float.__gt__)):
+                while queue and not keep(queue[-1][1], value):
+                    queue.pop()
+                queue.append((n, value))
+                if queue[0][0] < first:
+                    queue.popleft()
+                self.stats[channel, column] = queue[0][1]
+        return self.stats
+
+    def reset(self):
+        self.buffer[:] = 0
+        self.sum[:] = 0
+        self.sum_sq[:] = 0
+        self.count = 0
+        for queue in self.minima + self.maxima:
+            queue.clear()
+
+
+def rolling_stats(values, size):
+    '''
+    Batch `RollingStats` over (N, channels) samples, (N, channels, 4).
+
+    Sums are accumulated in the same order as the streaming updates, so
+    the results are identical.
+    '''
+    count = len(values)
+    old = np.zeros_like(values)
+    if count > size:
+        old[size:] = values[:-size]
+    sums = np.cumsum(values - old, axis=0)
+    sums_sq = np.cumsum(values * values - old * old, axis=0)
+    filled = np.minimum(np.arange(1, count + 1), size)[:, None]
+
+    stats = np.empty(values.shape + (len(STATS),))
+    mean = sums / filled
+    stats[..., 0] = mean
+    stats[..., 1] = np.maximum(sums_sq / filled - mean * mean, 0)
+    head = min(count, size - 1)
+    stats[:head, :, 2] = np.minimum.accumulate(values[:head], axis=0)
+    stats[:head, :, 3] = np.maximum.accumulate(values[:head], axis=0)
+    if count >= size:
+        windows = sliding_window_view(values, size, axis=0)
+        stats[size - 1:, :, 2] = windows.min(axis=-1)
+        stats[size - 1:, :, 3] = windows.max(axis=-1)
+    return stats
+
+
+class KinematicsEngine:
+    '''
+    Incremental derived kinematics, see FEATURES for the layout of `values`.
+
+    Accelerations are in m/s^2 in the car frame, longitudinal positive
+    forward and lateral positive to the right, like the local map crops.
+    '''
+
+    def __init__(self, window=64, ema_alpha=0.1):
+        self.window = window
+        self.ema_alpha = ema_alpha
+        self.index = {name: i for i, name in enumerate(FEATURES)}
+        self.values = np.zeros(len(FEATURES))
+        self.rolling = RollingStats(window, len(ROLLING))
+        self.reset()
+
+    @ property
+    def names(self):
+        return FEATURES
+
+    def reset(self):
+        self.values[:] = 0
+        self.rolling.reset()
+        self._time = None
+        self._state = None
+        self._ema = None
+
+    def update(self, time, physics):
+        '''Next frame from a physics page (ctypes, `Page` or record).'''
+        return self.update_values(time, physics.heading, physics.velocity[0],
+                                  physics.velocity[2], physics.steerAngle,
+                                  np.mean(np.asarray(physics.wheelSlip[:4], dtype=np.float64)))
+
+    def update_values(self, time, heading, velocity_x, velocity_z, steer, slip):
+        '''Next frame from raw values, returns `values` (reused).'''
+        time = float(time)
+        if self._time is not None and time <= self._time:
+            return self.values
+        base = self.values[:len(BASE)]
+        base[:] = _derive(np.float64(heading), np.float64(velocity_x),
+                          np.float64(velocity_z), np.float64(steer), np.float64(slip),
+                          None if self._time is None else time - self._time, self._state)
+        self._state = (np.float64(heading), np.float64(velocity_x),
+                       np.float64(velocity_z), base[2], base[3], np.float64(steer))
+        self._time = time
+
+        x = base[_EMA_INDEX]
+        if self._ema is None:
+            self._ema = x.copy()
+        else:
+            self._ema += self.ema_alpha * (x - self._ema)
+        start = len(BASE)
+        self.values[start:start + len(EMA)] = self._ema
+        self.values[start + len(EMA):] = self.rolling.add(base[_ROLLING_INDEX]).reshape(-1)
+        return self.values
+
+    def batch(self, time, heading, velocity_x, velocity_z, steer, slip):
+        '''
+        Values of every frame of a recording as (N, len(FEATURES)), the
+        same as streaming the frames through a fresh engine.
+        '''
+        time = np.asarray(time, dtype=np.float64)
+        count = len(time)
+        out = np.zeros((count, len(FEATURES)))
+        if not count:
+            return out
+        # Frames whose time did not advance repeat the previous row
+        keep = np.ones(count, dtype=bool)
+        keep[1:] = time[1:] > np.maximum.accumulate(time)[:-1]
+        rows = np.flatnonzero(keep)
+        columns = [np.asarray(values, dtype=np.float64)[rows]
+                   for values in (heading, velocity_x, velocity_z, steer, slip)]
+        heading, velocity_x, velocity_z, steer, slip = columns
+        time = time[rows]
+
+        dt = np.diff(time)
+        first = _derive(heading[:1], velocity_x[:1], velocity_z[:1], steer[:1], slip[:1],
+                        None, None)
+        rest = _derive(heading[1:], velocity_x[1:], velocity_z[1:], steer[1:], slip[1:],
+                       dt, (heading[:-1], velocity_x[:-1], velocity_z[:-1], 0.0, 0.0, steer[:-1]))
+        base = np.stack([np.concatenate([f, r]) for f, r in zip(first, rest)], axis=1)
+        # Jerk needs the acceleration of the previous frame
+        base[1:, 4] = (base[1:, 2] - base[:-1, 2]) / dt
+        base[1:, 5] = (base[1:, 3] - base[:-1, 3]) / dt
+
+        kept = np.zeros((len(rows), len(FEATURES)))
+        kept[:, :len(BASE)] = base
+        ema = kept[:, len(BASE):len(BASE) + len(EMA)]
+        x = base[:, _EMA_INDEX]
+        ema[0] = x[0]
+        for i in range(1, len(rows)):
+            ema[i] = ema[i - 1] + self.ema_alpha * (x[i] - ema[i - 1])
+        kept[:, len(BASE) + len(EMA):] = rolling_stats(
+            base[:, _ROLLING_INDEX], self.window).reshape(len(rows), -1)
+
+        out[:] = kept[np.cumsum(keep) - 1]
+        return out
+
+    def batch_frames(self, frames):
+        '''`batch` over recorder frames (FRAME_DTYPE).'''
+        physics = frames['physics']
+        return self.batch(frames['time'], physics['heading'], physics['velocity'][:, 0],
+                          physics['velocity'][:, 2], physics['steerAngle'],
+                          physics['wheelSlip'][:, :4].astype(np.float64).mean(axis=1))
+
+
+def _derive(heading, velocity_x, velocity_z, steer, slip, dt, state):
+    '''
+    BASE values from the current frame and the previous `state`
+    (heading, velocity_x, velocity_z, long_acc, lat_acc, steer), elementwise
+    so the streaming and batch paths share the arithmetic.
+    '''
+    speed = np.hypot(velocity_x, velocity_z)
+    if state is None:
+        zero = heading * 0
+        return speed, zero, zero, zero, zero, zero, steer, zero, slip
+    prev_heading, prev_vx, prev_vz, prev_long, prev_lat, prev_steer = state
+    yaw_rate = wrap_angle(heading - prev_heading) / dt
+    acc_x = (velocity_x - prev_vx) / dt
+    acc_z = (velocity_z - prev_vz) / dt
+    sin_h = np.sin(heading)
+    cos_h = np.cos(heading)
+    # Forward is (-sin h, cos h), right is (-cos h, -sin h)
+    long_acc = -acc_x * sin_h + acc_z * cos_h
+    lat_acc = -acc_x * cos_h - acc_z * sin_h
+    return (speed, yaw_rate, long_acc, lat_acc, (long_acc - prev_long) / dt,
+            (lat_acc - prev_lat) / dt, steer, (steer - prev_steer) / dt, slip)
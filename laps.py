@@ -0,0 +1,253 @@
+'''
+Lap segmentation of a telemetry stream and delta-to-best curves.
+
+`LapSegmenter` is fed one frame at a time and splits the stream at the
+start/finish line, found from `completedLaps` going up or
+`normalizedCarPosition` wrapping from ~1 to ~0, whichever comes first.
+It keeps an index of every lap (frame offsets, lap and sector times) and
+the position/time trace of each lap.
+
+Delta-to-best curves of many laps are one `np.interp` over a shared
+position grid::
+
+    segmenter = LapSegmenter()
+    while running:
+        segmenter.update_page(time.perf_counter(), gi._graphics)
+    deltas = delta_to_best(segmenter.laps)   # (laps, grid) seconds
+'''
+import numpy as np
+
+GRID_SIZE = 1000
+
+LAP_DTYPE = [('lap', np.int32), ('start', np.int64), ('stop', np.int64),
+             ('start_time', np.float64), ('time', np.float64), ('complete', bool)]
+
+
+class Lap:
+    '''
+    One lap of the stream, frames [start, stop).
+
+    position: unwrapped normalized position per frame, elapsed: seconds
+    since the lap started, sectors: sector times in seconds.
+    '''
+
+    def __init__(self, number, start, start_time, complete):
+        self.number = number
+        self.start = start
+        self.stop = start
+        self.start_time = start_time
+        self.time = 0.0
+        self.complete = complete
+        self.sectors = []
+        self.position = None
+        self.elapsed = None
+
+
+class LapSegmenter:
+    '''
+    Streaming lap boundaries and per-lap traces.
+
+    A lap is complete when it started at a boundary seen in the stream,
+    the first (joined mid lap) and the current one are not. Crossing the
+    line backwards takes the crossing back.
+
+    `completedLaps` and the position wrap of one crossing can come a few
+    frames apart in either order. The second one is the same crossing as
+    long as the car is within `line_window` of the line.
+    '''
+
+    def __init__(self, wrap_threshold=0.5, capacity=4096, line_window=0.05):
+        self.wrap_threshold = wrap_threshold
+        self.line_window = line_window
+        self.laps = []
+        self.current = None
+        self.frame = 0
+        self._number = 0
+        self._pending = None
+        self._completed = None
+        self._position = None
+        self._sector = None
+        self._sector_start = 0.0
+        self._positions = np.empty(capacity)
+        self._times = np.empty(capacity)
+        self._count = 0
+
+    @ property
+    def lap_number(self):
+        return self.current.number if self.current is not None else None
+
+    def _append(self, position, time):
+        if self._count == len(self._positions):
+            self._positions = np.concatenate([self._positions, np.empty_like(self._positions)])
+            self._times = np.concatenate([self._times, np.empty_like(self._times)])
+        self._positions[self._count] = position
+        self._times[self._count] = time
+        self._count += 1
+
+    def _close(self, time):
+        lap = self.current
+        lap.stop = self.frame
+        lap.time = float(time - lap.start_time)
+        position = np.unwrap(self._positions[:self._count], period=1.0)
+        if position.size and position[0] > self.wrap_threshold:
+            position -= 1.0
+        lap.position = position
+        lap.elapsed = self._times[:self._count] - lap.start_time
+        self._count = 0
+        return lap
+
+    def _cross(self, signal):
+        if self._pending is not None and self._pending != signal:
+            # The other signal already counted this crossing
+            self._pending = None
+            return
+        self._number += 1
+        self._pending = signal
+
+    def update(self, time, position, completed_laps, sector_index=None):
+        '''
+        Adds one frame, `time` in seconds. Returns the lap that just
+        ended, or None.
+        '''
+        position = float(position)
+        finished = None
+        restart = self._completed is not None and completed_laps < self._completed
+        if self._completed is None or restart:
+            # First frame or a restarted session
+            self._number = completed_laps
+            self._pending = None
+        else:
+            if self.line_window < position < 1 - self.line_window:
+                self._pending = None
+            jump = position - self._position
+            if jump < -self.wrap_threshold:
+                self._cross('wrap')
+            elif jump > self.wrap_threshold:
+                self._number -= 1
+                self._pending = None
+            for _ in range(completed_laps - self._completed):
+                self._cross('laps')
+        self._completed = completed_laps
+        self._position = position
+        number = self._number
+
+        if restart:
+            finished = self._close(time)
+            finished.complete = False
+            self.laps.append(finished)
+            self.current = None
+        if self.current is None:
+            self.current = Lap(number, self.frame, time, complete=False)
+            self._sector = sector_index
+            self._sector_start = time
+        elif number != self.current.number:
+            finished = self._close(time)
+            if sector_index is not None and finished.sectors:
+                finished.sectors.append(time - self._sector_start)
+            self.laps.append(finished)
+            self.current = Lap(number, self.frame, time,
+                               complete=number == finished.number + 1)
+            self._sector = sector_index
+            self._sector_start = time
+        elif sector_index is not None and sector_index != self._sector:
+            self.current.sectors.append(time - self._sector_start)
+            self._sector = sector_index
+            self._sector_start = time
+
+        self._append(position, time)
+        self.frame += 1
+        self.current.stop = self.frame
+        return finished
+
+    def update_page(self, time, graphics):
+        '''`update` from a graphics page (ctypes or `Page`).'''
+        return self.update(time, graphics.normalizedCarPosition, graphics.completedLaps,
+                           graphics.currentSectorIndex)
+
+    def index(self, sectors=3):
+        '''Finished laps as a LAP_DTYPE array with a (sectors,) 'sectors' column.'''
+        dtype = LAP_DTYPE + [('sectors', np.float64, (sectors,))]
+        index = np.zeros(len(self.laps), dtype=dtype)
+        for row, lap in zip(index, self.laps):
+            row['lap'] = lap.number
+            row['start'] = lap.start
+            row['stop'] = lap.stop
+            row['start_time'] = lap.start_time
+            row['time'] = lap.time
+            row['complete'] = lap.complete
+            row['sectors'] = np.nan
+            row['sectors'][:min(len(lap.sectors), sectors)] = lap.sectors[:sectors]
+        return index
+
+
+def segment(time, position, completed_laps, sector_index=None, wrap_threshold=0.5):
+    '''Streams recorded arrays through a `LapSegmenter`, returns it.'''
+    segmenter = LapSegmenter(wrap_threshold, capacity=max(len(time), 1))
+    for i in range(len(time)):
+        segmenter.update(time[i], position[i], int(completed_laps[i]),
+                         None if sector_index is None else int(sector_index[i]))
+    return segmenter
+
+
+def segment_frames(frames, wrap_threshold=0.5):
+    '''`segment` over recorder frames (FRAME_DTYPE).'''
+    graphics = frames['graphics']
+    return segment(frames['time'], graphics['normalizedCarPosition'],
+                   graphics['completedLaps'], graphics['currentSectorIndex'], wrap_threshold)
+
+
+def lap_curves(laps, grid_size=GRID_SIZE):
+    '''
+    Elapsed time of every lap on a shared grid of `grid_size` positions
+    in [0, 1], as (laps, grid_size), with one `np.interp` call.
+
+    Laps are laid end to end with a gap (lap k spans positions
+    [2k, 2k + 1]) so a single monotonic interpolation covers all of them
+    without one lap's ends interpolating towards its neighbours. Every
+    lap is closed by its first elapsed time at 0 and its lap time at 1.
+    '''
+    grid = np.linspace(0.0, 1.0, grid_size)
+    if not laps:
+        return grid, np.zeros((0, grid_size))
+    # Positions must not go backwards for the interpolation
+    positions = [np.concatenate([[0.0], np.clip(np.maximum.accumulate(lap.position), 0.0, 1.0),
+                                 [1.0]]) + 2 * k
+                 for k, lap in enumerate(laps)]
+    elapsed = [np.concatenate([lap.elapsed[:1], lap.elapsed, [lap.time]]) for lap in laps]
+    queries = (grid[None, :] + 2 * np.arange(len(laps))[:, None]).reshape(-1)
+    curves = np.interp(queries, np.concatenate(positions), np.concatenate(elapsed))
+    return grid, curves.reshape(len(laps), grid_size)
+
+
+def best_lap_index(laps):
+    '''Index into `laps` of the fastest complete lap, None without one.'''
+    times = [lap.time if lap.complete else np.inf for lap in laps]
+    if not times or not np.isfinite(min(times)):
+        return None
+    return int(np.argmin(times))
+
+
+def delta_to_best(laps, reference=None, grid_size=GRID_SIZE):
+    '''
+    Time delta of every lap against the `reference` lap (default the best
+    complete one) at every grid position, as (laps, grid_size) seconds.
+    Positive is slower.
+    '''
+    if reference is None:
+        reference = best_lap_index(laps)
+        if reference is None:
+            raise ValueError('No complete lap to compare against')
+    _, curves = lap_curves(laps, grid_size)
+    return curves - curves[reference]
+
+
+class DeltaTracker:
+    '''Live delta of the running lap against a reference lap curve.'''
+
+    def __init__(self, reference_lap, grid_size=GRID_SIZE):
+        self.grid, curves = lap_curves([reference_lap], grid_size)
+        self.reference = curves[0]
+
+    def delta(self, position, elapsed):
+        '''Seconds behind (positive) or ahead of the reference at `position`.'''
+        return elapsed - np.interp(position, self.grid, self.reference)
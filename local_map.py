@@ -0,0 +1,80 @@
+'''
+Car-centred, heading-aligned crops of the track mask for vision policies.
+
+Each crop is one vectorized affine resample (nearest neighbour) of the
+precomputed mask, the full map is never rotated.
+'''
+import numpy as np
+
+
+class LocalMapCropper:
+    '''
+    Fixed-size crops of `mask` around a car pose.
+
+    The car faces up in the crop. It sits at `anchor`, given as
+    (row, column) fractions of the crop, so by default it sees more track
+    ahead than behind. Everything outside the map counts as off track.
+    '''
+
+    def __init__(self, mask, map_data, size=64, metres_per_pixel=1.0,
+                 anchor=(0.75, 0.5)):
+        # One pixel of off track border, positions outside the map are
+        # clamped onto it
+        self.padded_mask = np.pad(np.asarray(mask, dtype=bool), 1)
+        self.flat_mask = self.padded_mask.reshape(-1)
+        self.height, self.width = self.padded_mask.shape
+        self.x_offset = map_data['x_offset']
+        self.z_offset = map_data['z_offset']
+        self.scale_factor = map_data['scale_factor']
+        self.size = size
+        self.metres_per_pixel = metres_per_pixel
+
+        rows, cols = np.mgrid[0:size, 0:size].astype(np.float32)
+        # Pixel centres ahead of and to the right of the car, in metres
+        # scaled to map pixels
+        self.ahead = (anchor[0] * size - rows - 0.5) * \
+            np.float32(metres_per_pixel * self.scale_factor)
+        self.right = (cols + 0.5 - anchor[1] * size) * \
+            np.float32(metres_per_pixel * self.scale_factor)
+
+    @ classmethod
+    def from_info(cls, gi, **kwargs):
+        return cls(gi.geometry.mask, gi.map_data, **kwargs)
+
+    def _sample(self, x, z):
+        xi = np.clip(x + 1, 0, self.width - 1).astype(np.intp)
+        zi = np.clip(z + 1, 0, self.height - 1).astype(np.intp)
+        return self.flat_mask[zi * self.width + xi]
+
+    def _map_points(self, x, z, heading):
+        '''Map pixel positions of the crop grid, broadcast over poses.'''
+        # Forward is (cos(heading + 90), sin(heading + 90)) like the sensors,
+        # right is forward turned so the crop is not mirrored
+        sin_h = np.sin(heading).astype(np.float32)
+        cos_h = np.cos(heading).astype(np.float32)
+        map_x = np.float32(self.x_offset) + np.float32(self.scale_factor) * x
+        map_z = np.float32(self.z_offset) + np.float32(self.scale_factor) * z
+        return (map_x - self.ahead * sin_h - self.right * cos_h,
+                map_z + self.ahead * cos_h - self.right * sin_h)
+
+    def crop(self, coordinates, heading):
+        '''(size, size) bool crop for one pose, coordinates are [x, y, z].'''
+        return self._sample(*self._map_points(coordinates[0], coordinates[2], heading))
+
+    def crop_batch(self, coordinates, headings, chunk=64, out=None):
+        '''
+        (N, size, size) bool crops for N poses, e.g. a whole recording.
+
+        Poses are resampled `chunk` at a time to bound the index memory.
+        '''
+        coordinates = np.asarray(coordinates, dtype=np.float32)
+        headings = np.asarray(headings, dtype=np.float32)
+        if out is None:
+            out = np.empty((len(headings), self.size, self.size), dtype=bool)
+        for start in range(0, len(headings), chunk):
+            stop = start + chunk
+            x = coordinates[start:stop, 0, None, None]
+            z = coordinates[start:stop, 2, None, None]
+            heading = headings[start:stop, None, None]
+            out[start:stop] = self._sample(*self._map_points(x, z, heading))
+        return out
@@ -4,90 +4,128 @@ import tkinter as tk
 import numpy as np
 from PIL import Image, ImageTk
 
+import profiling
 from ac_inputs import GetInfo
 
 
+class ArrowSprites:
+    '''Car arrow pre-rotated once per `step` degrees at startup.'''
+
+    def __init__(self, image, step=1):
+        self.step = step
+        self.sprites = [ImageTk.PhotoImage(image.rotate(angle, expand=True))
+                        for angle in range(0, 360, step)]
+
+    def get(self, degrees):
+        return self.sprites[int(round(degrees / self.step)) % len(self.sprites)]
+
+
 class MinimapApp:
-    def __init__(self, root):
-        self.gi = GetInfo()
+    '''
+    Minimap with retained canvas items.
+
+    Every item is created once and only moved or recolored per frame,
+    and each frame reads telemetry from a single snapshot. The snapshot is
+    frozen into a `GetInfo` of the minimap's own unless `gi` is given, so
+    the shared `default_info()` keeps reading live memory.
+    '''
+
+    def __init__(self, root, interval=16, gi=None):
+        self.gi = GetInfo() if gi is None else gi
         self.root = root
+        self.interval = interval
         self.root.title("Minimap")
         self.canvas = tk.Canvas(
             root, width=self.gi.map_data['width'], height=self.gi.map_data['height'])
         self.canvas.pack()
 
-        self.map_image_tk = ImageTk.PhotoImage(self.gi.map_image)
+        self.map_image = self.gi.map_image
+        self.map_image_tk = ImageTk.PhotoImage(self.map_image)
         self.map_image_on_canvas = self.canvas.create_image(
             0, 0, anchor=tk.NW, image=self.map_image_tk)
 
         self.arrow_image = Image.open("assets/arrow32.png")
-        self.arrow_image_tk = ImageTk.PhotoImage(self.arrow_image)
-        self.arrow_on_canvas = None
-        self.angle_beam = None
+        self.arrow_sprites = ArrowSprites(self.arrow_image)
+        self.arrow_on_canvas = self.canvas.create_image(
+            0, 0, anchor=tk.CENTER, image=self.arrow_sprites.get(0))
+        self.angle_beam = self.canvas.create_oval(
+            0, 0, 0, 0, fill="blue", width=2)
 
         self.sensors_on_canvas = []
+        self.sensor_colors = []
+        self.sensors_shown = 0
         self.sensor_info = self.canvas.create_text(
             50, 20, anchor='nw', text='', font=("Arial", 12), fill="black")
 
-        # self.triggered_sensors = [0]*5
-
         self.display_data = self.create_data_on_canvas()
+        self.frame_count = 0
+        self.profile_text = self.canvas.create_text(
+            10, self.gi.map_data['height'] - 10, anchor='sw', text='',
+            font=("Courier", 9), fill="black")
         self.update_minimap()
 
-    def draw_car(self):
-        if self.arrow_on_canvas:
-            self.canvas.delete(self.arrow_on_canvas)
+    def refresh_map(self):
+        '''Shows the map of the current track after a track change.'''
+        self.map_image = self.gi.map_image
+        self.map_image_tk = ImageTk.PhotoImage(self.map_image)
+        self.canvas.itemconfig(self.map_image_on_canvas, image=self.map_image_tk)
+        self.canvas.config(width=self.gi.map_data['width'],
+                           height=self.gi.map_data['height'])
+        self.canvas.coords(self.profile_text, 10, self.gi.map_data['height'] - 10)
 
+    def draw_car(self, coordinates, heading):
         player_x = self.gi.map_data['x_offset'] + \
-            self.gi.coordinates[0] * self.gi.map_data['scale_factor']
+            coordinates[0] * self.gi.map_data['scale_factor']
         player_z = self.gi.map_data['z_offset'] + \
-            self.gi.coordinates[2] * self.gi.map_data['scale_factor']
+            coordinates[2] * self.gi.map_data['scale_factor']
 
-        arrow_image_rotated = self.arrow_image.rotate(
-            (math.degrees(-self.gi.heading)+180), expand=True)
-        self.arrow_image_tk = ImageTk.PhotoImage(arrow_image_rotated)
-
-        self.arrow_on_canvas = self.canvas.create_image(
-            player_x, player_z, anchor=tk.CENTER, image=self.arrow_image_tk)
+        self.canvas.coords(self.arrow_on_canvas, player_x, player_z)
+        self.canvas.itemconfig(
+            self.arrow_on_canvas,
+            image=self.arrow_sprites.get(math.degrees(-heading)+180))
 
     def draw_sensors(self, all_sensors, triggered_sensors):
-        for sensor in self.sensors_on_canvas:
-            self.canvas.delete(sensor)
-        self.sensors_on_canvas.clear()
-
-        for sensor in all_sensors:
-            sensor_x = sensor[0]
-            sensor_z = sensor[1]
-            if sensor[2] in triggered_sensors[1:-1]:  # True if sensor is in track
+        while len(self.sensors_on_canvas) < len(all_sensors):
+            self.sensors_on_canvas.append(
+                self.canvas.create_oval(0, 0, 0, 0, state='hidden'))
+            self.sensor_colors.append(None)
+
+        # Only as many ovals as sensors in this frame are shown
+        for sensor_on_canvas in self.sensors_on_canvas[len(all_sensors):self.sensors_shown]:
+            self.canvas.itemconfig(sensor_on_canvas, state='hidden')
+        for sensor_on_canvas in self.sensors_on_canvas[self.sensors_shown:len(all_sensors)]:
+            self.canvas.itemconfig(sensor_on_canvas, state='normal')
+        self.sensors_shown = len(all_sensors)
+
+        triggered = set(triggered_sensors[1:-1])
+        for i, (sensor_x, sensor_z, angle) in enumerate(all_sensors):
+            if angle in triggered:  # True if sensor is in track
                 sensor_color = "green"
-
             else:
                 sensor_color = "red"
 
-            sensor_on_canvas = self.canvas.create_oval(
-                sensor_x - 3, sensor_z - 3, sensor_x + 3, sensor_z + 3, fill=sensor_color
-            )
-            self.sensors_on_canvas.append(sensor_on_canvas)
-
-    def draw_mean_angle_dot(self, triggered_sensors):
-        if self.angle_beam:
-            self.canvas.delete(self.angle_beam)
+            sensor_on_canvas = self.sensors_on_canvas[i]
+            self.canvas.coords(sensor_on_canvas,
+                               sensor_x - 3, sensor_z - 3, sensor_x + 3, sensor_z + 3)
+            if sensor_color != self.sensor_colors[i]:
+                self.canvas.itemconfig(sensor_on_canvas, fill=sensor_color)
+                self.sensor_colors[i] = sensor_color
 
+    def draw_mean_angle_dot(self, triggered_sensors, coordinates, heading):
         mean_angle = np.radians(triggered_sensors[-1])
         beam_length = triggered_sensors[0]*1.2
 
         end_x = self.gi.map_data['x_offset'] + \
-            self.gi.coordinates[0] + beam_length * \
-            np.cos(self.gi.heading + mean_angle + np.radians(90)) * \
+            coordinates[0] + beam_length * \
+            np.cos(heading + mean_angle + np.radians(90)) * \
             self.gi.map_data['scale_factor']
 
         end_z = self.gi.map_data['z_offset'] + \
-            self.gi.coordinates[2] + beam_length * \
-            np.sin(self.gi.heading + mean_angle + np.radians(90)) * \
+            coordinates[2] + beam_length * \
+            np.sin(heading + mean_angle + np.radians(90)) * \
             self.gi.map_data['scale_factor']
 
-        self.angle_beam = self.canvas.create_oval(
-            end_x-4, end_z-4, end_x+4, end_z+4, fill="blue", width=2)
+        self.canvas.coords(self.angle_beam, end_x-4, end_z-4, end_x+4, end_z+4)
 
     def create_data_on_canvas(self):
 
@@ -115,6 +153,7 @@ class MinimapApp:
     def update_data_on_canvas(self, triggered_sensors):
         sensor_distance = triggered_sensors[0]
         sensor_mean_angle = triggered_sensors[-1]
+        wheel_slip = self.gi.wheel_slip
 
         data = {
             'sensor_distance': sensor_distance,
@@ -123,10 +162,10 @@ class MinimapApp:
             'speed': self.gi.speed,
             'steer_angle': self.gi.steer_angle,
             'track_completion': self.gi.track_completion,
-            'wheel_slip_FL': self.gi.wheel_slip[0],
-            'wheel_slip_FR': self.gi.wheel_slip[1],
-            'wheel_slip_RL': self.gi.wheel_slip[2],
-            'wheel_slip_RR': self.gi.wheel_slip[3],
+            'wheel_slip_FL': wheel_slip[0],
+            'wheel_slip_FR': wheel_slip[1],
+            'wheel_slip_RL': wheel_slip[2],
+            'wheel_slip_RR': wheel_slip[3],
             'wheels_offtrack': self.gi.wheels_offtrack}
 
         for i, (key, value) in enumerate(data.items()):
@@ -135,16 +174,28 @@ class MinimapApp:
                 self.data_text_items[i], text=f"{key}: {value}")
 
     def update_minimap(self):
+        # One snapshot per frame, every read below sees the same packet
+        self.gi.freeze()
+        if self.gi.map_image is not self.map_image:
+            self.refresh_map()
+        coordinates = self.gi.coordinates
+        heading = self.gi.heading
 
         all_sensors, triggered_sensors = self.gi.get_sensors(
             min_sensor_distance=50, min_sensor_count=10, FOV_degrees=180)
 
-        self.draw_car()
-        self.draw_sensors(all_sensors, triggered_sensors)
-        self.draw_mean_angle_dot(triggered_sensors)
-        self.update_data_on_canvas(triggered_sensors)
+        with profiling.span('minimap.draw'):
+            self.draw_car(coordinates, heading)
+            self.draw_sensors(all_sensors, triggered_sensors)
+            self.draw_mean_angle_dot(triggered_sensors, coordinates, heading)
+            self.update_data_on_canvas(triggered_sensors)
+
+        # Profiling overlay, refreshed about twice a second
+        self.frame_count += 1
+        if profiling.ENABLED and self.frame_count % 30 == 0:
+            self.canvas.itemconfig(self.profile_text, text=profiling.format_report())
 
-        self.root.after(50, self.update_minimap)
+        self.root.after(self.interval, self.update_minimap)
 
 
 # gi = GetInfo()
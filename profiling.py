@@ -0,0 +1,191 @@
+'''
+Timing spans, counters and rolling latency percentiles for the hot paths.
+
+Off by default. Set RL_DRIVER_PROFILE=1 (or call `enable()` before the
+instrumented modules are imported) to turn it on. With
+RL_DRIVER_PROFILE_FILE set, the report is also written there as JSON at exit.
+
+    @ timed('sensors.get_sensors')
+    def get_sensors(...): ...
+
+    with span('minimap.draw'):
+        ...
+
+    count('snapshot.torn')
+
+When off, `timed` returns the function itself and `span` and `count`
+return immediately, so the instrumented code runs as if untouched.
+'''
+import atexit
+import functools
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+ENABLED = os.environ.get('RL_DRIVER_PROFILE', '') not in ('', '0')
+REPORT_PATH = os.environ.get('RL_DRIVER_PROFILE_FILE')
+
+_spans = {}
+_counters = {}
+_lock = threading.Lock()
+
+
+class LatencyTracker:
+    '''Rolling window of step latencies with percentiles and overrun count.'''
+
+    def __init__(self, budget, window=4096):
+        self.budget = budget
+        self.samples = np.zeros(window, dtype=np.float64)
+        self.count = 0
+        self.overruns = 0
+
+    def add(self, latency):
+        self.samples[self.count % len(self.samples)] = latency
+        self.count += 1
+        if latency > self.budget:
+            self.overruns += 1
+
+    def reset(self):
+        self.count = 0
+        self.overruns = 0
+
+    def percentiles(self, q=(50, 95, 99)):
+        '''{'p50': ms, ...} over the window, empty before the first sample.'''
+        if not self.count:
+            return {}
+        samples = self.samples[:min(self.count, len(self.samples))]
+        values = np.percentile(samples, q) * 1000
+        return {f'p{p}': float(v) for p, v in zip(q, values)}
+
+
+def enable(report_path=None):
+    '''
+    Turns profiling on, `timed` only affects functions defined after this.
+
+    Writes the report to `report_path` at exit when given.
+    '''
+    global ENABLED, REPORT_PATH
+    ENABLED = True
+    if report_path is not None:
+        REPORT_PATH = report_path
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def tracker(name):
+    '''Latency window of span `name`, created on first use.'''
+    latency = _spans.get(name)
+    if latency is None:
+        with _lock:
+            latency = _spans.setdefault(name, LatencyTracker(float('inf')))
+    return latency
+
+
+def record(name, seconds):
+    if ENABLED:
+        tracker(name).add(seconds)
+
+
+def count(name, n=1):
+    if ENABLED:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+class _Span:
+    __slots__ = ('latency', 'start')
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.latency.add(time.perf_counter() - self.start)
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    '''Context manager timing its body under `name`.'''
+    if not ENABLED:
+        return _NO_SPAN
+    return _Span(tracker(name))
+
+
+def timed(name):
+    '''Decorator timing every call under `name`, a no-op when profiling is off.'''
+    def decorate(func):
+        if not ENABLED:
+            return func
+        latency = tracker(name)
+
+        @ functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if ENABLED:
+                    latency.add(time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def report():
+    '''{'spans': {name: {'count', 'p50', 'p95', 'p99', 'max'}}, 'counters': {...}}, times in ms.'''
+    spans = {}
+    for name, latency in sorted(_spans.items()):
+        if not latency.count:
+            continue
+        window = latency.samples[:min(latency.count, len(latency.samples))]
+        spans[name] = {'count': latency.count, **latency.percentiles(),
+                       'max': float(window.max()) * 1000}
+    return {'spans': spans, 'counters': dict(sorted(_counters.items()))}
+
+
+def format_report(current=None):
+    '''Report as short text lines, e.g. for an overlay.'''
+    current = report() if current is None else current
+    lines = [f"{name}: p50 {s['p50']:.3f} p95 {s['p95']:.3f} p99 {s['p99']:.3f} ms"
+             for name, s in current['spans'].items()]
+    lines += [f'{name}: {value}' for name, value in current['counters'].items()]
+    return '\n'.join(lines)
+
+
+def dump(path=None):
+    '''Writes the report as JSON to `path` (default RL_DRIVER_PROFILE_FILE).'''
+    path = path or REPORT_PATH
+    with open(path, 'w') as f:
+        json.dump(report(), f, indent=2)
+    return path
+
+
+def reset():
+    for latency in _spans.values():
+        latency.reset()
+    _counters.clear()
+
+
+@ atexit.register
+def _dump_at_exit():
+    if ENABLED and REPORT_PATH:
+        dump(REPORT_PATH)
@@ -0,0 +1,152 @@
+'''
+Records every physics/graphics packet into a preallocated ring buffer.
+
+Full segments of the ring are written to disk by a background thread,
+the recording side never allocates frame buffers or waits on the disk.
+'''
+import glob
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from sim_info import GRAPHICS_DTYPE, PHYSICS_DTYPE
+
+FRAME_DTYPE = np.dtype([('time', '<f8'),
+                        ('physics', PHYSICS_DTYPE),
+                        ('graphics', GRAPHICS_DTYPE)])
+
+
+class TelemetryRecorder:
+    '''
+    Captures a frame whenever the physics or graphics `packetId` changes.
+
+    The ring holds `segments` segments of `segment_frames` frames. When the
+    writer falls a whole ring behind, new frames are dropped and counted
+    instead of stalling the caller.
+    '''
+
+    def __init__(self, directory, sim_info=None, segment_frames=4096, segments=8):
+        if sim_info is None:
+            from sim_info import info as sim_info
+        self.sim_info = sim_info
+        self.directory = directory
+        self.segment_frames = segment_frames
+        self.segments = segments
+
+        self.ring = np.zeros(segment_frames * segments, FRAME_DTYPE)
+        ring_bytes = self.ring.view(np.uint8).reshape(len(self.ring), -1)
+        physics_offset = FRAME_DTYPE.fields['physics'][1]
+        graphics_offset = FRAME_DTYPE.fields['graphics'][1]
+        self._ring_physics = ring_bytes[:, physics_offset:physics_offset + PHYSICS_DTYPE.itemsize]
+        self._ring_graphics = ring_bytes[:, graphics_offset:graphics_offset + GRAPHICS_DTYPE.itemsize]
+        self._ring_time = self.ring['time']
+        self._ring_physics_id = self.ring['physics']['packetId']
+        self._ring_graphics_id = self.ring['graphics']['packetId']
+
+        self.frames = 0
+        self.dropped = 0
+        self.torn = 0
+        self._last_ids = (None, None)
+        self._filled = 0
+        self._written = 0
+        self._segment_queue = queue.SimpleQueue()
+        self._writer = None
+        self._poller = None
+        self._running = False
+
+    def poll(self, retries=4):
+        '''Records the current packet if it is new, returns True if it was.'''
+        physics = self.sim_info.physics
+        graphics = self.sim_info.graphics
+        ids = (physics.packetId, graphics.packetId)
+        if ids == self._last_ids:
+            return False
+
+        if self._filled - self._written >= self.segments:
+            # Writer is a full ring behind
+            self._last_ids = ids
+            self.dropped += 1
+            return True
+
+        slot = self.frames % len(self.ring)
+        for _ in range(retries):
+            physics_id = physics.packetId
+            graphics_id = graphics.packetId
+            self._ring_physics[slot] = self.sim_info._physics_bytes
+            self._ring_graphics[slot] = self.sim_info._graphics_bytes
+            if self._ring_physics_id[slot] == physics_id == physics.packetId and \
+                    self._ring_graphics_id[slot] == graphics_id == graphics.packetId:
+                break
+            self.torn += 1
+        self._ring_time[slot] = time.perf_counter()
+        self._last_ids = (self._ring_physics_id[slot], self._ring_graphics_id[slot])
+        self.frames += 1
+
+        if self.frames % self.segment_frames == 0:
+            self._filled += 1
+            self._segment_queue.put(self._filled - 1)
+        return True
+
+    def _write_segments(self):
+        while True:
+            segment = self._segment_queue.get()
+            if segment is None:
+                break
+            self._write(segment, self.segment_frames)
+            self._written += 1
+
+    def _write(self, segment, count):
+        start = (segment % self.segments) * self.segment_frames
+        path = os.path.join(self.directory, f'segment_{segment:06d}.npy')
+        np.save(path, self.ring[start:start + count])
+
+    def _poll_loop(self, poll_interval):
+        while self._running:
+            if not self.poll():
+                time.sleep(poll_interval)
+
+    def start(self, poll_interval=0.0005, poll_thread=True):
+        '''
+        Starts the writer thread, and a polling thread unless the caller
+        is going to call `poll` from its own loop.
+        '''
+        os.makedirs(self.directory, exist_ok=True)
+        self._running = True
+        self._writer = threading.Thread(target=self._write_segments, daemon=True)
+        self._writer.start()
+        if poll_thread:
+            self._poller = threading.Thread(
+                target=self._poll_loop, args=(poll_interval,), daemon=True)
+            self._poller.start()
+        return self
+
+    def stop(self):
+        '''Stops polling and flushes everything recorded so far.'''
+        self._running = False
+        if self._poller is not None:
+            self._poller.join()
+            self._poller = None
+        if self._writer is not None:
+            self._segment_queue.put(None)
+            self._writer.join()
+            self._writer = None
+        partial = self.frames % self.segment_frames
+        if partial:
+            self._write(self._filled, partial)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def load_recording(directory, mmap_mode=None):
+    '''All segments of a recording as one FRAME_DTYPE array, in order.'''
+    paths = sorted(glob.glob(os.path.join(directory, 'segment_*.npy')))
+    if not paths:
+        return np.zeros(0, FRAME_DTYPE)
+    return np.concatenate([np.load(path, mmap_mode=mmap_mode) for path in paths])
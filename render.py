@@ -0,0 +1,159 @@
+'''
+Headless minimap rasterizer.
+
+Draws the same picture as `minimap.MinimapApp` (map, car arrow, sensor
+dots and the mean-angle beam) into a reused NumPy RGB frame, without Tk.
+Useful for image observations and for exporting recorded runs::
+
+    rasterizer = MinimapRasterizer.from_info(gi)
+    frames = rasterizer.render_frames(coordinates, headings, speeds, gi.sensor_engine)
+    save_frames(frames, 'run_frames')
+'''
+import os
+
+import numpy as np
+from PIL import Image
+
+ARROW_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assets', 'arrow32.png')
+
+GREEN = np.array([0, 128, 0], dtype=np.uint8)
+RED = np.array([255, 0, 0], dtype=np.uint8)
+BLUE = np.array([0, 0, 255], dtype=np.uint8)
+
+
+def disc_offsets(radius):
+    '''(dx, dz) offsets of every pixel of a filled disc.'''
+    dz, dx = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    inside = dx**2 + dz**2 <= radius**2
+    return dx[inside], dz[inside]
+
+
+class MinimapRasterizer:
+    '''
+    Composites a minimap frame with vectorized drawing.
+
+    `render` returns the same frame buffer every call, copy it to keep it.
+    '''
+
+    def __init__(self, map_image, map_data, arrow_image=None, angle_step=1,
+                 background=(255, 255, 255)):
+        self.map_data = map_data
+        rgba = np.asarray(map_image.convert('RGBA'), dtype=np.float32)
+        alpha = rgba[..., 3:] / 255
+        self.background = (rgba[..., :3] * alpha +
+                           np.asarray(background, dtype=np.float32) * (1 - alpha)
+                           ).round().astype(np.uint8)
+        self.height, self.width = self.background.shape[:2]
+        self.frame = self.background.copy()
+
+        if arrow_image is None:
+            arrow_image = Image.open(ARROW_PATH)
+        self.angle_step = angle_step
+        self.sprites = []
+        for angle in range(0, 360, angle_step):
+            sprite = np.asarray(arrow_image.convert('RGBA').rotate(angle, expand=True),
+                                dtype=np.float32)
+            sprite_alpha = sprite[..., 3:] / 255
+            self.sprites.append((sprite[..., :3] * sprite_alpha, 1 - sprite_alpha))
+
+        self.sensor_disc = disc_offsets(3)
+        self.beam_disc = disc_offsets(4)
+
+    @ classmethod
+    def from_info(cls, gi, **kwargs):
+        return cls(gi.map_image, gi.map_data, **kwargs)
+
+    def world_to_map(self, x, z):
+        return (self.map_data['x_offset'] + x * self.map_data['scale_factor'],
+                self.map_data['z_offset'] + z * self.map_data['scale_factor'])
+
+    def draw_discs(self, x, z, colors, disc):
+        '''Filled discs at every (x, z), colors is one RGB or one per disc.'''
+        dx, dz = disc
+        xs = (np.round(np.asarray(x, dtype=np.float64))[:, None] + dx).astype(np.intp)
+        zs = (np.round(np.asarray(z, dtype=np.float64))[:, None] + dz).astype(np.intp)
+        colors = np.broadcast_to(np.asarray(colors, dtype=np.uint8).reshape(-1, 1, 3),
+                                 xs.shape + (3,))
+        valid = (xs >= 0) & (xs < self.width) & (zs >= 0) & (zs < self.height)
+        self.frame[zs[valid], xs[valid]] = colors[valid]
+
+    def draw_arrow(self, x, z, heading):
+        angle = np.degrees(-heading) + 180
+        premultiplied, transparency = self.sprites[
+            int(round(angle / self.angle_step)) % len(self.sprites)]
+        sprite_h, sprite_w = transparency.shape[:2]
+        x0 = int(round(x)) - sprite_w // 2
+        z0 = int(round(z)) - sprite_h // 2
+
+        # Clip the sprite to the frame
+        fx0, fz0 = max(x0, 0), max(z0, 0)
+        fx1, fz1 = min(x0 + sprite_w, self.width), min(z0 + sprite_h, self.height)
+        if fx0 >= fx1 or fz0 >= fz1:
+            return
+        sx0, sz0 = fx0 - x0, fz0 - z0
+        sprite_slice = (slice(sz0, sz0 + fz1 - fz0), slice(sx0, sx0 + fx1 - fx0))
+        region = self.frame[fz0:fz1, fx0:fx1]
+        region[...] = region * transparency[sprite_slice] + premultiplied[sprite_slice]
+
+    def render(self, coordinates, heading, sensors=(), triggered_sensors=None):
+        '''
+        Frame for one car pose, with the output of `GetInfo.get_sensors`.
+
+        Same geometry as the Tk minimap, including the beam.
+        '''
+        np.copyto(self.frame, self.background)
+
+        if len(sensors):
+            sensors = np.asarray(sensors, dtype=np.float64)
+            triggered = np.isin(sensors[:, 2], triggered_sensors[1:-1])
+            colors = np.where(triggered[:, None], GREEN, RED)
+            self.draw_discs(sensors[:, 0], sensors[:, 1], colors, self.sensor_disc)
+
+        if triggered_sensors is not None:
+            mean_angle = np.radians(triggered_sensors[-1])
+            beam_length = triggered_sensors[0]*1.2
+            reach = beam_length * self.map_data['scale_factor']
+            end_x = self.map_data['x_offset'] + coordinates[0] + \
+                reach * np.cos(heading + mean_angle + np.radians(90))
+            end_z = self.map_data['z_offset'] + coordinates[2] + \
+                reach * np.sin(heading + mean_angle + np.radians(90))
+            self.draw_discs([end_x], [end_z], BLUE, self.beam_disc)
+
+        self.draw_arrow(*self.world_to_map(coordinates[0], coordinates[2]), heading)
+        return self.frame
+
+    def render_frames(self, coordinates, headings, speeds=None, sensor_engine=None,
+                      min_sensor_distance=50, min_sensor_count=10, FOV_degrees=180):
+        '''
+        Yields a frame per recorded pose, sensors are recomputed with
+        `sensor_engine` when given. Every yield reuses the frame buffer.
+        '''
+        prev_mean_angle = 0
+        for i in range(len(headings)):
+            sensors, triggered_sensors = (), None
+            if sensor_engine is not None:
+                sensors, triggered_sensors, mean_angle = sensor_engine.get_sensors(
+                    coordinates[i], headings[i], speeds[i],
+                    min_sensor_distance, min_sensor_count, FOV_degrees)
+                if np.isnan(mean_angle):
+                    mean_angle = prev_mean_angle
+                prev_mean_angle = mean_angle
+                triggered_sensors.append(mean_angle)
+            yield self.render(coordinates[i], headings[i], sensors, triggered_sensors)
+
+    def render_batch(self, coordinates, headings, speeds=None, sensor_engine=None, **kwargs):
+        '''All frames of `render_frames` as one (N, H, W, 3) array.'''
+        frames = np.empty((len(headings), self.height, self.width, 3), dtype=np.uint8)
+        for i, frame in enumerate(self.render_frames(
+                coordinates, headings, speeds, sensor_engine, **kwargs)):
+            frames[i] = frame
+        return frames
+
+
+def save_frames(frames, directory, pattern='frame_{:06d}.png'):
+    '''Streams frames to an image sequence, returns the number written.'''
+    os.makedirs(directory, exist_ok=True)
+    count = 0
+    for count, frame in enumerate(frames, 1):
+        Image.fromarray(frame).save(os.path.join(directory, pattern.format(count - 1)))
+    return count
@@ -0,0 +1,276 @@
+'''
+Replay buffer of environment transitions for off-policy training.
+
+Every field is one preallocated contiguous array (or a memory-mapped .npy
+file when a `directory` is given, for buffers larger than RAM) written as
+a ring. Sampling is uniform or prioritized through a sum tree, n-step
+returns are computed for the whole batch at once and every field of a
+batch is a single gather::
+
+    buffer = ReplayBuffer.for_env(env, 2_000_000, n_step=3, prioritized=True)
+    buffer.add(obs, action, reward, next_obs, terminated, truncated)
+    batch = buffer.sample(256)
+    buffer.update_priorities(batch['index'], td_errors)
+'''
+import json
+import os
+
+import numpy as np
+
+STATE_NAME = 'state.json'
+
+
+class SumTree:
+    '''
+    Binary tree of priority sums over `capacity` leaves, updated and
+    searched for many leaves at once.
+    '''
+
+    def __init__(self, capacity, tree=None):
+        self.leaves = 1 << max(int(capacity) - 1, 0).bit_length()
+        self.depth = self.leaves.bit_length() - 1
+        self.tree = np.zeros(2 * self.leaves) if tree is None else tree
+
+    @ property
+    def total(self):
+        return float(self.tree[1])
+
+    def __getitem__(self, indices):
+        return self.tree[self.leaves + np.asarray(indices)]
+
+    def update(self, indices, priorities):
+        nodes = self.leaves + np.asarray(indices, dtype=np.int64)
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes >> 1)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def set(self, index, priority):
+        '''Single leaf update, adds the change to every ancestor in one step.'''
+        node = self.leaves + int(index)
+        self.tree[node >> np.arange(self.depth + 1)] += priority - self.tree[node]
+
+    def find(self, values):
+        '''Leaf index of each cumulative priority in `values`.'''
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sum = self.tree[left]
+            right = values > left_sum
+            values -= np.where(right, left_sum, 0.0)
+            nodes = left + right
+        return nodes - self.leaves
+
+
+class ReplayBuffer:
+    '''
+    Ring of `capacity` transitions with one array per field.
+
+    The fields are observation, action, reward, next_observation,
+    terminated and truncated, `fields` maps their names to the arrays.
+    With `n_step` > 1 sampled batches hold the discounted return of up to
+    `n_step` rewards, cut at the end of an episode or the newest
+    transition, the matching next_observation and `discount`
+    (gamma ** steps, 0 after a termination).
+
+    With `directory` the arrays are .npy files opened as memory maps and
+    `flush` saves the ring position, an existing buffer is reopened.
+    '''
+
+    def __init__(self, capacity, observation_shape, action_shape, observation_dtype=np.float32,
+                 action_dtype=np.float32, n_step=1, gamma=0.99, prioritized=False,
+                 alpha=0.6, epsilon=1e-6, directory=None, seed=None):
+        self.capacity = int(capacity)
+        self.n_step = n_step
+        self.gamma = gamma
+        self.prioritized = prioritized
+        self.alpha = alpha
+        self.epsilon = epsilon
+        self.directory = directory
+        self.rng = np.random.default_rng(seed)
+        self.cursor = 0
+        self.size = 0
+        self.max_priority = 1.0
+
+        observation_shape = tuple(int(n) for n in np.atleast_1d(observation_shape))
+        action_shape = tuple(int(n) for n in np.atleast_1d(action_shape))
+        self.specs = {'observation': (observation_shape, observation_dtype),
+                      'action': (action_shape, action_dtype),
+                      'reward': ((), np.float32),
+                      'next_observation': (observation_shape, observation_dtype),
+                      'terminated': ((), bool),
+                      'truncated': ((), bool)}
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            state = self._load_state()
+            self.fields = {name: self._open(name, shape, dtype, state is not None)
+                           for name, (shape, dtype) in self.specs.items()}
+        else:
+            state = None
+            self.fields = {name: np.zeros((self.capacity, *shape), dtype=dtype)
+                           for name, (shape, dtype) in self.specs.items()}
+        self.tree = None
+        if prioritized:
+            tree_leaves = SumTree(self.capacity).leaves
+            tree = None if directory is None else \
+                self._open('priorities', (), np.float64, state is not None, 2 * tree_leaves)
+            self.tree = SumTree(self.capacity, tree)
+        if state is not None:
+            self.cursor = state['cursor']
+            self.size = state['size']
+            self.max_priority = state['max_priority']
+        self._out = {}
+
+    @ classmethod
+    def for_env(cls, env, capacity, **kwargs):
+        '''Buffer sized for a `DrivingEnv`: observation vector, (steer, gas, brake).'''
+        return cls(capacity, env.observation.shape, (3,), env.observation.dtype, **kwargs)
+
+    def _open(self, name, shape, dtype, existing, length=None):
+        path = os.path.join(self.directory, f'{name}.npy')
+        shape = (length or self.capacity, *shape)
+        if existing and os.path.exists(path):
+            array = np.load(path, mmap_mode='r+')
+            if array.shape == shape and array.dtype == np.dtype(dtype):
+                return array
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+    def _load_state(self):
+        try:
+            with open(os.path.join(self.directory, STATE_NAME)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return state if state.get('capacity') == self.capacity else None
+
+    def flush(self):
+        '''Writes memory-mapped fields and the ring position to disk.'''
+        if self.directory is None:
+            return
+        for array in self.fields.values():
+            array.flush()
+        if self.tree is not None:
+            self.tree.tree.flush()
+        path = os.path.join(self.directory, STATE_NAME)
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump({'capacity': self.capacity, 'cursor': self.cursor, 'size': self.size,
+                       'max_priority': self.max_priority}, f)
+        os.replace(f'{path}.tmp', path)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, observation, action, reward, next_observation, terminated, truncated=False):
+        '''Stores one transition, returns its index.'''
+        slot = self.cursor
+        fields = self.fields
+        fields['observation'][slot] = observation
+        fields['action'][slot] = action
+        fields['reward'][slot] = reward
+        fields['next_observation'][slot] = next_observation
+        fields['terminated'][slot] = terminated
+        fields['truncated'][slot] = truncated
+        if self.tree is not None:
+            self.tree.set(slot, self.max_priority ** self.alpha)
+        self.cursor = (slot + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return slot
+
+    def add_batch(self, **arrays):
+        '''
+        Stores N transitions given as arrays named like the fields (N
+        beyond the capacity keeps the last ones), returns their indices.
+        '''
+        count = len(arrays['reward'])
+        skip = max(count - self.capacity, 0)
+        indices = (self.cursor + np.arange(skip, count)) % self.capacity
+        for name, array in self.fields.items():
+            values = arrays.get(name, False if name == 'truncated' else None)
+            if values is None:
+                raise ValueError(f'Missing field {name!r}')
+            array[indices] = values[skip:] if np.ndim(values) else values
+        if self.tree is not None:
+            self.tree.update(indices, np.full(len(indices), self.max_priority ** self.alpha))
+        self.cursor = int((self.cursor + count) % self.capacity)
+        self.size = min(self.size + count, self.capacity)
+        return indices
+
+    def view(self, start, stop):
+        '''Fields of the slots [start, stop) as views, no copy.'''
+        return {name: array[start:stop] for name, array in self.fields.items()}
+
+    def _gather(self, name, indices):
+        '''One gather into a reused output buffer per field.'''
+        source = self.fields[name]
+        out = self._out.get(name)
+        if out is None or len(out) != len(indices):
+            out = self._out[name] = np.empty((len(indices), *source.shape[1:]), source.dtype)
+        return np.take(source, indices, axis=0, out=out)
+
+    def sample_indices(self, batch_size):
+        if not self.size:
+            raise ValueError('Sampling from an empty replay buffer')
+        if self.tree is None:
+            return self.rng.integers(0, self.size, batch_size), None
+        # Stratified: one draw in each of batch_size equal slices of the total
+        total = self.tree.total
+        values = (np.arange(batch_size) + self.rng.random(batch_size)) * (total / batch_size)
+        indices = np.minimum(self.tree.find(values), self.size - 1)
+        return indices, self.tree[indices] / total
+
+    def sample(self, batch_size, beta=0.4):
+        '''
+        Random batch as {field: array} plus 'index', 'discount' and, when
+        prioritized, importance 'weight' normalized to a maximum of 1.
+        The arrays are reused by the next `sample` of the same size.
+        '''
+        indices, probabilities = self.sample_indices(batch_size)
+        batch = {'index': indices,
+                 'observation': self._gather('observation', indices),
+                 'action': self._gather('action', indices)}
+        if self.n_step == 1:
+            batch['reward'] = self._gather('reward', indices).astype(np.float64)
+            batch['next_observation'] = self._gather('next_observation', indices)
+            batch['terminated'] = self._gather('terminated', indices)
+            batch['discount'] = self.gamma * ~batch['terminated']
+        else:
+            returns, last, discount = self.n_step_returns(indices)
+            batch['reward'] = returns
+            batch['next_observation'] = self._gather('next_observation', last)
+            batch['terminated'] = self.fields['terminated'][last]
+            batch['discount'] = discount
+        if probabilities is not None:
+            weights = (self.size * probabilities) ** -beta
+            batch['weight'] = weights / weights.max()
+        return batch
+
+    def n_step_returns(self, indices):
+        '''
+        Discounted n-step returns from `indices`, for all of them at once.
+        Returns (returns, index of the last transition used, discount).
+        '''
+        steps = np.arange(self.n_step)
+        window = (indices[:, None] + steps) % self.capacity
+        # Steps stored after `index`, the window must not pass the newest one
+        available = (self.cursor - 1 - indices) % self.capacity + 1
+        valid = steps < np.minimum(available, self.size)[:, None]
+        done = self.fields['terminated'][window] | self.fields['truncated'][window]
+        # A step is used when no earlier step of the window ended the episode
+        ended = np.cumsum(done, axis=1) - done
+        used = valid & (ended == 0)
+        count = used.sum(axis=1)
+        rewards = self.fields['reward'][window].astype(np.float64)
+        returns = (rewards * used * self.gamma ** steps).sum(axis=1)
+        last = window[np.arange(len(indices)), count - 1]
+        discount = self.gamma ** count * ~self.fields['terminated'][last]
+        return returns, last, discount
+
+    def update_priorities(self, indices, td_errors):
+        '''New priorities (|td error| + epsilon) ** alpha of sampled transitions.'''
+        if self.tree is None:
+            return
+        priorities = np.abs(np.asarray(td_errors, dtype=np.float64)) + self.epsilon
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(indices, priorities ** self.alpha)
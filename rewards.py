@@ -0,0 +1,342 @@
+'''
+Declarative reward and termination, on live frames or whole recordings.
+
+A pipeline is a list of reward terms and termination conditions built
+from a plain dict (or JSON file)::
+
+    pipeline = RewardPipeline.from_config({
+        'terms': {'progress': {'weight': 100}, 'offtrack': {'weight': 0.1},
+                  'slip': {'weight': 0.05, 'threshold': 0.5}},
+        'terminations': {'damage_jump': {'threshold': 20},
+                         'offtrack': {'wheels': 4, 'frames': 300}}})
+
+    reward, terminated = pipeline.step(live_signals(gi, pipeline.signals))
+    labels = pipeline.batch(load_signals('session.rla'))
+
+Terms are elementwise NumPy expressions of the current and the previous
+frame, so `step` and `batch` do the same arithmetic and give identical
+results. Relabeling a recording is a handful of array operations::
+
+    python rewards.py session.rla labels.npz --config reward.json \\
+        --features session.features.rla
+'''
+import abc
+import argparse
+import json
+import os
+
+import numpy as np
+
+# Signal name -> recorded column, damage and slip are reduced in `_reduce`
+SIGNAL_COLUMNS = {'completion': 'graphics.normalizedCarPosition',
+                  'wheels_offtrack': 'physics.numberOfTyresOut',
+                  'damage': 'physics.carDamage',
+                  'wheel_slip': 'physics.wheelSlip',
+                  'performance_meter': 'physics.performanceMeter',
+                  'speed': 'physics.speedKmh',
+                  'sensor_mean_angle': 'features.sensor_mean_angle'}
+
+
+def _reduce(name, values):
+    values = np.asarray(values, dtype=np.float64)
+    if name == 'damage':
+        # Highest damage of the five zones
+        return values[..., 4]
+    if name == 'wheel_slip':
+        return values[..., :4]
+    return values
+
+
+class Term(abc.ABC):
+    '''Reward term, `weight` times the value of `__call__`.'''
+    signals = ()
+
+    def __init__(self, weight=1.0):
+        self.weight = weight
+
+    @ abc.abstractmethod
+    def __call__(self, current, previous):
+        '''Weighted term of every frame, from {signal: array} dicts.'''
+
+
+class Progress(Term):
+    '''Change of the normalized track position, across the finish line too.'''
+    signals = ('completion',)
+
+    def __call__(self, current, previous):
+        progress = current['completion'] - previous['completion']
+        progress = np.where(progress < -0.5, progress + 1, progress)
+        return self.weight * progress
+
+
+class OffTrack(Term):
+    '''Penalty per wheel off the track.'''
+    signals = ('wheels_offtrack',)
+
+    def __call__(self, current, previous):
+        return -self.weight * current['wheels_offtrack']
+
+
+class DamagePenalty(Term):
+    '''Penalty on the increase of the highest damage.'''
+    signals = ('damage',)
+
+    def __call__(self, current, previous):
+        return -self.weight * np.maximum(current['damage'] - previous['damage'], 0.0)
+
+
+class SlipPenalty(Term):
+    '''Penalty on the wheel slip above `threshold`, summed over the wheels.'''
+    signals = ('wheel_slip',)
+
+    def __init__(self, weight=1.0, threshold=0.5):
+        super().__init__(weight)
+        self.threshold = threshold
+
+    def __call__(self, current, previous):
+        excess = np.maximum(current['wheel_slip'] - self.threshold, 0.0)
+        return -self.weight * excess.sum(axis=-1)
+
+
+class PerformanceDelta(Term):
+    '''Time gained on the best lap since the previous frame (performance meter).'''
+    signals = ('performance_meter',)
+
+    def __call__(self, current, previous):
+        return -self.weight * (current['performance_meter'] - previous['performance_meter'])
+
+
+class HeadingPenalty(Term):
+    '''Penalty on the sensor mean angle, in units of 90 degrees.'''
+    signals = ('sensor_mean_angle',)
+
+    def __call__(self, current, previous):
+        return -self.weight * np.abs(current['sensor_mean_angle']) / 90
+
+
+class Termination(abc.ABC):
+    '''
+    Ends the episode when `condition` holds for `frames` consecutive frames.
+    '''
+    signals = ()
+
+    def __init__(self, frames=1):
+        self.frames = frames
+
+    @ abc.abstractmethod
+    def condition(self, current, previous):
+        '''Boolean of every frame, from {signal: array} dicts.'''
+
+
+class DamageLimit(Termination):
+    signals = ('damage',)
+
+    def __init__(self, limit=150, frames=1):
+        super().__init__(frames)
+        self.limit = limit
+
+    def condition(self, current, previous):
+        return current['damage'] >= self.limit
+
+
+class DamageJump(Termination):
+    '''Damage rising by more than `threshold` in one frame, a crash.'''
+    signals = ('damage',)
+
+    def __init__(self, threshold=20, frames=1):
+        super().__init__(frames)
+        self.threshold = threshold
+
+    def condition(self, current, previous):
+        return current['damage'] - previous['damage'] > self.threshold
+
+
+class OffTrackLimit(Termination):
+    signals = ('wheels_offtrack',)
+
+    def __init__(self, wheels=4, frames=1):
+        super().__init__(frames)
+        self.wheels = wheels
+
+    def condition(self, current, previous):
+        return current['wheels_offtrack'] >= self.wheels
+
+
+TERMS = {'progress': Progress, 'offtrack': OffTrack, 'damage': DamagePenalty,
+         'slip': SlipPenalty, 'performance': PerformanceDelta,
+         'heading': HeadingPenalty}
+TERMINATIONS = {'damage_limit': DamageLimit, 'damage_jump': DamageJump,
+                'offtrack': OffTrackLimit}
+
+
+def _build(registry, config):
+    built = {}
+    for name, params in config.items():
+        params = dict(params)
+        kind = params.pop('type', name)
+        if kind not in registry:
+            raise ValueError(f'Unknown {name!r} type {kind!r}, one of {sorted(registry)}')
+        built[name] = registry[kind](**params)
+    return built
+
+
+class RewardPipeline:
+    '''
+    Reward terms summed in order and termination conditions OR-ed.
+
+    `step` keeps the previous frame and the termination streaks, `reset`
+    starts a new episode. The first frame of an episode is its own previous
+    frame, so deltas are 0.
+    '''
+
+    def __init__(self, terms, terminations=None):
+        self.terms = dict(terms)
+        self.terminations = dict(terminations or {})
+        self.signals = sorted({signal for part in (*self.terms.values(),
+                                                   *self.terminations.values())
+                               for signal in part.signals})
+        self.components = {}
+        self.reset()
+
+    @ classmethod
+    def from_config(cls, config):
+        '''From {'terms': {name: params}, 'terminations': {name: params}}.'''
+        if isinstance(config, (str, os.PathLike)):
+            with open(config) as f:
+                config = json.load(f)
+        return cls(_build(TERMS, config.get('terms', {})),
+                   _build(TERMINATIONS, config.get('terminations', {})))
+
+    def reset(self):
+        self._previous = None
+        self._streaks = np.zeros(len(self.terminations), dtype=np.int64)
+
+    def _evaluate(self, current, previous, count):
+        reward = np.zeros(count)
+        components = {}
+        for name, term in self.terms.items():
+            value = np.broadcast_to(term(current, previous), (count,))
+            components[name] = value
+            reward += value
+        conditions = [np.broadcast_to(termination.condition(current, previous), (count,))
+                      for termination in self.terminations.values()]
+        return reward, conditions, components
+
+    def step(self, signals):
+        '''
+        One live frame of {signal: scalar or array}, see `live_signals`.
+        Returns (reward, terminated), the terms are in `components`.
+        '''
+        current = {name: _reduce(name, signals[name])[None] for name in self.signals}
+        previous = current if self._previous is None else self._previous
+        reward, conditions, components = self._evaluate(current, previous, 1)
+        self._previous = current
+        terminated = False
+        for i, (condition, termination) in enumerate(zip(conditions, self.terminations.values())):
+            self._streaks[i] = self._streaks[i] + 1 if condition[0] else 0
+            terminated |= bool(self._streaks[i] >= termination.frames)
+        self.components = {name: float(value[0]) for name, value in components.items()}
+        return float(reward[0]), terminated
+
+    def batch(self, signals, starts=None):
+        '''
+        Every frame of a recording, {signal: (N, ...) array}, the same as
+        `step` after a `reset` at frame 0 and wherever `starts` is True.
+
+        Returns {'reward': (N,), 'terminated': (N,), <term name>: (N,)}.
+        '''
+        current = {name: _reduce(name, signals[name]) for name in self.signals}
+        count = len(next(iter(signals.values())))
+        starts = np.zeros(count, dtype=bool) if starts is None else np.asarray(starts, dtype=bool)
+        if count:
+            starts = starts.copy()
+            starts[0] = True
+        previous = {}
+        for name, values in current.items():
+            shifted = np.empty_like(values)
+            shifted[1:] = values[:-1]
+            shifted[starts] = values[starts]
+            previous[name] = shifted
+        reward, conditions, components = self._evaluate(current, previous, count)
+
+        index = np.arange(count)
+        terminated = np.zeros(count, dtype=bool)
+        for condition, termination in zip(conditions, self.terminations.values()):
+            # Streak length: frames since the last False or episode start
+            last = np.where(~condition, index, np.where(starts, index - 1, -1))
+            np.maximum.accumulate(last, out=last)
+            terminated |= index - last >= termination.frames
+        return {'reward': reward, 'terminated': terminated,
+                **{name: np.array(value) for name, value in components.items()}}
+
+
+def default_pipeline(progress_weight=100.0, offtrack_penalty=0.1, damage_weight=0.01,
+                     damage_limit=150):
+    '''The reward `DrivingEnv` has always used.'''
+    return RewardPipeline({'progress': Progress(progress_weight),
+                           'offtrack': OffTrack(offtrack_penalty),
+                           'damage': DamagePenalty(damage_weight)},
+                          {'damage_limit': DamageLimit(damage_limit)})
+
+
+def live_signals(gi, names=SIGNAL_COLUMNS):
+    '''
+    Signals of the current `GetInfo` frame. The sensor mean angle is the
+    one of the last `get_sensors` call.
+    '''
+    getters = {'completion': lambda: gi.track_completion,
+               'wheels_offtrack': lambda: gi.wheels_offtrack,
+               'damage': lambda: gi.car_damage,
+               'wheel_slip': lambda: gi.wheel_slip,
+               'performance_meter': lambda: gi.performance_meter,
+               'speed': lambda: gi.speed,
+               'sensor_mean_angle': lambda: gi.prev_sensor_mean_angle}
+    return {name: getters[name]() for name in names}
+
+
+def load_signals(source, names=SIGNAL_COLUMNS, features=None):
+    '''
+    Signals of a recorder directory or an archive. The sensor mean angle
+    comes from a feature archive (`features.py`) aligned with `source`.
+    '''
+    names = list(names)
+    columns = {name: SIGNAL_COLUMNS[name] for name in names
+               if not SIGNAL_COLUMNS[name].startswith('features.')}
+    if os.path.isdir(source):
+        from archive import column_values
+        from recorder import load_recording
+        frames = load_recording(source, mmap_mode='r')
+        signals = {name: np.asarray(column_values(frames, path))
+                   for name, path in columns.items()}
+    else:
+        from archive import Archive
+        with Archive(source) as archive:
+            data = archive.read(list(columns.values()))
+        signals = {name: data[path] for name, path in columns.items()}
+    if 'sensor_mean_angle' in names:
+        if features is None:
+            raise ValueError('sensor_mean_angle needs a feature archive')
+        from archive import Archive
+        with Archive(features) as archive:
+            path = SIGNAL_COLUMNS['sensor_mean_angle']
+            signals['sensor_mean_angle'] = archive.read([path])[path]
+    return signals
+
+
+if __name__ == '__main__':
+    import time
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('source', help='recorder directory or archive')
+    parser.add_argument('output', help='.npz of rewards, terminations and terms')
+    parser.add_argument('--config', help='JSON pipeline config, default the env reward')
+    parser.add_argument('--features', help='feature archive for sensor_mean_angle')
+    args = parser.parse_args()
+
+    pipeline = RewardPipeline.from_config(args.config) if args.config else default_pipeline()
+    start = time.perf_counter()
+    signals = load_signals(args.source, pipeline.signals, args.features)
+    labels = pipeline.batch(signals)
+    np.savez(args.output, **labels)
+    print(f"Labeled {len(labels['reward'])} frames in "
+          f'{time.perf_counter() - start:.2f} s, {labels["terminated"].sum()} terminal')
@@ -0,0 +1,149 @@
+'''
+Deadline-driven control loop, independent of any UI event loop.
+
+Runs sense -> decide -> act at a fixed rate in its own thread or process,
+optionally aligned to new physics packets::
+
+    loop = ControlLoop(sense, policy, gamepad.apply_input, rate_hz=60)
+    loop.start()
+    ...
+    loop.stop()
+    print(loop.stats())
+'''
+import multiprocessing
+import threading
+import time
+
+from profiling import LatencyTracker
+
+CATCH_UP = 'catch_up'
+DROP = 'drop'
+
+
+class ControlLoop:
+    '''
+    Calls `act(decide(sense()))` every 1/rate_hz seconds.
+
+    align_to_packets: after each deadline, waits (up to one period) for a
+        new physics packetId so every tick sees fresh telemetry
+    overrun_policy: what to do with ticks missed after an overrun,
+        CATCH_UP runs up to `max_catch_up` of them back to back,
+        DROP skips them and realigns to the next deadline
+    spin: last part of the wait (seconds) spent spinning instead of
+        sleeping, for sub-millisecond jitter
+    '''
+
+    def __init__(self, sense, decide, act, rate_hz=60.0, sim_info=None,
+                 align_to_packets=True, overrun_policy=DROP, max_catch_up=3,
+                 spin=0.0005):
+        if overrun_policy not in (CATCH_UP, DROP):
+            raise ValueError(f'Unknown overrun policy: {overrun_policy}')
+        if align_to_packets and sim_info is None:
+            from sim_info import info as sim_info
+        self.sense = sense
+        self.decide = decide
+        self.act = act
+        self.period = 1 / rate_hz
+        self.sim_info = sim_info
+        self.align_to_packets = align_to_packets
+        self.overrun_policy = overrun_policy
+        self.max_catch_up = max_catch_up
+        self.spin = spin
+
+        self.jitter = LatencyTracker(self.period)
+        self.step_time = LatencyTracker(self.period)
+        self.ticks = 0
+        self.dropped = 0
+        self.stale = 0
+        self._packet_id = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sleep_until(self, deadline):
+        remaining = deadline - time.perf_counter()
+        if remaining > self.spin:
+            self._stop.wait(remaining - self.spin)
+        while time.perf_counter() < deadline:
+            pass
+
+    def tick(self):
+        '''One sense -> decide -> act pass, returns its duration.'''
+        start = time.perf_counter()
+        self.act(self.decide(self.sense()))
+        return time.perf_counter() - start
+
+    def run(self, duration=None, ticks=None):
+        '''Runs the loop in the calling thread until stopped or a limit is hit.'''
+        self._stop.clear()
+        start = time.perf_counter()
+        deadline = start
+        if self.align_to_packets:
+            self._packet_id = self.sim_info.physics.packetId
+
+        while not self._stop.is_set():
+            if ticks is not None and self.ticks >= ticks:
+                break
+            if duration is not None and deadline - start >= duration:
+                break
+
+            self._sleep_until(deadline)
+            if self.align_to_packets:
+                packet_id = self.sim_info.wait_for_packet(
+                    self._packet_id, timeout=self.period)
+                if packet_id is None:
+                    self.stale += 1
+                else:
+                    self._packet_id = packet_id
+
+            self.jitter.add(time.perf_counter() - deadline)
+            self.step_time.add(self.tick())
+            self.ticks += 1
+
+            deadline += self.period
+            late = time.perf_counter() - deadline
+            if late > 0:
+                # Deadlines that already passed
+                behind = int(late // self.period) + 1
+                if self.overrun_policy == CATCH_UP:
+                    skipped = max(behind - self.max_catch_up, 0)
+                else:
+                    skipped = behind
+                self.dropped += skipped
+                deadline += skipped * self.period
+
+    def start(self):
+        '''Runs the loop in a daemon thread.'''
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self):
+        '''Tick counts plus jitter and step time percentiles in ms.'''
+        return {'ticks': self.ticks,
+                'dropped': self.dropped,
+                'stale': self.stale,
+                'overruns': self.step_time.overruns,
+                'jitter': self.jitter.percentiles(),
+                'step_time': self.step_time.percentiles()}
+
+
+def _run_loop(factory, duration):
+    factory().run(duration)
+
+
+def start_process(factory, duration=None):
+    '''
+    Runs `factory().run(duration)` in a separate process, so nothing in
+    this process (e.g. rendering) can hold up control. `factory` builds
+    the ControlLoop and has to be picklable, e.g. a module level function.
+    '''
+    process = multiprocessing.Process(
+        target=_run_loop, args=(factory, duration), daemon=True)
+    process.start()
+    return process
@@ -0,0 +1,285 @@
+import functools
+
+import numpy as np
+
+
+@functools.lru_cache(maxsize=64)
+def gauss_weights(n, sigma):
+    '''
+    Gaussian kernel normalized to [0, 1].
+
+    Cached per (n, sigma), the returned array is read-only.
+    '''
+    r = np.arange(-int(n/2), int(n/2)+1, dtype=np.float64)
+    result = 1 / (sigma * np.sqrt(2*np.pi)) * np.exp(-r**2/(2*sigma**2))
+    result = (result - result.min()) / (result.max() - result.min())
+    result.flags.writeable = False
+    return result
+
+
+@functools.lru_cache(maxsize=64)
+def sensor_angles(sensor_count, FOV_degrees):
+    '''
+    Ray angles of a sensor fan, offset by 90 degrees like the heading.
+
+    Cached per (count, FOV), the returned array is read-only.
+    '''
+    FOV_radians = np.radians(FOV_degrees)
+    angles = np.linspace(-FOV_radians/2, FOV_radians/2,
+                         sensor_count) + np.radians(90)
+    angles.flags.writeable = False
+    return angles
+
+
+def track_mask(map_image):
+    '''Boolean on-track mask from the alpha channel of the map image.'''
+    alpha = np.asarray(map_image.convert('RGBA'))[..., 3]
+    return alpha == 255
+
+
+class SensorEngine:
+    '''
+    Computes every sensor of a frame in one NumPy pass.
+
+    Positions are sampled from a precomputed boolean track mask
+    instead of reading pixels one by one. Ray casting needs the signed
+    distance field of the track as well.
+    '''
+
+    def __init__(self, mask, map_data, sdf=None) -> None:
+        self.mask = mask
+        # Plain ndarray views, memmap indexing is much slower
+        self.sdf = None if sdf is None else np.asarray(sdf)
+        self.height, self.width = mask.shape
+        self.x_offset = map_data['x_offset']
+        self.z_offset = map_data['z_offset']
+        self.scale_factor = map_data['scale_factor']
+
+    def on_track(self, x, z):
+        '''Vectorized `is_sensor_on_track`, returns a boolean array.'''
+        xi = np.trunc(np.asarray(x, dtype=np.float64))
+        zi = np.trunc(np.asarray(z, dtype=np.float64))
+        inside = (xi >= 0) & (xi < self.width) & (zi >= 0) & (zi < self.height)
+        result = np.zeros(inside.shape, dtype=bool)
+        result[inside] = self.mask[zi[inside].astype(np.intp),
+                                   xi[inside].astype(np.intp)]
+        return result
+
+    def sensor_layout(self, speed, min_sensor_distance=10, min_sensor_count=5):
+        '''Returns (sensor_distance, sensor_count) for the given speed.'''
+        sensor_distance = max(min_sensor_distance *
+                              speed/100, min_sensor_distance)
+
+        sensor_count = max(
+            int(np.ceil(min_sensor_count * sensor_distance/25) // 2 * 2 + 1), min_sensor_count)
+        return sensor_distance, sensor_count
+
+    def sense(self, coords, heading, sensor_distance, sensor_count, FOV_degrees=90):
+        '''
+        Positions and on-track flags of every sensor.
+
+        Returns (x, z, angles, on_track) arrays.
+        '''
+        angles = sensor_angles(sensor_count, FOV_degrees)
+        reach = sensor_distance * self.scale_factor
+        x = self.x_offset + coords[0] + reach * np.cos(heading + angles)
+        z = self.z_offset + coords[2] + reach * np.sin(heading + angles)
+        return x, z, angles, self.on_track(x, z)
+
+    def mean_angle(self, angles, on_track, sensor_count):
+        '''
+        Gaussian weighted mean angle of the triggered sensors in degrees.
+
+        Returns NaN when there is nothing to average.
+        '''
+        weights = gauss_weights(sensor_count, sensor_count)[:sensor_count]
+        triggered = (angles[on_track] - np.radians(90)) * \
+            weights[on_track] + np.radians(90)
+        # First triggered sensor is skipped, same as the original loop
+        if triggered.size < 2:
+            return float('nan')
+        return float(np.degrees(np.mean(triggered[1:])) - 90)
+
+    def get_sensors(self, coords, heading, speed, min_sensor_distance=10,
+                    min_sensor_count=5, FOV_degrees=90):
+        '''
+        Returns (sensors, triggered_sensors, sensor_mean_angle).
+
+        sensors: [(x, z, angle), ...]
+        triggered_sensors: [sensor_distance, angle, ...]
+        '''
+        sensor_distance, sensor_count = self.sensor_layout(
+            speed, min_sensor_distance, min_sensor_count)
+        x, z, angles, on_track = self.sense(
+            coords, heading, sensor_distance, sensor_count, FOV_degrees)
+
+        angle_list = angles.tolist()
+        sensors = list(zip(x.tolist(), z.tolist(), angle_list))
+        triggered_sensors = [sensor_distance]
+        triggered_sensors.extend(
+            angle for angle, on in zip(angle_list, on_track.tolist()) if on)
+
+        return sensors, triggered_sensors, self.mean_angle(angles, on_track, sensor_count)
+
+    def get_sensors_batch(self, coords, headings, speeds, min_sensor_distance=10,
+                          min_sensor_count=5, FOV_degrees=90, sigma=None):
+        '''
+        `get_sensors` for N poses at once, e.g. a whole recording.
+
+        coords is (N, 3) [x, y, z]. sigma is the Gaussian weighting width,
+        the sensor count like `get_sensors` when None. Returns a dict of
+        arrays: sensor_distance, sensor_count, sensor_mean_angle (NaN when
+        nothing to average) and on_track, (N, max count) padded with False.
+        '''
+        coords = np.asarray(coords, dtype=np.float64)
+        headings = np.asarray(headings, dtype=np.float64)
+        speeds = np.asarray(speeds, dtype=np.float64)
+        sensor_distance = np.maximum(min_sensor_distance * speeds / 100, min_sensor_distance)
+        sensor_count = np.maximum(
+            (np.ceil(min_sensor_count * sensor_distance / 25) // 2 * 2 + 1).astype(np.int64),
+            min_sensor_count)
+
+        max_count = int(sensor_count.max()) if len(speeds) else min_sensor_count
+        on_track = np.zeros((len(speeds), max_count), dtype=bool)
+        mean_angle = np.full(len(speeds), np.nan)
+        # Poses with the same sensor count share angles and weights
+        for count in np.unique(sensor_count).tolist():
+            rows = np.flatnonzero(sensor_count == count)
+            angles = sensor_angles(count, FOV_degrees)
+            reach = sensor_distance[rows, None] * self.scale_factor
+            x = self.x_offset + coords[rows, 0, None] + \
+                reach * np.cos(headings[rows, None] + angles)
+            z = self.z_offset + coords[rows, 2, None] + \
+                reach * np.sin(headings[rows, None] + angles)
+            on = self.on_track(x, z)
+            on_track[rows, :count] = on
+
+            weights = gauss_weights(count, count if sigma is None else sigma)[:count]
+            weighted = (angles - np.radians(90)) * weights + np.radians(90)
+            # First triggered sensor is skipped, same as `mean_angle`
+            used = on & (np.cumsum(on, axis=1) > 1)
+            used_count = used.sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = (used * weighted).sum(axis=1) / used_count
+            mean_angle[rows] = np.where(used_count > 0, np.degrees(mean) - 90, np.nan)
+
+        return {'sensor_distance': sensor_distance,
+                'sensor_count': sensor_count,
+                'sensor_mean_angle': mean_angle,
+                'on_track': on_track}
+
+    def world_to_map(self, x, z):
+        '''World coordinates to map pixels.'''
+        return (self.x_offset + x * self.scale_factor,
+                self.z_offset + z * self.scale_factor)
+
+    def cast(self, coords, heading, ray_count=64, FOV_degrees=180,
+             max_distance=200, max_steps=16, tolerance=0.05, min_step=1.0):
+        '''
+        Sphere traces a fan of rays through the signed distance field.
+
+        Every ray steps by the distance to the nearest edge (at least
+        `min_step` pixels) until it leaves the track or reaches
+        `max_distance`. Rays still going after `max_steps` are sampled
+        every `min_step` pixels instead. The last step is then bisected
+        down to `tolerance` pixels, so hits land on the edge instead of up
+        to a step past it.
+
+        Returns (distances, hit_points), distances are float32 metres and
+        hit_points are float32 [x, z] map pixels.
+        '''
+        if self.sdf is None:
+            raise ValueError('Ray casting needs a signed distance field')
+
+        angles = sensor_angles(ray_count, FOV_degrees)
+        origin_x, origin_z = self.world_to_map(coords[0], coords[2])
+        # Positions are complex x + iz, one array op moves both coordinates
+        origin = complex(origin_x, origin_z)
+        direction = np.exp(1j * (heading + angles))
+        t = np.zeros(ray_count)
+        if 0 <= origin_x < self.width and 0 <= origin_z < self.height:
+            # Rays stop at the map border (its margin is off track anyway),
+            # so positions never need clamping
+            limit = np.minimum(max_distance * self.scale_factor,
+                               np.minimum(self._exit(origin_x, direction.real, self.width),
+                                          self._exit(origin_z, direction.imag, self.height)))
+            t = self._trace(origin, direction, limit, max_steps, tolerance, min_step)
+
+        points = origin + t * direction
+        hit_points = np.stack([points.real, points.imag], axis=-1).astype(np.float32)
+        distances = (t / self.scale_factor).astype(np.float32)
+        return distances, hit_points
+
+    @ staticmethod
+    def _exit(origin, direction, size):
+        '''Ray length to the last position that truncates into [0, size).'''
+        with np.errstate(divide='ignore'):
+            return np.where(direction > 0, (size - 1e-6 - origin) / direction,
+                            np.where(direction < 0, -origin / direction, np.inf))
+
+    def _sample(self, sdf, points):
+        # trunc(z) * width + x truncates to the flat pixel index, as x >= 0
+        index = np.trunc(points.imag)
+        index *= self.width
+        index += points.real
+        return sdf[index.astype(np.intp)]
+
+    def _trace(self, origin, direction, limit, max_steps, tolerance, min_step):
+        '''Ray lengths in pixels, see `cast`.'''
+        sdf = self.sdf.reshape(-1)
+        points = np.full(len(direction), origin)
+        remaining = limit.copy()
+        step = np.empty(len(direction))
+        last_step = np.zeros(len(direction))
+        for _ in range(max_steps):
+            d = self._sample(sdf, points)
+            on = d > 0
+            # Rays that left the track or reached the limit stay put
+            np.maximum(d, min_step, out=step)
+            step *= on
+            np.minimum(step, remaining, out=step)
+            if not step.any():
+                break
+            np.copyto(last_step, step, where=on)
+            remaining -= step
+            points += step * direction
+        else:
+            on = self._sample(sdf, points) > 0
+            self._finish(sdf, points, direction, remaining, last_step, on, min_step)
+        t = limit - remaining
+
+        # Bisect the last step of the rays that hit an edge, [lo on, hi off]
+        rows = np.flatnonzero(~on & (last_step > 0))
+        if rows.size:
+            hi = t[rows]
+            lo = hi - last_step[rows]
+            direction = direction[rows]
+            iterations = int(np.ceil(np.log2(last_step[rows].max() / tolerance)))
+            for _ in range(max(iterations, 0)):
+                middle = 0.5 * (lo + hi)
+                inside = self._sample(sdf, origin + middle * direction) > 0
+                lo = np.where(inside, middle, lo)
+                hi = np.where(inside, hi, middle)
+            t[rows] = hi
+        return t
+
+    def _finish(self, sdf, points, direction, remaining, last_step, on, min_step):
+        '''
+        Rays still going after `max_steps` graze an edge and would creep
+        along it a pixel at a time. They are sampled every `min_step`
+        pixels up to their limit in one go instead, updated in place.
+        '''
+        rows = np.flatnonzero(on & (remaining > 0))
+        if not rows.size:
+            return
+        offsets = np.arange(1, int(np.ceil(remaining[rows].max() / min_step)) + 1) * min_step
+        offsets = np.minimum(offsets, remaining[rows, None])
+        off = self._sample(sdf, points[rows, None] + offsets * direction[rows, None]) <= 0
+        hit = off.any(axis=1)
+        first = off.argmax(axis=1)
+        # Rays without a hit end at their limit, still on track
+        length = np.where(hit, offsets[np.arange(len(rows)), first], remaining[rows])
+        before = np.where(first > 0, offsets[np.arange(len(rows)), first - 1], 0.0)
+        last_step[rows] = np.where(hit, length - before, last_step[rows])
+        remaining[rows] -= length
+        on[rows] = ~hit
@@ -20,6 +20,11 @@ some_app.py::
 
     print(info.graphics.tyreCompound, info.physics.rpms, info.static.playerNick)
 
+Without the game (any OS other than Windows, or when AC_SHM_DIR is set) the
+pages are plain files in AC_SHM_DIR, defaulting to /dev/shm/acpmf.
+telemetry_producer.py writes synthetic or replayed frames into them.
+The pages are only opened on the first use of `info`.
+
 
 Do whatever you want with this code!
 WBR, Rombik :)
@@ -27,8 +32,16 @@ WBR, Rombik :)
 import mmap
 import functools
 import ctypes
+import os
+import sys
+import tempfile
+import time
 from ctypes import c_int32, c_float, c_wchar
 
+import numpy as np
+
+from profiling import count, timed
+
 
 AC_STATUS = c_int32
 AC_OFF = 0
@@ -167,17 +180,194 @@ class SPageFileStatic(ctypes.Structure):
     ]
 
 
+def structure_dtype(structure):
+    '''NumPy dtype with the exact memory layout of a ctypes Structure.'''
+    base_types = {c_int32: '<i4', c_float: '<f4',
+                  c_wchar: f'<u{ctypes.sizeof(c_wchar)}'}
+    names, formats, offsets = [], [], []
+    for name, ctype in structure._fields_:
+        if issubclass(ctype, ctypes.Array):
+            fmt = (base_types[ctype._type_], (ctype._length_,))
+        else:
+            fmt = base_types[ctype]
+        names.append(name)
+        formats.append(fmt)
+        offsets.append(getattr(structure, name).offset)
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                     'itemsize': ctypes.sizeof(structure)})
+
+
+def text_fields(structure):
+    return frozenset(name for name, ctype in structure._fields_
+                     if getattr(ctype, '_type_', None) is c_wchar)
+
+
+PHYSICS_DTYPE = structure_dtype(SPageFilePhysics)
+GRAPHICS_DTYPE = structure_dtype(SPageFileGraphic)
+STATIC_DTYPE = structure_dtype(SPageFileStatic)
+
+_GRAPHICS_TEXT = text_fields(SPageFileGraphic)
+_STATIC_TEXT = text_fields(SPageFileStatic)
+
+_WCHAR_ENCODING = 'utf-16-le' if ctypes.sizeof(c_wchar) == 2 else 'utf-32-le'
+
+
+def decode_text(value):
+    '''wchar array field to str, up to the first null.'''
+    end = np.flatnonzero(value == 0)
+    if end.size:
+        value = value[:end[0]]
+    return value.tobytes().decode(_WCHAR_ENCODING)
+
+
+def encode_text(field, text):
+    '''Writes str into a wchar array field, null terminated.'''
+    encoded = np.frombuffer(text.encode(_WCHAR_ENCODING), dtype=field.dtype)
+    encoded = encoded[:field.size - 1]
+    field[:encoded.size] = encoded
+    field[encoded.size:] = 0
+
+
+class Page:
+    '''
+    Attribute access over one copied page, like the ctypes structures.
+
+    Text fields are decoded to str, numbers to Python scalars and
+    array fields are NumPy arrays. The raw structured array is in `data`.
+    '''
+    __slots__ = ('data', '_record', '_text_fields')
+
+    def __init__(self, data, text_fields=frozenset()):
+        self.data = data
+        self._record = data[0]
+        self._text_fields = text_fields
+
+    def __getattr__(self, name):
+        try:
+            value = self._record[name]
+        except (ValueError, IndexError):
+            raise AttributeError(name) from None
+        if name in self._text_fields:
+            return decode_text(value)
+        if isinstance(value, np.ndarray):
+            return value
+        return value.item()
+
+
+class Snapshot:
+    '''
+    Consistent copy of the physics, graphics and static pages.
+
+    `consistent` is False when every retry saw a torn read.
+    '''
+    __slots__ = ('physics', 'graphics', 'static', 'consistent')
+
+    def __init__(self, physics, graphics, static, consistent=True):
+        self.physics = Page(physics)
+        self.graphics = Page(graphics, _GRAPHICS_TEXT)
+        self.static = Page(static, _STATIC_TEXT)
+        self.consistent = consistent
+
+
+class TaggedMmapBackend:
+    '''Windows named shared memory, as published by Assetto Corsa.'''
+
+    def open(self, name, size):
+        return mmap.mmap(0, size, name)
+
+
+class FileMmapBackend:
+    '''
+    Pages backed by plain files, e.g. in /dev/shm.
+
+    Stands in for the game on Linux, `telemetry_producer` writes the
+    same layouts into these files.
+    '''
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = os.environ.get('AC_SHM_DIR') or default_shm_dir()
+        self.directory = directory
+
+    def open(self, name, size):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, name), 'a+b') as f:
+            if os.fstat(f.fileno()).st_size < size:
+                f.truncate(size)
+            return mmap.mmap(f.fileno(), size)
+
+
+def default_shm_dir():
+    root = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(root, 'acpmf')
+
+
+def default_backend():
+    '''Tagged mmaps on Windows, file-backed pages elsewhere or when AC_SHM_DIR is set.'''
+    if sys.platform == 'win32' and not os.environ.get('AC_SHM_DIR'):
+        return TaggedMmapBackend()
+    return FileMmapBackend()
+
+
 class SimInfo:
-    def __init__(self):
-        self._acpmf_physics = mmap.mmap(
-            0, ctypes.sizeof(SPageFilePhysics), "acpmf_physics")
-        self._acpmf_graphics = mmap.mmap(
-            0, ctypes.sizeof(SPageFileGraphic), "acpmf_graphics")
-        self._acpmf_static = mmap.mmap(
-            0, ctypes.sizeof(SPageFileStatic), "acpmf_static")
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = default_backend()
+        self._acpmf_physics = backend.open(
+            "acpmf_physics", ctypes.sizeof(SPageFilePhysics))
+        self._acpmf_graphics = backend.open(
+            "acpmf_graphics", ctypes.sizeof(SPageFileGraphic))
+        self._acpmf_static = backend.open(
+            "acpmf_static", ctypes.sizeof(SPageFileStatic))
         self.physics = SPageFilePhysics.from_buffer(self._acpmf_physics)
         self.graphics = SPageFileGraphic.from_buffer(self._acpmf_graphics)
         self.static = SPageFileStatic.from_buffer(self._acpmf_static)
+        # Raw byte views, copying bytes is much cheaper than copying
+        # a structured array field by field
+        self._physics_bytes = np.frombuffer(
+            self._acpmf_physics, np.uint8, count=PHYSICS_DTYPE.itemsize)
+        self._graphics_bytes = np.frombuffer(
+            self._acpmf_graphics, np.uint8, count=GRAPHICS_DTYPE.itemsize)
+        self._static_bytes = np.frombuffer(
+            self._acpmf_static, np.uint8, count=STATIC_DTYPE.itemsize)
+
+    @ timed('sim_info.snapshot')
+    def snapshot(self, retries=8):
+        '''
+        Copies every page with one memcpy each.
+
+        A copy counts as torn when `packetId` changed while copying,
+        it is retried up to `retries` times.
+        '''
+        if retries < 1:
+            raise ValueError(f'retries must be at least 1: {retries}')
+        for _ in range(retries):
+            physics_id = self.physics.packetId
+            graphics_id = self.graphics.packetId
+            physics = self._physics_bytes.copy().view(PHYSICS_DTYPE)
+            graphics = self._graphics_bytes.copy().view(GRAPHICS_DTYPE)
+            consistent = physics['packetId'][0] == physics_id == self.physics.packetId and \
+                graphics['packetId'][0] == graphics_id == self.graphics.packetId
+            if consistent:
+                break
+            count('sim_info.torn_reads')
+        static = self._static_bytes.copy().view(STATIC_DTYPE)
+        return Snapshot(physics, graphics, static, consistent)
+
+    def wait_for_packet(self, last_id, timeout=1.0, poll_interval=0.0002):
+        '''
+        Waits until the physics `packetId` differs from `last_id`.
+
+        Returns the new packetId, or None on timeout.
+        '''
+        deadline = time.perf_counter() + timeout
+        while True:
+            packet_id = self.physics.packetId
+            if packet_id != last_id:
+                return packet_id
+            if time.perf_counter() >= deadline:
+                return None
+            time.sleep(poll_interval)
 
     def close(self):
         self._acpmf_physics.close()
@@ -190,12 +380,29 @@ class SimInfo:
         pass
 
 
-info = SimInfo()
+_info = None
+
+
+def get_info():
+    '''The process wide `SimInfo`, opened on first use.'''
+    global _info
+    if _info is None:
+        _info = SimInfo()
+    return _info
+
+
+def __getattr__(name):
+    # `from sim_info import info` keeps working without opening the
+    # shared memory at import time
+    if name == 'info':
+        return get_info()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def demo():
     import time
 
+    info = get_info()
     for _ in range(400):
         print(info.static.track, info.graphics.tyreCompound, info.graphics.currentTime,
               info.physics.rpms, info.graphics.currentTime, info.static.maxRpm, list(info.physics.tyreWear))
@@ -203,6 +410,7 @@ def demo():
 
 
 def do_test():
+    info = get_info()
     for struct in info.static, info.graphics, info.physics:
         print(struct.__class__.__name__)
         for field, type_spec in struct._fields_:  # type: ignore
@@ -0,0 +1,184 @@
+'''
+Writes synthetic or replayed Assetto Corsa telemetry into shared memory.
+
+Meant for running the sensor, minimap and control paths without the game,
+together with the file-backed pages of `sim_info`::
+
+    AC_SHM_DIR=/dev/shm/acpmf python telemetry_producer.py --hz 333
+'''
+import argparse
+import math
+import os
+import time
+
+import numpy as np
+
+from sim_info import (AC_LIVE, GRAPHICS_DTYPE, PHYSICS_DTYPE, STATIC_DTYPE,
+                      SimInfo, encode_text)
+
+
+def _write_page(target, page):
+    '''
+    Copies a page with its `packetId` (offset 0) last, so a reader never
+    sees a new packetId over an old body. It can still see the old
+    packetId over a partly new body, see `TelemetryProducer`.
+    '''
+    data = page.view(np.uint8)
+    size = page.dtype['packetId'].itemsize
+    target[size:] = data[size:]
+    target[:size] = data[:size]
+
+
+class SyntheticLap:
+    '''
+    Car driving around an ellipse in world coordinates at constant speed.
+
+    Heading follows the `GetInfo` convention, the car faces
+    (cos(heading + 90), sin(heading + 90)).
+    '''
+
+    def __init__(self, radius_x=250.0, radius_z=200.0, speed=120.0,
+                 center=(0.0, 0.0)):
+        self.radius_x = radius_x
+        self.radius_z = radius_z
+        self.speed = speed
+        self.center = center
+        # Ramanujan's approximation of the perimeter
+        a, b = radius_x, radius_z
+        self.length = math.pi * (3*(a + b) - math.sqrt((3*a + b)*(a + 3*b)))
+
+    def fill(self, physics, graphics, t):
+        '''Writes the state at `t` seconds into the page records.'''
+        travelled = self.speed / 3.6 * t
+        laps, position = divmod(travelled / self.length, 1.0)
+        angle = 2 * math.pi * position
+        x = self.center[0] + self.radius_x * math.cos(angle)
+        z = self.center[1] + self.radius_z * math.sin(angle)
+        dx = -self.radius_x * math.sin(angle)
+        dz = self.radius_z * math.cos(angle)
+        norm = math.hypot(dx, dz)
+        velocity = self.speed / 3.6
+
+        physics['speedKmh'] = self.speed
+        physics['gas'] = 0.6
+        physics['gear'] = 3
+        physics['rpms'] = 5000
+        physics['heading'] = math.atan2(-dx, dz)
+        physics['velocity'] = (velocity * dx / norm, 0.0, velocity * dz / norm)
+        physics['accG'] = (velocity**2 * self.radius_x * self.radius_z /
+                           norm**3 / 9.81, 0.0, 0.0)
+        physics['wheelSlip'] = 0.1
+
+        graphics['status'] = AC_LIVE
+        graphics['completedLaps'] = int(laps)
+        graphics['iCurrentTime'] = int(position * self.length / velocity * 1000)
+        graphics['normalizedCarPosition'] = position
+        graphics['carCoordinates'] = (x, 0.0, z)
+        graphics['distanceTraveled'] = travelled
+
+
+class TelemetryProducer:
+    '''
+    Publishes frames at a fixed rate, bumping `packetId` every frame.
+
+    Every page is staged in private memory and published with the body
+    first and packetId last, like `_write_page`. Torn reads are not
+    prevented: a `SimInfo.snapshot` whose copy falls entirely inside a
+    body write sees the same old packetId before and after it and takes
+    a half new page as consistent. The window is one page copy, a few
+    microseconds per frame.
+    '''
+
+    def __init__(self, sim_info, hz=333.0):
+        self.sim_info = sim_info
+        self.hz = hz
+        self.packet_id = int(sim_info.physics.packetId)
+        self.physics = np.zeros(1, PHYSICS_DTYPE)
+        self.graphics = np.zeros(1, GRAPHICS_DTYPE)
+        self.static = np.zeros(1, STATIC_DTYPE)
+
+    def set_static(self, track, layout='', car='synthetic_car'):
+        static = self.static[0]
+        encode_text(static['track'], track)
+        encode_text(static['trackConfiguration'], layout)
+        encode_text(static['carModel'], car)
+        static['sectorCount'] = 3
+        self.sim_info._static_bytes[:] = self.static.view(np.uint8)
+
+    def publish(self):
+        '''Publishes the staged physics and graphics pages as a new packet.'''
+        self.packet_id += 1
+        self.physics['packetId'] = self.packet_id
+        self.graphics['packetId'] = self.packet_id
+        _write_page(self.sim_info._physics_bytes, self.physics)
+        _write_page(self.sim_info._graphics_bytes, self.graphics)
+
+    def _run(self, fill, count=None, duration=None):
+        period = 1 / self.hz
+        start = time.perf_counter()
+        deadline = start
+        frame = 0
+        while count is None or frame < count:
+            now = time.perf_counter()
+            if duration is not None and now - start >= duration:
+                break
+            fill(frame, now - start)
+            self.publish()
+            frame += 1
+
+            deadline += period
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Behind schedule, don't try to catch up in a burst
+                deadline = time.perf_counter()
+        return frame
+
+    def run_synthetic(self, lap, duration=None, count=None):
+        '''Publishes `lap` states on the simulated clock, returns the frame count.'''
+        def fill(frame, elapsed):
+            lap.fill(self.physics[0], self.graphics[0], frame / self.hz)
+        return self._run(fill, count, duration)
+
+    def replay(self, physics, graphics, loop=False, duration=None):
+        '''
+        Publishes recorded pages, PHYSICS_DTYPE and GRAPHICS_DTYPE arrays.
+
+        Packet ids are renumbered so they keep increasing across loops.
+        '''
+        frames = len(physics)
+
+        def fill(frame, elapsed):
+            self.physics[0] = physics[frame % frames]
+            self.graphics[0] = graphics[frame % frames]
+        return self._run(fill, None if loop else frames, duration)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--hz', type=float, default=333.0)
+    parser.add_argument('--duration', type=float, default=None)
+    parser.add_argument('--track', default='synthetic')
+    parser.add_argument('--layout', default='')
+    parser.add_argument('--speed', type=float, default=120.0, help='km/h')
+    parser.add_argument('--radius', type=float, nargs=2, default=(250.0, 200.0),
+                        metavar=('X', 'Z'), help='ellipse radii in metres')
+    parser.add_argument('--replay', help='recorder directory or .npz with physics and graphics arrays')
+    parser.add_argument('--loop', action='store_true')
+    args = parser.parse_args()
+
+    producer = TelemetryProducer(SimInfo(), args.hz)
+    producer.set_static(args.track, args.layout)
+    if args.replay:
+        if os.path.isdir(args.replay):
+            from recorder import load_recording
+            recording = load_recording(args.replay)
+        else:
+            recording = np.load(args.replay)
+        frames = producer.replay(recording['physics'], recording['graphics'],
+                                 args.loop, args.duration)
+    else:
+        frames = producer.run_synthetic(
+            SyntheticLap(*args.radius, speed=args.speed), args.duration)
+    print(f'Published {frames} frames')
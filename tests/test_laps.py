@@ -0,0 +1,65 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from laps import best_lap_index, delta_to_best, lap_curves, segment  # noqa: E402
+
+
+def drive(laps_delay=0, frames_per_lap=100, laps=2.5, start=0.03):
+    '''
+    Positions of `laps` laps from `start`, completedLaps going up
+    `laps_delay` frames after the position wraps (negative: before).
+    '''
+    frames = int(laps * frames_per_lap)
+    position = (start + np.arange(frames) / frames_per_lap) % 1.0
+    crossings = np.flatnonzero(np.diff(position) < 0) + 1
+    completed = np.zeros(frames, dtype=np.int64)
+    for crossing in crossings:
+        completed[crossing + laps_delay:] += 1
+    return np.arange(frames) * 0.01, position, completed
+
+
+def lap_rows(segmenter):
+    return [(lap.number, lap.start, lap.stop, lap.complete) for lap in segmenter.laps]
+
+
+def test_laps_counted_before_wrap():
+    time, position, completed = drive(laps_delay=-3)
+    segmenter = segment(time, position, completed)
+    assert lap_rows(segmenter) == [(0, 0, 94, False), (1, 94, 194, True)]
+    assert segmenter.current.number == 2
+
+
+def test_laps_counted_after_wrap():
+    time, position, completed = drive(laps_delay=3)
+    segmenter = segment(time, position, completed)
+    assert lap_rows(segmenter) == [(0, 0, 97, False), (1, 97, 197, True)]
+    assert segmenter.current.number == 2
+
+
+def test_best_lap_is_a_full_lap():
+    time, position, completed = drive(laps_delay=-3, laps=4.5)
+    segmenter = segment(time, position, completed)
+    best = segmenter.laps[best_lap_index(segmenter.laps)]
+    assert best.stop - best.start == 100
+
+
+def test_backwards_crossing_is_taken_back():
+    position = np.array([0.95, 0.98, 0.01, 0.02, 0.99, 0.97, 0.99, 0.02, 0.2])
+    completed = np.array([0, 0, 1, 1, 1, 1, 1, 1, 1])
+    segmenter = segment(np.arange(9) * 0.01, position, completed)
+    assert [lap.number for lap in segmenter.laps] == [0, 1, 0]
+    assert segmenter.current.number == 1
+
+
+def test_identical_laps_have_zero_delta():
+    time, position, completed = drive(laps_delay=3, laps=4.5)
+    laps = segment(time, position, completed).laps
+    complete = np.array([lap.complete for lap in laps])
+    grid, curves = lap_curves(laps)
+    assert grid[-1] == 1.0
+    np.testing.assert_allclose(curves[complete, -1], [lap.time for lap in laps if lap.complete])
+    np.testing.assert_allclose(delta_to_best(laps)[complete], 0.0, atol=1e-9)
@@ -0,0 +1,249 @@
+import configparser
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+from PIL import Image
+
+from sensors import track_mask
+
+CACHE_DIR = os.environ.get(
+    'RL_DRIVER_CACHE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'track_cache'))
+
+_FAR = 1e20
+_loaded = {}
+
+
+def read_map_config(path):
+    config = configparser.ConfigParser()
+
+    # Read the .ini file
+    config.read(path)
+    parameters = {}
+    if 'PARAMETERS' in config:
+        for key in config['PARAMETERS']:
+            value = config.get('PARAMETERS', key)
+            if value.isdigit():
+                parameters[key] = int(value)
+            elif value.replace('.', '', 1).isdigit():
+                parameters[key] = float(value)
+            else:
+                parameters[key] = value
+
+    return parameters
+
+
+def _edt_1d(f):
+    '''
+    Squared 1D distance transform of every row of `f` at once.
+
+    Lower envelope of parabolas (Felzenszwalb & Huttenlocher),
+    vectorized across rows and looped along the columns.
+    '''
+    m, n = f.shape
+    rows = np.arange(m)
+    q_all = np.arange(n, dtype=np.float64)
+    v = np.zeros((m, n), dtype=np.intp)
+    z = np.empty((m, n + 1), dtype=np.float64)
+    z[:, 0] = -np.inf
+    z[:, 1] = np.inf
+    k = np.zeros(m, dtype=np.intp)
+    fq2 = f + q_all**2
+
+    for q in range(1, n):
+        active = rows
+        k_act = k
+        while True:
+            vk = v[active, k_act]
+            s = (fq2[active, q] - fq2[active, vk]) / (2 * (q - vk))
+            pop = s <= z[active, k_act]
+            if not pop.any():
+                break
+            k[active[pop]] -= 1
+            active = active[pop]
+            k_act = k[active]
+        k += 1
+        v[rows, k] = q
+        vk = v[rows, k - 1]
+        z[rows, k] = (fq2[rows, q] - fq2[rows, vk]) / (2 * (q - vk))
+        z[rows, k + 1] = np.inf
+
+    d = np.empty_like(f)
+    k[:] = 0
+    for q in range(n):
+        while True:
+            step = z[rows, k + 1] < q
+            if not step.any():
+                break
+            k[step] += 1
+        vk = v[rows, k]
+        d[:, q] = (q - vk)**2 + f[rows, vk]
+    return d
+
+
+def distance_transform(features):
+    '''Euclidean distance of every pixel to the nearest True pixel of `features`.'''
+    if not features.any():
+        return np.full(features.shape, np.inf)
+    f = np.where(features, 0.0, _FAR)
+    d = _edt_1d(f.T).T
+    d = _edt_1d(d)
+    return np.sqrt(d)
+
+
+def signed_distance(mask):
+    '''
+    Signed distance to the track edge in pixels.
+
+    Positive on track, negative off track, the edge sits at 0.
+    '''
+    inside = distance_transform(~mask) - 0.5
+    outside = distance_transform(mask) - 0.5
+    limit = float(sum(mask.shape))
+    sdf = np.where(mask, np.minimum(inside, limit), -np.minimum(outside, limit))
+    return sdf.astype(np.float32)
+
+
+def edge_normals(sdf):
+    '''
+    Unit gradient of the signed distance field as [nx, nz].
+
+    Points away from the nearest edge, into the track.
+    '''
+    gz, gx = np.gradient(sdf.astype(np.float64))
+    norm = np.hypot(gx, gz)
+    norm[norm == 0] = 1
+    return np.stack([gx / norm, gz / norm], axis=-1).astype(np.float32)
+
+
+def cache_key(track, layout, mtime_ns):
+    name = f'{track}__{layout}' if layout else track
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+    return f'{name}_{mtime_ns}'
+
+
+class TrackGeometry:
+    '''
+    Precomputed geometry of one track layout.
+
+    Arrays are in map pixels, [z, x] indexed like the map image.
+    Loaded arrays are read-only memory maps.
+    '''
+
+    def __init__(self, map_data, packed_mask, sdf, normals, map_path=None,
+                 cache_path=None) -> None:
+        self.map_data = map_data
+        self.packed_mask = packed_mask
+        self.sdf = sdf
+        self.normals = normals
+        self.map_path = map_path
+        self.cache_path = cache_path
+        self.height, self.width = sdf.shape
+        self._mask = None
+
+    @ property
+    def mask(self):
+        '''Boolean on-track mask, unpacked on first use.'''
+        if self._mask is None:
+            self._mask = np.unpackbits(
+                self.packed_mask, axis=1, count=self.width).view(bool)
+        return self._mask
+
+    @ property
+    def scale_factor(self):
+        return self.map_data['scale_factor']
+
+    def _index(self, x, z):
+        xi = np.clip(np.asarray(x, dtype=np.float64).astype(np.intp), 0, self.width - 1)
+        zi = np.clip(np.asarray(z, dtype=np.float64).astype(np.intp), 0, self.height - 1)
+        return zi, xi
+
+    def distance_to_edge(self, x, z):
+        '''
+        Signed distance to the track edge in metres at map pixel (x, z).
+
+        Positive on track, negative off track.
+        '''
+        zi, xi = self._index(x, z)
+        return self.sdf[zi, xi] / self.scale_factor
+
+    def edge_normal(self, x, z):
+        '''Unit [nx, nz] pointing away from the nearest edge at map pixel (x, z).'''
+        zi, xi = self._index(x, z)
+        return self.normals[zi, xi]
+
+    @ classmethod
+    def from_image(cls, map_image, map_data, map_path=None):
+        mask = track_mask(map_image)
+        sdf = signed_distance(mask)
+        return cls(map_data, np.packbits(mask, axis=1), sdf,
+                   edge_normals(sdf), map_path)
+
+    def save(self, path):
+        '''Writes the arrays as .npy files into directory `path`.'''
+        tmp_path = f'{path}.tmp{os.getpid()}'
+        os.makedirs(tmp_path, exist_ok=True)
+        np.save(os.path.join(tmp_path, 'mask.npy'), self.packed_mask)
+        np.save(os.path.join(tmp_path, 'sdf.npy'), self.sdf)
+        np.save(os.path.join(tmp_path, 'normals.npy'), self.normals)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({'map_data': self.map_data,
+                       'shape': [self.height, self.width]}, f)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # Another process finished first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    @ classmethod
+    def open(cls, path, map_path=None):
+        '''Opens a saved geometry with zero-copy memory maps.'''
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        return cls(meta['map_data'],
+                   np.load(os.path.join(path, 'mask.npy'), mmap_mode='r'),
+                   np.load(os.path.join(path, 'sdf.npy'), mmap_mode='r'),
+                   np.load(os.path.join(path, 'normals.npy'), mmap_mode='r'),
+                   map_path, path)
+
+
+def source_mtime(map_path, map_data_path):
+    mtime = os.stat(map_path).st_mtime_ns
+    if os.path.exists(map_data_path):
+        mtime = max(mtime, os.stat(map_data_path).st_mtime_ns)
+    return mtime
+
+
+def load_track(map_path, map_data_path, track, layout='', cache_dir=None):
+    '''
+    Geometry of a track layout, computed once and cached on disk.
+
+    Entries are keyed by track, layout and source mtime, stale ones
+    are removed. Repeated calls in the same process are free.
+    '''
+    cache_dir = cache_dir or CACHE_DIR
+    key = cache_key(track, layout, source_mtime(map_path, map_data_path))
+    path = os.path.join(cache_dir, key)
+
+    memo_key = (os.path.abspath(path), map_path)
+    if memo_key in _loaded:
+        return _loaded[memo_key]
+
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        map_data = read_map_config(map_data_path)
+        with Image.open(map_path) as map_image:
+            geometry = TrackGeometry.from_image(map_image, map_data, map_path)
+        os.makedirs(cache_dir, exist_ok=True)
+        prefix = key.rsplit('_', 1)[0] + '_'
+        for entry in os.listdir(cache_dir):
+            stale = entry != key and entry.startswith(prefix) and \
+                entry[len(prefix):].isdigit()
+            if stale:
+                shutil.rmtree(os.path.join(cache_dir, entry), ignore_errors=True)
+        geometry.save(path)
+
+    geometry = TrackGeometry.open(path, map_path)
+    _loaded[memo_key] = geometry
+    return geometry